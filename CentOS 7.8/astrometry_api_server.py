@@ -3,15 +3,21 @@
 Astrometry.net API服务器
 在CentOS 7.8上运行，提供HTTP API接口
 """
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
 import subprocess
 import os
 import tempfile
 import shutil
 import time
-from threading import Thread
+from collections import OrderedDict, deque
+from threading import Condition, Lock, Thread
+import hashlib
 import json
+import math
+import urllib.error
+import urllib.request
+import uuid
 
 app = Flask(__name__)
 CORS(app)
@@ -21,6 +27,31 @@ ASTROMETRY_BIN = '/usr/local/astrometry/bin/solve-field'
 UPLOAD_FOLDER = '/tmp/astrometry_uploads'
 RESULTS_FOLDER = '/tmp/astrometry_results'
 JOBS = {}  # 存储任务状态
+# 任务状态变化时唤醒长轮询与SSE连接；EVENTS 保存最近的状态变化事件（序号, 事件）
+JOBS_COND = Condition()
+EVENTS = deque(maxlen=1000)
+EVENT_SEQ = [0]
+# 长轮询最长等待时间（秒）与SSE心跳间隔
+MAX_WAIT = 60
+KEEPALIVE_INTERVAL = 15
+# 完成回调的最多尝试次数与单次超时（秒）
+CALLBACK_ATTEMPTS = 3
+CALLBACK_TIMEOUT = 10
+# 随解析结果返回的WCS头字段（TAN投影；solve-field 输出的 .wcs 文件用 IMAGEW/IMAGEH 记录图片尺寸）
+WCS_KEYS = ('CTYPE1', 'CTYPE2', 'CRVAL1', 'CRVAL2', 'CRPIX1', 'CRPIX2',
+            'CD1_1', 'CD1_2', 'CD2_1', 'CD2_2', 'IMAGEW', 'IMAGEH')
+# 上传时可附带的解析提示（scale_* 单位角秒/像素，ra/dec/radius 单位度）
+HINT_FIELDS = ('scale_low', 'scale_high', 'ra', 'dec', 'radius', 'downsample')
+# 未指定 downsample 时，把长边缩小到不超过该像素数再提取星点（0 表示不自动缩小）
+DOWNSAMPLE_TARGET = int(os.getenv('ASTROMETRY_DOWNSAMPLE_TARGET', 2048))
+FITS_EXTENSIONS = ('fits', 'fit', 'fts')
+# 解析结果缓存：只缓存解析成功的 calibration（含WCS），按图片内容SHA-256（提示只缩小搜索范围，解出的WCS相同）；
+# 超过条目数时淘汰最久未命中的
+SOLVE_CACHE = OrderedDict()   # 内容哈希 -> (过期时间, calibration)
+SOLVE_CACHE_LOCK = Lock()
+SOLVE_CACHE_STATS = {'hits': 0, 'misses': 0, 'evictions': 0}
+CACHE_MAX_ENTRIES = int(os.getenv('ASTROMETRY_CACHE_MAX_ENTRIES', 10000))
+CACHE_TTL = int(os.getenv('ASTROMETRY_CACHE_TTL', 30 * 24 * 3600))
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
@@ -36,27 +67,57 @@ def upload():
         if file.filename == '':
             return jsonify({'error': '文件名为空'}), 400
         
-        # 保存文件
+        hints = {}
+        for key in HINT_FIELDS:
+            value = request.form.get(key)
+            if value:
+                try:
+                    hints[key] = float(value)
+                except ValueError:
+                    return jsonify({'error': f'{key} 不是有效数字'}), 400
+        
+        # 生成任务ID（毫秒时间戳 + 随机后缀，同一毫秒内的并发上传不会冲突）
+        job_id = f"{int(time.time() * 1000)}{uuid.uuid4().hex[:6]}"
+        
+        # 保存文件（加任务ID前缀，同名文件互不覆盖）
         filename = file.filename
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
+        filepath = os.path.join(UPLOAD_FOLDER, f"{job_id}_{os.path.basename(filename)}")
         file.save(filepath)
         
-        # 生成任务ID
-        job_id = str(int(time.time() * 1000))
+        # 同一张图片解析过时直接返回缓存的结果，不再运行 solve-field（表单字段 cache=0 时跳过查找，结果仍写入缓存）
+        image_hash = file_sha256(filepath)
+        calibration = cache_lookup(image_hash) if request.form.get('cache') != '0' else None
+        if calibration is not None:
+            os.remove(filepath)
+            update_job(job_id, {
+                'status': 'success',
+                'filename': filename,
+                'start_time': time.time(),
+                'solve_time': 0.0,
+                'calibration': calibration,
+                'cached': True
+            }, callback_url=request.form.get('callback_url') or None)
+            return jsonify({
+                'job_id': job_id,
+                'status': 'success',
+                'cached': True,
+                'message': '命中解析缓存'
+            }), 200
         
         # 创建结果目录
         job_dir = os.path.join(RESULTS_FOLDER, job_id)
         os.makedirs(job_dir, exist_ok=True)
         
-        # 初始化任务状态
-        JOBS[job_id] = {
+        # 初始化任务状态；callback_url 为可选的完成回调地址，解析结束后POST任务结果
+        update_job(job_id, {
             'status': 'processing',
             'filename': filename,
-            'start_time': time.time()
-        }
+            'start_time': time.time(),
+            'hints': hints
+        }, callback_url=request.form.get('callback_url') or None)
         
         # 在后台运行解析
-        thread = Thread(target=solve_field, args=(job_id, filepath, job_dir))
+        thread = Thread(target=solve_field, args=(job_id, filepath, job_dir, hints, image_hash))
         thread.start()
         
         return jsonify({
@@ -68,8 +129,135 @@ def upload():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def solve_field(job_id, filepath, output_dir):
-    """执行solve-field命令"""
+def job_event(job_id, job):
+    """状态变化事件：任务状态与结果，不含内部字段"""
+    event = {key: value for key, value in job.items() if key != 'callback_url'}
+    event['job_id'] = job_id
+    return event
+
+def update_job(job_id, job, callback_url=None):
+    """
+    更新任务状态：递增版本号，记录事件并唤醒等待中的长轮询与SSE连接；
+    任务结束且有回调地址时在后台POST任务结果
+    """
+    with JOBS_COND:
+        previous = JOBS.get(job_id, {})
+        job['version'] = previous.get('version', 0) + 1
+        job['callback_url'] = callback_url or previous.get('callback_url')
+        JOBS[job_id] = job
+        EVENT_SEQ[0] += 1
+        EVENTS.append((EVENT_SEQ[0], job_event(job_id, job)))
+        JOBS_COND.notify_all()
+    
+    if job['status'] != 'processing' and job['callback_url']:
+        Thread(target=post_callback, args=(job['callback_url'], job_event(job_id, job)), daemon=True).start()
+
+def post_callback(url, event):
+    """POST任务结果到回调地址，失败时按1、2秒退避重试"""
+    body = json.dumps(event, ensure_ascii=False).encode('utf-8')
+    for attempt in range(CALLBACK_ATTEMPTS):
+        try:
+            req = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'}, method='POST')
+            with urllib.request.urlopen(req, timeout=CALLBACK_TIMEOUT) as response:
+                if response.status < 500:
+                    return
+        except urllib.error.HTTPError as e:
+            if e.code < 500:
+                print(f"回调被拒绝（任务 {event['job_id']}）: {e.code}")
+                return
+        except Exception as e:
+            print(f"回调失败（任务 {event['job_id']}，第 {attempt + 1} 次）: {e}")
+        if attempt + 1 < CALLBACK_ATTEMPTS:
+            time.sleep(2 ** attempt)
+
+def file_sha256(filepath):
+    """文件内容的SHA-256"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_lookup(image_hash):
+    """查找缓存的解析结果（calibration），未命中返回None"""
+    now = time.time()
+    with SOLVE_CACHE_LOCK:
+        entry = SOLVE_CACHE.get(image_hash)
+        if entry is not None and entry[0] < now:
+            del SOLVE_CACHE[image_hash]
+            entry = None
+        if entry is None:
+            SOLVE_CACHE_STATS['misses'] += 1
+            return None
+        SOLVE_CACHE.move_to_end(image_hash)
+        SOLVE_CACHE_STATS['hits'] += 1
+        return entry[1]
+
+def cache_store(image_hash, calibration):
+    """缓存解析成功的结果；失败不缓存（可能是提示有误，换一组提示或不带提示可能解出）"""
+    if CACHE_TTL <= 0 or CACHE_MAX_ENTRIES <= 0:
+        return
+    with SOLVE_CACHE_LOCK:
+        SOLVE_CACHE[image_hash] = (time.time() + CACHE_TTL, calibration)
+        SOLVE_CACHE.move_to_end(image_hash)
+        while len(SOLVE_CACHE) > CACHE_MAX_ENTRIES:
+            SOLVE_CACHE.popitem(last=False)
+            SOLVE_CACHE_STATS['evictions'] += 1
+
+def cache_stats():
+    """解析缓存的命中率与条目数"""
+    with SOLVE_CACHE_LOCK:
+        hits, misses = SOLVE_CACHE_STATS['hits'], SOLVE_CACHE_STATS['misses']
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0,
+            'evictions': SOLVE_CACHE_STATS['evictions'],
+            'entries': len(SOLVE_CACHE),
+            'max_entries': CACHE_MAX_ENTRIES
+        }
+
+def image_size(filepath):
+    """图片尺寸 (宽, 高)，读取失败返回None"""
+    try:
+        if filepath.rsplit('.', 1)[-1].lower() in FITS_EXTENSIONS:
+            from astropy.io import fits
+            with fits.open(filepath) as hdul:
+                for hdu in hdul:
+                    if hdu.header.get('NAXIS', 0) >= 2:
+                        return int(hdu.header['NAXIS1']), int(hdu.header['NAXIS2'])
+            return None
+        from PIL import Image
+        with Image.open(filepath) as img:
+            return img.size
+    except Exception:
+        return None
+
+def hint_args(filepath, hints):
+    """
+    解析提示对应的 solve-field 参数：
+    像素比例范围限定索引的尺度，大致指向把全天搜索缩小到一个圆内，
+    大图先缩小再提取星点（星点数够用，提取与匹配更快）
+    """
+    args = []
+    if 'scale_low' in hints and 'scale_high' in hints:
+        args += ['--scale-units', 'arcsecperpix',
+                 '--scale-low', str(hints['scale_low']), '--scale-high', str(hints['scale_high'])]
+    if 'ra' in hints and 'dec' in hints:
+        args += ['--ra', str(hints['ra']), '--dec', str(hints['dec']), '--radius', str(hints.get('radius', 5))]
+    
+    downsample = int(hints.get('downsample') or 0)
+    if not downsample and DOWNSAMPLE_TARGET > 0:
+        size = image_size(filepath)
+        if size:
+            downsample = math.ceil(max(size) / DOWNSAMPLE_TARGET)
+    if downsample > 1:
+        args += ['--downsample', str(downsample)]
+    return args
+
+def solve_field(job_id, filepath, output_dir, hints=None, image_hash=None):
+    """执行solve-field命令；解析成功的结果写入解析缓存"""
+    hints = hints or {}
     try:
         # 构建命令
         cmd = [
@@ -80,7 +268,7 @@ def solve_field(job_id, filepath, output_dir):
             '--no-plots',
             '--no-verify',
             '--cpulimit', '300'  # 5分钟超时
-        ]
+        ] + hint_args(filepath, hints)
         
         # 执行命令
         result = subprocess.run(
@@ -96,35 +284,37 @@ def solve_field(job_id, filepath, output_dir):
             # 解析成功，读取WCS信息
             wcs_info = parse_wcs_file(output_file)
             
-            JOBS[job_id] = {
+            update_job(job_id, {
                 'status': 'success',
                 'filename': JOBS[job_id]['filename'],
                 'start_time': JOBS[job_id]['start_time'],
                 'solve_time': time.time() - JOBS[job_id]['start_time'],
                 'calibration': wcs_info
-            }
+            })
+            if image_hash and 'error' not in wcs_info:
+                cache_store(image_hash, wcs_info)
         else:
-            JOBS[job_id] = {
+            update_job(job_id, {
                 'status': 'failure',
                 'filename': JOBS[job_id]['filename'],
                 'start_time': JOBS[job_id]['start_time'],
                 'error': result.stderr
-            }
+            })
             
     except subprocess.TimeoutExpired:
-        JOBS[job_id] = {
+        update_job(job_id, {
             'status': 'failure',
             'filename': JOBS[job_id]['filename'],
             'start_time': JOBS[job_id]['start_time'],
             'error': '解析超时'
-        }
+        })
     except Exception as e:
-        JOBS[job_id] = {
+        update_job(job_id, {
             'status': 'failure',
             'filename': JOBS[job_id]['filename'],
             'start_time': JOBS[job_id]['start_time'],
             'error': str(e)
-        }
+        })
 
 def parse_wcs_file(wcs_file):
     """解析WCS文件，提取坐标信息"""
@@ -156,12 +346,17 @@ def parse_wcs_file(wcs_file):
             # 获取方向角
             orientation = float(hdul[0].header.get('CROTA2', 0))
             
+            # 原样返回投影参数，后端据此把天球坐标换算到图片像素（星座轮廓、连线）
+            header = hdul[0].header
+            wcs_header = {key: header[key] for key in WCS_KEYS if key in header}
+            
             return {
                 'ra': ra,
                 'dec': dec,
                 'field_width': ra_range,
                 'field_height': dec_range,
-                'orientation': orientation
+                'orientation': orientation,
+                'wcs': wcs_header
             }
     except Exception as e:
         return {
@@ -175,11 +370,86 @@ def parse_wcs_file(wcs_file):
 
 @app.route('/jobs/<job_id>', methods=['GET'])
 def get_job_status(job_id):
-    """获取任务状态"""
-    if job_id not in JOBS:
-        return jsonify({'error': '任务不存在'}), 404
+    """
+    获取任务状态
+
+    长轮询：?wait=N 时最多等待N秒（不超过 MAX_WAIT），直到任务状态变化后返回；
+    ?since=版本号 时等待版本号大于它的状态，不传时等待任务结束（状态不再是 processing）
+    """
+    wait = min(request.args.get('wait', 0, type=float), MAX_WAIT)
+    since = request.args.get('since', type=int)
     
-    return jsonify(JOBS[job_id]), 200
+    with JOBS_COND:
+        if job_id not in JOBS:
+            return jsonify({'error': '任务不存在'}), 404
+        
+        if wait > 0:
+            if since is None:
+                changed = lambda: JOBS[job_id]['status'] != 'processing'
+            else:
+                changed = lambda: JOBS[job_id]['version'] > since
+            JOBS_COND.wait_for(changed, wait)
+        
+        return jsonify(job_event(job_id, JOBS[job_id])), 200
+
+def format_event(seq, event):
+    return f"id: {seq}\nevent: {event['status']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+def event_stream(last_seq, job_id=None, current=None):
+    """
+    SSE事件流：先补发 last_seq 之后的事件，再推送新的状态变化（id 为事件序号，可用 Last-Event-ID 续传）；
+    只订阅单个任务时先推送其当前状态 current，该任务结束后关闭
+    """
+    if current is not None:
+        yield format_event(last_seq, current)
+        if current['status'] != 'processing':
+            return
+    while True:
+        with JOBS_COND:
+            JOBS_COND.wait_for(lambda: EVENT_SEQ[0] > last_seq, KEEPALIVE_INTERVAL)
+            pending = [(seq, event) for seq, event in EVENTS
+                       if seq > last_seq and (job_id is None or event['job_id'] == job_id)]
+            last_seq = EVENT_SEQ[0]
+        
+        if not pending:
+            yield ": keep-alive\n\n"
+        for seq, event in pending:
+            yield format_event(seq, event)
+            if job_id is not None and event['status'] != 'processing':
+                return
+
+def sse_response(last_seq, job_id=None, current=None):
+    return Response(
+        stream_with_context(event_stream(last_seq, job_id, current)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/events', methods=['GET'])
+def events():
+    """
+    所有任务的状态变化（SSE）
+
+    断线重连时用 Last-Event-ID 请求头或 ?since=序号 补发错过的事件（最多保留最近1000个）；
+    都不传时只推送连接之后的事件
+    """
+    last_seq = request.headers.get('Last-Event-ID', type=int)
+    if last_seq is None:
+        last_seq = request.args.get('since', type=int)
+    if last_seq is None or last_seq > EVENT_SEQ[0]:
+        # 服务重启后序号从0开始，客户端带来的旧序号无效
+        last_seq = EVENT_SEQ[0]
+    return sse_response(last_seq)
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """单个任务的状态变化（SSE）：先推送当前状态，任务结束后关闭"""
+    with JOBS_COND:
+        if job_id not in JOBS:
+            return jsonify({'error': '任务不存在'}), 404
+        current = job_event(job_id, JOBS[job_id])
+        last_seq = EVENT_SEQ[0]
+    return sse_response(last_seq, job_id, current)
 
 @app.route('/jobs/<job_id>/info', methods=['GET'])
 def get_job_info(job_id):
@@ -206,6 +476,18 @@ def get_job_info(job_id):
             'message': '任务处理中'
         }), 200
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    """任务数与解析缓存统计"""
+    with JOBS_COND:
+        processing = sum(1 for job in JOBS.values() if job['status'] == 'processing')
+        total = len(JOBS)
+    return jsonify({
+        'jobs': total,
+        'processing': processing,
+        'cache': cache_stats()
+    }), 200
+
 @app.route('/health', methods=['GET'])
 def health():
     """健康检查"""
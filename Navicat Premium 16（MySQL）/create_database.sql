@@ -31,10 +31,14 @@ CREATE TABLE IF NOT EXISTS galaxy_classifications (
     predicted_class INT NOT NULL COMMENT '预测类别',
     confidence FLOAT NOT NULL COMMENT '置信度',
     class_name VARCHAR(50) COMMENT '类别名称',
+    model_version VARCHAR(64) COMMENT '模型版本',
+    corrected_class INT COMMENT '用户修正的类别',
+    corrected_at DATETIME COMMENT '修正时间',
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     INDEX idx_user_id (user_id),
-    INDEX idx_created_at (created_at)
+    INDEX idx_created_at (created_at),
+    INDEX idx_corrected_at (corrected_at)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='星系分类记录表';
 
 -- 星座识别记录表
@@ -44,6 +48,10 @@ CREATE TABLE IF NOT EXISTS constellation_recognitions (
     image_path VARCHAR(255) NOT NULL COMMENT '图片路径',
     detected_constellations TEXT COMMENT '检测到的星座（JSON格式）',
     confidence FLOAT COMMENT '置信度',
+    image_phash VARCHAR(16) COMMENT '图片感知哈希（pHash，十六进制）',
+    image_dhash VARCHAR(16) COMMENT '图片差值哈希（dHash，十六进制）',
+    source_record_id INT COMMENT '复用结果的近重复记录ID',
+    positioning_id INT COMMENT '所用天体定位记录ID（按定位结果离线识别时）',
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     INDEX idx_user_id (user_id),
@@ -60,15 +68,41 @@ CREATE TABLE IF NOT EXISTS celestial_positionings (
     field_width FLOAT COMMENT '视场宽度（度）',
     field_height FLOAT COMMENT '视场高度（度）',
     orientation FLOAT COMMENT '方向角（度）',
+    wcs TEXT COMMENT 'WCS头（JSON格式）',
     solved BOOLEAN DEFAULT FALSE COMMENT '是否成功解析',
     solve_time FLOAT COMMENT '解析耗时（秒）',
+    status VARCHAR(20) DEFAULT 'pending' COMMENT '解析状态（pending/processing/success/failure）',
+    job_id VARCHAR(64) COMMENT 'Astrometry任务ID',
+    error TEXT COMMENT '失败原因',
+    hints TEXT COMMENT '解析提示（JSON格式：比例范围、大致指向）',
+    image_hash VARCHAR(64) COMMENT '图片内容SHA-256',
+    source_record_id INT COMMENT '复用解析结果的记录ID',
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+    completed_at DATETIME COMMENT '解析完成时间',
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
     INDEX idx_user_id (user_id),
     INDEX idx_created_at (created_at),
-    INDEX idx_solved (solved)
+    INDEX idx_solved (solved),
+    INDEX idx_status (status),
+    INDEX idx_image_hash (image_hash)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='天体定位记录表';
 
+-- 器材配置表
+CREATE TABLE IF NOT EXISTS equipment_profiles (
+    id INT AUTO_INCREMENT PRIMARY KEY COMMENT '配置ID',
+    user_id INT NOT NULL COMMENT '用户ID',
+    name VARCHAR(100) NOT NULL COMMENT '配置名称',
+    focal_length FLOAT NOT NULL COMMENT '焦距（mm）',
+    pixel_size FLOAT COMMENT '像元尺寸（µm）',
+    sensor_width FLOAT COMMENT '传感器宽度（mm）',
+    sensor_pixels INT COMMENT '传感器宽度方向像素数（原始分辨率）',
+    binning INT DEFAULT 1 COMMENT '像素合并',
+    is_default BOOLEAN DEFAULT FALSE COMMENT '是否默认配置',
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    INDEX idx_user_id (user_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='器材配置表';
+
 -- 太空引擎数据表
 CREATE TABLE IF NOT EXISTS space_engine_data (
     id INT AUTO_INCREMENT PRIMARY KEY COMMENT '记录ID',
@@ -140,3 +174,24 @@ INSERT INTO homepage_contents (content_type, title, content, sort_order) VALUES
 INSERT INTO homepage_contents (content_type, title, image_url, sort_order) VALUES
 ('background', '登录背景', '/images/login_bg.jpg', 1);
 
+-- 已有数据库升级（按需执行）
+-- ALTER TABLE galaxy_classifications ADD COLUMN model_version VARCHAR(64) COMMENT '模型版本' AFTER class_name;
+-- ALTER TABLE galaxy_classifications ADD COLUMN corrected_class INT COMMENT '用户修正的类别' AFTER model_version,
+--     ADD COLUMN corrected_at DATETIME COMMENT '修正时间' AFTER corrected_class,
+--     ADD INDEX idx_corrected_at (corrected_at);
+-- ALTER TABLE constellation_recognitions ADD COLUMN image_phash VARCHAR(16) COMMENT '图片感知哈希（pHash，十六进制）' AFTER confidence,
+--     ADD COLUMN image_dhash VARCHAR(16) COMMENT '图片差值哈希（dHash，十六进制）' AFTER image_phash,
+--     ADD COLUMN source_record_id INT COMMENT '复用结果的近重复记录ID' AFTER image_dhash;
+-- ALTER TABLE constellation_recognitions ADD COLUMN positioning_id INT COMMENT '所用天体定位记录ID（按定位结果离线识别时）' AFTER source_record_id;
+-- ALTER TABLE celestial_positionings ADD COLUMN wcs TEXT COMMENT 'WCS头（JSON格式）' AFTER orientation;
+-- ALTER TABLE celestial_positionings ADD COLUMN status VARCHAR(20) DEFAULT 'pending' COMMENT '解析状态（pending/processing/success/failure）' AFTER solve_time,
+--     ADD COLUMN job_id VARCHAR(64) COMMENT 'Astrometry任务ID' AFTER status,
+--     ADD COLUMN error TEXT COMMENT '失败原因' AFTER job_id,
+--     ADD COLUMN completed_at DATETIME COMMENT '解析完成时间' AFTER created_at,
+--     ADD INDEX idx_status (status);
+-- UPDATE celestial_positionings SET status = IF(solved, 'success', 'failure'), completed_at = created_at;
+-- ALTER TABLE celestial_positionings ADD COLUMN hints TEXT COMMENT '解析提示（JSON格式：比例范围、大致指向）' AFTER error;
+-- ALTER TABLE equipment_profiles ADD COLUMN sensor_pixels INT COMMENT '传感器宽度方向像素数（原始分辨率）' AFTER sensor_width;
+-- ALTER TABLE celestial_positionings ADD COLUMN image_hash VARCHAR(64) COMMENT '图片内容SHA-256' AFTER hints,
+--     ADD COLUMN source_record_id INT COMMENT '复用解析结果的记录ID' AFTER image_hash,
+--     ADD INDEX idx_image_hash (image_hash);
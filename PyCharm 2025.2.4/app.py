@@ -40,6 +40,7 @@ from routes.space_engine import space_engine_bp
 from routes.tianxun_ai import tianxun_ai_bp
 from routes.user import user_bp
 from routes.homepage import homepage_bp
+from routes.health import health_bp
 
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(galaxy_bp, url_prefix='/api/galaxy')
@@ -49,6 +50,7 @@ app.register_blueprint(space_engine_bp, url_prefix='/api/space-engine')
 app.register_blueprint(tianxun_ai_bp, url_prefix='/api/tianxun-ai')
 app.register_blueprint(user_bp, url_prefix='/api/user')
 app.register_blueprint(homepage_bp, url_prefix='/api/homepage')
+app.register_blueprint(health_bp, url_prefix='/api/health')
 
 @app.route('/')
 def index():
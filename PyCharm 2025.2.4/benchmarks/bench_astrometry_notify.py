@@ -0,0 +1,155 @@
+"""
+天体定位任务通知方式基准测试
+在本机启动 CentOS 7.8/astrometry_api_server.py（solve-field 换成按设定耗时写出WCS文件的模拟脚本），
+分别用 poll（每2秒查询）、long_poll、events（SSE）与回调跟踪同一批任务，统计：
+    从服务端任务结束到后端写回结果的延迟（p50/p95/max）
+    后端发给服务端的状态查询请求数（/jobs/<id>）
+
+后端写回记录的数据库操作换成内存字典，只测通知链路
+
+用法：
+    python benchmarks/bench_astrometry_notify.py
+    python benchmarks/bench_astrometry_notify.py --jobs 20 --solve-seconds 3
+"""
+import argparse
+import logging
+import os
+import stat
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from flask import Flask, request
+from werkzeug.serving import make_server
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, '..', 'CentOS 7.8'))
+import astrometry_api_server as astrometry
+from services.celestial_positioning_service import CelestialPositioningService
+
+PORT = 5931
+
+FAKE_SOLVE_FIELD = '''#!{python}
+import sys, time
+from astropy.io import fits
+time.sleep({seconds})
+header = fits.Header()
+for key, value in dict(CTYPE1='RA---TAN', CTYPE2='DEC--TAN', CRVAL1=83.8, CRVAL2=-5.4, CRPIX1=32.0, CRPIX2=24.0,
+                       CD1_1=-0.01, CD1_2=0.0, CD2_1=0.0, CD2_2=0.01, IMAGEW=64, IMAGEH=48).items():
+    header[key] = value
+fits.PrimaryHDU(header=header).writeto(sys.argv[sys.argv.index('--out') + 1] + '.wcs', overwrite=True)
+'''
+
+class MemoryPositioningService(CelestialPositioningService):
+    """定位服务：记录写回内存字典，记下写回时刻"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.job_ids = {}
+        self.finished = {}
+
+    def upload(self, image_path, record_id=None, hints=None):
+        job_id = super().upload(image_path, record_id, hints)
+        self.job_ids[record_id] = job_id
+        return job_id
+
+    def unfinished_jobs(self, timeout):
+        return [], []
+
+    def mark_processing(self, record_id, job_id):
+        return record_id not in self.finished
+
+    def complete(self, record_id, calibration, solve_time):
+        self.finished.setdefault(record_id, ('success', time.time()))
+
+    def fail(self, record_id, error):
+        self.finished.setdefault(record_id, ('failure', time.time()))
+
+    def retry_without_hints(self, record_id):
+        return None
+
+def serve(app, port):
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def run(mode, image_path, jobs, callback_port=None):
+    """提交 jobs 个任务并等待全部写回，返回 (延迟列表ms, 状态查询数)"""
+    astrometry.JOBS.clear()
+    counts = {'status': 0}
+    os.environ['ASTROMETRY_NOTIFY'] = mode
+    # 回调方式下把定时查询放慢，只作兜底
+    os.environ['ASTROMETRY_POLL_INTERVAL'] = '60' if callback_port else '2'
+    os.environ['ASTROMETRY_CALLBACK_URL'] = f'http://127.0.0.1:{callback_port}/callback' if callback_port else ''
+    service = MemoryPositioningService(api_url=f'http://127.0.0.1:{PORT}')
+
+    callback_server = None
+    if callback_port:
+        receiver = Flask(__name__)
+
+        @receiver.route('/callback/<int:record_id>', methods=['POST'])
+        def callback(record_id):
+            service.tracker.handle_callback(record_id, request.get_json(), 0)
+            return {'message': 'ok'}
+
+        callback_server = serve(receiver, callback_port)
+
+    counting = astrometry.app.wsgi_app
+    def count_requests(environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith('/jobs/') and not path.endswith(('/info', '/events')):
+            counts['status'] += 1
+        return counting(environ, start_response)
+    astrometry.app.wsgi_app = count_requests
+
+    try:
+        service.tracker.start(Flask(__name__))
+        for record_id in range(1, jobs + 1):
+            service.tracker.submit(record_id, image_path)
+        while len(service.finished) < jobs:
+            time.sleep(0.05)
+    finally:
+        astrometry.app.wsgi_app = counting
+        service.tracker.stop()
+        if callback_server:
+            callback_server.shutdown()
+
+    lags = []
+    for record_id, (_, finished_at) in service.finished.items():
+        job = astrometry.JOBS[service.job_ids[record_id]]
+        lags.append((finished_at - job['start_time'] - job['solve_time']) * 1000)
+    return lags, counts['status']
+
+def main():
+    parser = argparse.ArgumentParser(description='天体定位任务通知方式基准测试')
+    parser.add_argument('--jobs', type=int, default=10, help='每种方式提交的任务数')
+    parser.add_argument('--solve-seconds', type=float, default=2.0, help='模拟的解析耗时（秒）')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='astrometry_bench_')
+    fake = os.path.join(workdir, 'solve-field')
+    with open(fake, 'w') as f:
+        f.write(FAKE_SOLVE_FIELD.format(python=sys.executable, seconds=args.solve_seconds))
+    os.chmod(fake, os.stat(fake).st_mode | stat.S_IEXEC)
+    astrometry.ASTROMETRY_BIN = fake
+    # 所有任务上传同一张图片，关闭解析缓存，每个任务都实际运行模拟的 solve-field
+    astrometry.CACHE_MAX_ENTRIES = 0
+    image_path = os.path.join(workdir, 'frame.png')
+    with open(image_path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = serve(astrometry.app, PORT)
+    try:
+        for mode, callback_port in (('poll', None), ('long_poll', None), ('events', None), ('poll', PORT + 1)):
+            lags, requests_sent = run(mode, image_path, args.jobs, callback_port)
+            name = '回调' if callback_port else mode
+            print(f"{name:10s} 延迟 p50 {np.percentile(lags, 50):7.1f} ms，p95 {np.percentile(lags, 95):7.1f} ms，"
+                  f"max {max(lags):7.1f} ms；状态查询 {requests_sent} 次")
+    finally:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+离线星座图谱基准测试
+1. 正确性：在全天随机取点，与 astropy.coordinates.get_constellation 对比所属星座；
+   两者的差异只应出现在边界附近（astropy 先换算到地心坐标，含周年光行差，约20角秒）
+2. 速度：对几种典型视场（大视场、天极附近、跨赤经0h、小视场）统计 identify 的单次耗时
+
+用法：
+    python benchmarks/bench_constellation_atlas.py
+    python benchmarks/bench_constellation_atlas.py --points 500000 --samples 32
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from services.constellation_atlas import ConstellationAtlas, FieldGeometry
+
+# (名称, 中心赤经, 中心赤纬, 视场宽, 视场高, 方向角)，单位：度
+FIELDS = [
+    ('猎户座广角', 83.8, -5.4, 30.0, 20.0, 15.0),
+    ('北天极', 180.0, 89.5, 60.0, 40.0, 0.0),
+    ('跨赤经0h', 0.5, 30.0, 5.0, 3.0, 0.0),
+    ('银心长焦', 266.4, -29.0, 1.0, 0.7, 120.0)
+]
+
+def check_boundaries(atlas, points, tolerance):
+    """返回 (不一致数, 其中离边界超过 tolerance 度的数量)"""
+    from astropy.coordinates import SkyCoord, get_constellation
+
+    rng = np.random.default_rng(0)
+    ra = rng.uniform(0.0, 360.0, points)
+    dec = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, points)))
+    mismatched = np.flatnonzero(atlas.lookup(ra, dec) != get_constellation(SkyCoord(ra, dec, unit='deg'), short_name=True))
+
+    far = 0
+    offsets = np.array([[tolerance, 0.0], [-tolerance, 0.0], [0.0, tolerance], [0.0, -tolerance]])
+    for i in mismatched:
+        around = SkyCoord(ra[i] + offsets[:, 0] / np.cos(np.radians(dec[i])), dec[i] + offsets[:, 1], unit='deg')
+        if len(set(get_constellation(around, short_name=True))) == 1:
+            far += 1
+    return len(mismatched), far
+
+def main():
+    parser = argparse.ArgumentParser(description='离线星座图谱基准测试')
+    parser.add_argument('--points', type=int, default=200000, help='正确性检查的随机点数')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='视为"边界附近"的距离（度）')
+    parser.add_argument('--samples', type=int, default=None, help='每个方向的网格点数')
+    parser.add_argument('--repeats', type=int, default=2000, help='每个视场的调用次数')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    atlas = ConstellationAtlas()
+    print(f"加载：{(time.perf_counter() - started) * 1000:.1f} ms，"
+          f"{len(atlas.dec_edges)} 个赤纬带，{len(atlas.band_keys)} 个赤经区间，{len(atlas.segment_owners)} 条连线")
+
+    try:
+        mismatched, far = check_boundaries(atlas, args.points, args.tolerance)
+        print(f"与 astropy 对比 {args.points} 个随机点：不一致 {mismatched} 个，"
+              f"其中离边界超过 {args.tolerance:g}° 的 {far} 个")
+    except ImportError:
+        print("未安装 astropy，跳过正确性检查")
+
+    for name, ra, dec, field_width, field_height, orientation in FIELDS:
+        field = FieldGeometry.from_center(ra, dec, field_width, field_height, 4000, 3000, orientation)
+        result = atlas.identify(field, samples=args.samples)
+        times = []
+        for _ in range(args.repeats):
+            started = time.perf_counter()
+            atlas.identify(field, samples=args.samples)
+            times.append((time.perf_counter() - started) * 1e6)
+        summary = '、'.join(f"{item['name_zh']} {item['coverage']:.0%}" for item in result[:5])
+        print(f"  {name}（{field_width:g}°x{field_height:g}°）：p50 {np.percentile(times, 50):.0f} µs，"
+              f"p99 {np.percentile(times, 99):.0f} µs；{summary}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+星系分类预处理基准测试
+对比原流程（上传落盘 -> 重新打开 -> 全分辨率解码 -> 缩放 -> float64）
+与新流程（内存中解码 -> JPEG draft 降采样解码 -> float32）的耗时
+
+用法：
+    python benchmarks/bench_preprocess.py                 # 生成 24MP 合成JPEG测试
+    python benchmarks/bench_preprocess.py photo1.jpg ...  # 使用真实相机照片
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.image_preprocess import load_image_tensor
+
+SIZE = (69, 69)
+
+def make_camera_jpeg(width=6000, height=4000, quality=92):
+    """生成一张接近相机直出尺寸的JPEG（噪声+渐变，避免被过度压缩）"""
+    rng = np.random.default_rng(0)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    noise = rng.normal(0, 30, (height, width, 3)).astype(np.float32)
+    pixels = np.clip(gradient + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+def baseline(data, workdir):
+    """原流程：写盘后重新打开并全分辨率解码"""
+    path = os.path.join(workdir, 'upload.jpg')
+    with open(path, 'wb') as f:
+        f.write(data)
+    img = Image.open(path)
+    img = img.convert('RGB')
+    img = img.resize(SIZE)
+    img_array = np.array(img) / 255.0
+    return np.expand_dims(img_array, axis=0)
+
+def optimized(data, workdir):
+    """新流程：内存中 draft 解码，直接生成float32"""
+    return load_image_tensor(data, SIZE)[np.newaxis]
+
+def bench(fn, data, workdir, repeats):
+    fn(data, workdir)
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn(data, workdir)
+        times.append((time.perf_counter() - started) * 1000.0)
+    return np.percentile(times, 50), np.percentile(times, 95)
+
+def main():
+    paths = sys.argv[1:]
+    if paths:
+        samples = [(os.path.basename(p), open(p, 'rb').read()) for p in paths]
+    else:
+        samples = [('synthetic_6000x4000.jpg', make_camera_jpeg())]
+
+    repeats = int(os.getenv('BENCH_REPEATS', 10))
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, data in samples:
+            width, height = Image.open(io.BytesIO(data)).size
+            before = bench(baseline, data, workdir, repeats)
+            after = bench(optimized, data, workdir, repeats)
+            diff = np.abs(baseline(data, workdir) - optimized(data, workdir)).mean()
+
+            print(f"{name}（{width}x{height}，{len(data) / 1024 / 1024:.1f} MB）")
+            print(f"  原流程：p50 {before[0]:.1f} ms，p95 {before[1]:.1f} ms")
+            print(f"  新流程：p50 {after[0]:.1f} ms，p95 {after[1]:.1f} ms")
+            print(f"  加速比：{before[0] / after[0]:.1f}x，像素平均差异 {diff:.4f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""
+Roboflow 调用基准测试
+在本机启动一个模拟的 Roboflow 检测服务，对比原流程（每次 requests.post 新建连接、整文件读入内存、
+无超时无重试）与新流程（共享连接池、流式上传、5xx/429 抖动重试）的吞吐量与延迟
+
+模拟服务：每个新连接先等待 --handshake-ms（模拟公网上TCP+TLS握手的往返），
+每个请求处理 --latency-ms，并按 --error-rate 的比例随机返回 503
+
+用法：
+    python benchmarks/bench_roboflow_client.py
+    python benchmarks/bench_roboflow_client.py --requests 500 --concurrency 16 --error-rate 0.05
+    python benchmarks/bench_roboflow_client.py photo.jpg
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import requests
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from services.constellation_recognition_service import ConstellationRecognitionService
+from utils.http_client import HTTPClient
+
+PREDICTIONS = {'predictions': [
+    {'class': 'Orion', 'confidence': 0.91, 'x': 320.5, 'y': 240.0, 'width': 180.0, 'height': 210.0}
+]}
+
+def make_server(handshake_ms, latency_ms, error_rate):
+    """启动模拟的 Roboflow 检测服务，返回 (服务器, 根地址)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # 与真实的服务端一样关闭Nagle，否则复用的连接上响应头与响应体分两次写会被延迟确认卡住约40ms
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            time.sleep(handshake_ms / 1000.0)
+            super().setup()
+
+        def do_POST(self):
+            remaining = int(self.headers.get('Content-Length', 0))
+            while remaining > 0:
+                remaining -= len(self.rfile.read(min(remaining, 65536)))
+            time.sleep(latency_ms / 1000.0)
+
+            if random.random() < error_rate:
+                body, status = b'{"message": "Service Unavailable"}', 503
+            else:
+                body, status = json.dumps(PREDICTIONS).encode('utf-8'), 200
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+def make_image(path, width=1920, height=1080):
+    """生成一张带噪声的PNG（约数MB，接近用户上传的星空截图）"""
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path, 'PNG')
+
+def baseline(url, image_path):
+    """原流程：读入整个文件，每次新建连接，无超时无重试"""
+    with open(image_path, 'rb') as f:
+        image_data = f.read()
+    response = requests.post(url, params={'api_key': 'bench'}, files={'file': image_data},
+                             data={'overlap': 30, 'confidence': 40})
+    if response.status_code != 200:
+        raise Exception(f"API调用失败: {response.status_code}")
+    return response.json().get('predictions', [])
+
+def run(fn, count, concurrency):
+    """并发执行 count 次，返回 (每秒请求数, p50 ms, p99 ms, 失败数)"""
+    def timed(_):
+        started = time.perf_counter()
+        try:
+            fn()
+            ok = True
+        except Exception:
+            ok = False
+        return (time.perf_counter() - started) * 1000.0, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(count)))
+    elapsed = time.perf_counter() - started
+    latencies = np.array([ms for ms, _ in results])
+    failures = sum(1 for _, ok in results if not ok)
+    return count / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99), failures
+
+def main():
+    parser = argparse.ArgumentParser(description='Roboflow 调用基准测试')
+    parser.add_argument('image', nargs='?', help='测试图片，默认生成 1920x1080 噪声PNG')
+    parser.add_argument('--requests', type=int, default=200, help='每种流程的请求数')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发线程数')
+    parser.add_argument('--handshake-ms', type=float, default=30, help='模拟的每连接握手耗时')
+    parser.add_argument('--latency-ms', type=float, default=20, help='模拟的服务端处理耗时')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='模拟的503比例')
+    args = parser.parse_args()
+
+    server, root = make_server(args.handshake_ms, args.latency_ms, args.error_rate)
+    os.environ['ROBOFLOW_API_URL'] = root
+    with tempfile.TemporaryDirectory() as workdir:
+        image_path = args.image
+        if image_path is None:
+            image_path = os.path.join(workdir, 'sky.png')
+            make_image(image_path)
+
+        service = ConstellationRecognitionService(
+            api_key='bench',
+            http_client=HTTPClient(pool_size=args.concurrency, backoff_factor=0.05)
+        )
+        size_mb = os.path.getsize(image_path) / 1024 / 1024
+        print(f"图片 {os.path.basename(image_path)}（{size_mb:.1f} MB），{args.requests} 次请求，"
+              f"并发 {args.concurrency}，握手 {args.handshake_ms:g} ms，处理 {args.latency_ms:g} ms，"
+              f"503比例 {args.error_rate:.0%}")
+
+        rows = [
+            ('原流程', run(lambda: baseline(service.base_url, image_path), args.requests, args.concurrency)),
+            ('新流程', run(lambda: service.detect(image_path), args.requests, args.concurrency))
+        ]
+        for name, (rps, p50, p99, failures) in rows:
+            print(f"  {name}：{rps:.1f} 请求/秒，p50 {p50:.1f} ms，p99 {p99:.1f} ms，失败 {failures}")
+        print(f"  吞吐量提升：{rows[1][1][0] / rows[0][1][0]:.2f}x，p99 降低：{rows[0][1][2] / rows[1][1][2]:.2f}x")
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
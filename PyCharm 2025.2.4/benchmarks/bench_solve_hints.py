@@ -0,0 +1,85 @@
+"""
+天体定位解析提示基准测试
+对同一批图片向 Astrometry 服务（ASTROMETRY_API_URL）依次提交三轮解析，统计每轮的解析耗时（p50/p90）与成功率：
+    无提示：不带任何提示，也关闭服务端的自动缩小（downsample=1），即原来的全天盲解
+    仅缩小：只用服务端按 ASTROMETRY_DOWNSAMPLE_TARGET 自动缩小
+    提示：services/solve_hints.py 从 FITS头/EXIF/器材参数推算的像素比例与指向，加自动缩小
+
+解析耗时取服务端记录的 solve_time（不含上传与排队）；任务逐个提交，避免并发解析互相影响；
+上传时跳过服务端的解析缓存，每轮都实际运行 solve-field
+
+用法：
+    ASTROMETRY_API_URL=http://astrometry:5000 python benchmarks/bench_solve_hints.py frames/*.fits
+    python benchmarks/bench_solve_hints.py sky1.jpg sky2.jpg --focal-length 400 --pixel-size 3.76
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from services.celestial_positioning_service import CelestialPositioningService
+from services.solve_hints import collect_hints
+
+def solve(service, image_path, hints, timeout):
+    """提交一个任务并长轮询到结束，返回 (是否成功, 服务端解析耗时秒)"""
+    job_id = service.upload(image_path, hints=hints, use_cache=False)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = service.fetch_status(job_id, wait=30)
+        if job.get('status') == 'success':
+            return True, job.get('solve_time') or time.time() - job['start_time']
+        if job.get('status') == 'failure':
+            return False, time.time() - job.get('start_time', time.time())
+    return False, timeout
+
+def run(name, service, images, hints_for, timeout):
+    times = []
+    solved = 0
+    for image_path in images:
+        hints = hints_for(image_path)
+        try:
+            success, elapsed = solve(service, image_path, hints, timeout)
+        except Exception as e:
+            print(f"  {name} 提交失败 {os.path.basename(image_path)}: {e}")
+            continue
+        solved += success
+        if success:
+            times.append(elapsed)
+        print(f"  {name} {os.path.basename(image_path)}: {'成功' if success else '失败'} {elapsed:.1f} s")
+    return {
+        'images': len(images),
+        'success_rate': round(solved / len(images), 3) if images else 0,
+        'p50_seconds': round(float(np.percentile(times, 50)), 2) if times else None,
+        'p90_seconds': round(float(np.percentile(times, 90)), 2) if times else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='天体定位解析提示基准测试')
+    parser.add_argument('images', nargs='+', help='测试图片（FITS / JPEG / PNG）')
+    parser.add_argument('--focal-length', type=float, help='器材焦距（mm），图片本身没有像素比例时使用')
+    parser.add_argument('--pixel-size', type=float, help='像元尺寸（µm）')
+    parser.add_argument('--binning', type=int, default=1, help='像素合并')
+    parser.add_argument('--timeout', type=float, default=300, help='单个任务的最长等待（秒）')
+    args = parser.parse_args()
+
+    equipment = None
+    if args.focal_length and args.pixel_size:
+        equipment = {'focal_length': args.focal_length, 'pixel_size': args.pixel_size, 'binning': args.binning}
+
+    service = CelestialPositioningService()
+    print(f"Astrometry服务：{service.api_url}")
+    for image_path in args.images:
+        print(f"  {os.path.basename(image_path)} 提示：{collect_hints(image_path, equipment)}")
+
+    report = {
+        'no_hints': run('无提示', service, args.images, lambda path: {'downsample': 1}, args.timeout),
+        'downsample_only': run('仅缩小', service, args.images, lambda path: {}, args.timeout),
+        'hints': run('提示', service, args.images, lambda path: collect_hints(path, equipment), args.timeout)
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
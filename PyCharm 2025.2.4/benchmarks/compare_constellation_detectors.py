@@ -0,0 +1,81 @@
+"""
+本地星座检测模型与 Roboflow 的对比工具
+对同一批图片分别用两个后端检测，输出各自的延迟分位数、以 Roboflow 为参考的一致性
+（同类别、IoU 不低于阈值即视为一致），以及本地模型在不同批次大小下的吞吐
+
+本地模型按 CONSTELLATION_LOCAL_* 环境变量加载；未配置 ROBOFLOW_API_KEY 时只测本地模型
+
+用法：
+    CONSTELLATION_LOCAL_MODEL_PATH=models/constellation_detector.onnx \\
+        python benchmarks/compare_constellation_detectors.py uploads/constellation/*.png
+    python benchmarks/compare_constellation_detectors.py sky1.png sky2.jpg --batch-sizes 1 4 8 --iou 0.5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from services.constellation_detectors import AgreementStats, DetectorStats, LocalConstellationDetector
+from services.constellation_recognition_service import ConstellationRecognitionService
+
+def run(name, detect, images, repeats):
+    """逐张检测，返回 (每张图片最后一次的检测结果, 统计)"""
+    stats = DetectorStats()
+    results = []
+    for image_path in images:
+        predictions = None
+        for _ in range(repeats):
+            started = time.perf_counter()
+            try:
+                predictions = detect(image_path)
+            except Exception as e:
+                stats.record(time.perf_counter() - started, None)
+                print(f"  {name} 检测失败 {os.path.basename(image_path)}: {e}")
+                continue
+            stats.record(time.perf_counter() - started, predictions)
+        results.append(predictions)
+    return results, stats.get_stats()
+
+def throughput(detector, images, batch_size, repeats):
+    """本地模型按指定批次大小检测，返回每秒处理的图片数"""
+    started = time.perf_counter()
+    count = 0
+    for _ in range(repeats):
+        for start in range(0, len(images), batch_size):
+            count += len(detector.detect_batch(images[start:start + batch_size]))
+    return count / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description='本地星座检测模型与 Roboflow 对比')
+    parser.add_argument('images', nargs='+', help='测试图片')
+    parser.add_argument('--repeats', type=int, default=3, help='每张图片每个后端的检测次数')
+    parser.add_argument('--iou', type=float, default=0.5, help='判定检测一致的IoU阈值')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8], help='测试吞吐的批次大小')
+    args = parser.parse_args()
+
+    detector = LocalConstellationDetector.from_env()
+    print(f"本地模型：{detector.model_path}（{detector.backend_name}，输入 {detector.input_width}x{detector.input_height}，"
+          f"{len(detector.labels)} 个类别）")
+    local, local_stats = run('本地模型', detector.detect, args.images, args.repeats)
+    report = {'local': local_stats}
+
+    remote_service = ConstellationRecognitionService(detector_mode='remote')
+    if remote_service.api_key or 'ROBOFLOW_API_URL' in os.environ:
+        remote, report['remote'] = run('Roboflow', remote_service.detect, args.images, args.repeats)
+        agreement = AgreementStats(args.iou)
+        for reference, candidate in zip(remote, local):
+            if reference is not None and candidate is not None:
+                agreement.record(reference, candidate)
+        report['agreement'] = agreement.get_stats()
+    else:
+        print("未配置 ROBOFLOW_API_KEY，只测试本地模型")
+
+    report['local_throughput'] = {
+        str(size): round(throughput(detector, args.images, size, args.repeats), 2) for size in args.batch_sizes
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == '__main__':
+    main()
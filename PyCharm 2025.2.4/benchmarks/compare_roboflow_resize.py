@@ -0,0 +1,77 @@
+"""
+Roboflow 上传前缩放的对比工具
+对同一批图片分别上传原图与缩放后重新编码的JPEG，对比上传字节数、端到端耗时，
+并检查换算回原图坐标后的检测结果是否与原图一致（同类别、IoU 不低于阈值即视为一致）
+
+需要配置 ROBOFLOW_API_KEY（或用 ROBOFLOW_API_URL 指向自建的推理服务）
+
+用法：
+    python benchmarks/compare_roboflow_resize.py sky1.png sky2.jpg
+    ROBOFLOW_MAX_DIMENSION=640 ROBOFLOW_JPEG_QUALITY=85 python benchmarks/compare_roboflow_resize.py uploads/constellation/*.png
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from services.constellation_detectors import match_detections
+from services.constellation_recognition_service import ConstellationRecognitionService
+
+def timed_detect(service, image_path, repeats):
+    """返回 (检测结果, 上传字节数, 中位耗时ms)"""
+    upload, _, _ = service.prepare_image(image_path)
+    size = os.path.getsize(upload) if isinstance(upload, str) else len(upload.getbuffer())
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        predictions = service.detect(image_path)
+        times.append((time.perf_counter() - started) * 1000.0)
+    return predictions, size, float(np.median(times))
+
+def main():
+    parser = argparse.ArgumentParser(description='Roboflow 上传前缩放对比')
+    parser.add_argument('images', nargs='+', help='测试图片')
+    parser.add_argument('--repeats', type=int, default=3, help='每张图片每种方式的请求次数（取中位耗时）')
+    parser.add_argument('--iou', type=float, default=0.5, help='判定检测一致的IoU阈值')
+    args = parser.parse_args()
+
+    resized = ConstellationRecognitionService()
+    if not resized.api_key and 'ROBOFLOW_API_URL' not in os.environ:
+        raise SystemExit('请先配置 ROBOFLOW_API_KEY')
+    original = ConstellationRecognitionService(http_client=resized.http)
+    original.max_dimension = 0
+    print(f"缩放参数：长边 {resized.max_dimension}，JPEG质量 {resized.jpeg_quality}，IoU阈值 {args.iou}")
+
+    totals = {'original_bytes': 0, 'resized_bytes': 0, 'original_ms': 0.0, 'resized_ms': 0.0,
+              'reference': 0, 'matched': 0, 'extra': 0}
+    for image_path in args.images:
+        before, before_bytes, before_ms = timed_detect(original, image_path, args.repeats)
+        after, after_bytes, after_ms = timed_detect(resized, image_path, args.repeats)
+        pairs = match_detections(before, after, args.iou)
+        mean_iou = np.mean([score for _, _, score in pairs]) if pairs else float('nan')
+        conf_diff = np.mean([abs(a['confidence'] - b['confidence']) for a, b, _ in pairs]) if pairs else float('nan')
+
+        print(f"\n{os.path.basename(image_path)}")
+        print(f"  上传：{before_bytes / 1024:.0f} KB -> {after_bytes / 1024:.0f} KB，"
+              f"耗时：{before_ms:.0f} ms -> {after_ms:.0f} ms")
+        print(f"  检测：原图 {len(before)} 个，缩放后 {len(after)} 个，一致 {len(pairs)} 个，"
+              f"平均IoU {mean_iou:.3f}，平均置信度差 {conf_diff:.3f}")
+
+        totals['original_bytes'] += before_bytes
+        totals['resized_bytes'] += after_bytes
+        totals['original_ms'] += before_ms
+        totals['resized_ms'] += after_ms
+        totals['reference'] += len(before)
+        totals['matched'] += len(pairs)
+        totals['extra'] += len(after) - len(pairs)
+
+    count = len(args.images)
+    recall = totals['matched'] / totals['reference'] if totals['reference'] else 1.0
+    print(f"\n合计 {count} 张：上传字节减少 {1 - totals['resized_bytes'] / max(totals['original_bytes'], 1):.1%}，"
+          f"平均耗时 {totals['original_ms'] / count:.0f} ms -> {totals['resized_ms'] / count:.0f} ms")
+    print(f"  原图检测在缩放后仍一致的比例 {recall:.1%}，缩放后多出的检测 {totals['extra']} 个")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+星系分类模型导出与一致性检查脚本
+将 train_galaxy_model.py 训练得到的 .h5 模型导出为 TFLite（float16/int8）或 ONNX，
+并对比量化模型与原始Keras模型的 Top-1 一致率、推理延迟和内存占用
+
+用法示例：
+    python export_galaxy_model.py --format tflite --quantize float16
+    python export_galaxy_model.py --format tflite --quantize int8 --data Galaxy10_DECals.h5
+    python export_galaxy_model.py --format onnx
+    python export_galaxy_model.py --check tflite --data Galaxy10_DECals.h5
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import time
+import numpy as np
+from services.inference_backends import DEFAULT_MODEL_PATHS, create_backend
+from services.model_registry import ModelRegistry
+
+INPUT_SHAPE = (69, 69, 3)
+
+def load_sample_images(data_path='Galaxy10_DECals.h5', num_samples=500, seed=42):
+    """从Galaxy10数据集中随机抽取样本并缩放到模型输入尺寸"""
+    import h5py
+    from PIL import Image
+
+    if not os.path.exists(data_path):
+        raise FileNotFoundError(f"数据集文件 {data_path} 不存在，量化校准与一致性检查需要样本图片")
+
+    with h5py.File(data_path, 'r') as F:
+        total = F['images'].shape[0]
+        rng = np.random.default_rng(seed)
+        indices = np.sort(rng.choice(total, size=min(num_samples, total), replace=False))
+
+        samples = np.empty((len(indices),) + INPUT_SHAPE, dtype=np.float32)
+        for i, index in enumerate(indices):
+            img = Image.fromarray(F['images'][index]).resize(INPUT_SHAPE[:2])
+            samples[i] = np.asarray(img, dtype=np.float32) / 255.0
+
+    return samples
+
+def export_tflite(model_path, output_path, quantize='float16', samples=None):
+    """
+    导出TFLite模型
+
+    quantize: none / dynamic / float16 / int8（int8需要校准样本）
+    """
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if quantize == 'dynamic':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif quantize == 'float16':
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == 'int8':
+        if samples is None:
+            raise ValueError("int8量化需要校准样本，请通过 --data 指定数据集")
+
+        def representative_dataset():
+            for i in range(min(len(samples), 200)):
+                yield [samples[i:i + 1]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+    print(f"TFLite模型已导出（{quantize}）：{output_path}")
+
+def export_onnx(model_path, output_path, quantize='none', opset=13):
+    """
+    导出ONNX模型
+
+    quantize: none / float16 / int8（int8为onnxruntime动态量化）
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    model = tf.keras.models.load_model(model_path)
+    spec = (tf.TensorSpec((None,) + INPUT_SHAPE, tf.float32, name='input'),)
+    model_proto, _ = tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset)
+
+    if quantize == 'float16':
+        from onnxconverter_common import float16
+        model_proto = float16.convert_float_to_float16(model_proto, keep_io_types=True)
+
+    if quantize == 'int8':
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        float_path = output_path + '.float.onnx'
+        with open(float_path, 'wb') as f:
+            f.write(model_proto.SerializeToString())
+        quantize_dynamic(float_path, output_path, weight_type=QuantType.QInt8)
+        os.remove(float_path)
+    else:
+        with open(output_path, 'wb') as f:
+            f.write(model_proto.SerializeToString())
+
+    print(f"ONNX模型已导出（{quantize}）：{output_path}")
+
+def _peak_rss_mb():
+    """当前进程的峰值常驻内存（MB）"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def _measure_backend(backend, model_path, samples, repeats):
+    """在独立进程中加载后端并测量延迟与内存，避免各后端互相影响RSS"""
+    baseline_rss = _peak_rss_mb()
+
+    started = time.perf_counter()
+    runner = create_backend(backend, model_path)
+    load_time = time.perf_counter() - started
+
+    # 预热
+    runner.predict(samples[:1])
+
+    single = []
+    for i in range(min(repeats, len(samples))):
+        started = time.perf_counter()
+        runner.predict(samples[i:i + 1])
+        single.append(time.perf_counter() - started)
+
+    batch = samples[:64]
+    started = time.perf_counter()
+    for _ in range(5):
+        runner.predict(batch)
+    batch_time = (time.perf_counter() - started) / 5
+
+    predictions = np.concatenate([
+        runner.predict(samples[i:i + 64]) for i in range(0, len(samples), 64)
+    ])
+
+    single_ms = np.asarray(single) * 1000.0
+    return {
+        'backend': backend,
+        'model_path': model_path,
+        'file_size_mb': round(os.path.getsize(model_path) / 1024 / 1024, 3),
+        'load_time_s': round(load_time, 3),
+        'single_p50_ms': round(float(np.percentile(single_ms, 50)), 3),
+        'single_p99_ms': round(float(np.percentile(single_ms, 99)), 3),
+        'batch64_ms': round(batch_time * 1000.0, 3),
+        'batch64_images_per_s': round(len(batch) / batch_time, 1),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'model_rss_mb': round(_peak_rss_mb() - baseline_rss, 1)
+    }, predictions
+
+def parity_check(candidate_backend, candidate_path, reference_path, samples, repeats=200):
+    """对比候选后端与Keras参考模型的Top-1一致率、延迟和内存"""
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(1) as pool:
+        reference, reference_pred = pool.apply(
+            _measure_backend, ('keras', reference_path, samples, repeats)
+        )
+    with ctx.Pool(1) as pool:
+        candidate, candidate_pred = pool.apply(
+            _measure_backend, (candidate_backend, candidate_path, samples, repeats)
+        )
+
+    agreement = float(np.mean(
+        np.argmax(reference_pred, axis=1) == np.argmax(candidate_pred, axis=1)
+    ))
+    max_abs_diff = float(np.max(np.abs(reference_pred - candidate_pred)))
+
+    return {
+        'samples': len(samples),
+        'top1_agreement': round(agreement, 4),
+        'max_abs_prob_diff': round(max_abs_diff, 4),
+        'reference': reference,
+        'candidate': candidate
+    }
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='星系分类模型导出与一致性检查')
+    parser.add_argument('--model', default=DEFAULT_MODEL_PATHS['keras'], help='Keras模型路径')
+    parser.add_argument('--format', choices=['tflite', 'onnx'], help='导出格式')
+    parser.add_argument('--quantize', default='float16',
+                        choices=['none', 'dynamic', 'float16', 'int8'], help='量化方式')
+    parser.add_argument('--output', help='导出文件路径，默认使用服务的默认路径')
+    parser.add_argument('--data', default='Galaxy10_DECals.h5', help='Galaxy10数据集路径')
+    parser.add_argument('--samples', type=int, default=500, help='校准/检查样本数')
+    parser.add_argument('--check', choices=['tflite', 'onnxruntime'],
+                        help='对指定后端做一致性检查')
+    parser.add_argument('--candidate', help='一致性检查的候选模型路径')
+    parser.add_argument('--report', default='models/parity_report.json', help='检查报告输出路径')
+    parser.add_argument('--publish', action='store_true', help='将导出的模型发布到模型仓库')
+    args = parser.parse_args()
+
+    if not args.format and not args.check:
+        parser.error('请指定 --format 或 --check')
+
+    if args.format == 'tflite':
+        samples = None
+        if args.quantize == 'int8':
+            samples = load_sample_images(args.data, args.samples)
+        output = args.output or DEFAULT_MODEL_PATHS['tflite']
+        export_tflite(args.model, output, args.quantize, samples)
+    elif args.format == 'onnx':
+        # ONNX 的 int8 即 onnxruntime 动态量化
+        quantize = 'int8' if args.quantize == 'dynamic' else args.quantize
+        output = args.output or DEFAULT_MODEL_PATHS['onnxruntime']
+        export_onnx(args.model, output, quantize)
+
+    if args.format and args.publish:
+        ModelRegistry().publish(output, {
+            'quantize': args.quantize,
+            'source_model': args.model
+        })
+
+    if args.check:
+        samples = load_sample_images(args.data, args.samples)
+        candidate_path = args.candidate or DEFAULT_MODEL_PATHS[args.check]
+        report = parity_check(args.check, candidate_path, args.model, samples)
+
+        print("=" * 60)
+        print(f"Top-1一致率：{report['top1_agreement'] * 100:.2f}%（{report['samples']} 张）")
+        print(f"最大概率差：{report['max_abs_prob_diff']:.4f}")
+        for item in (report['reference'], report['candidate']):
+            print(f"[{item['backend']}] 文件 {item['file_size_mb']} MB，"
+                  f"单张 p50 {item['single_p50_ms']} ms / p99 {item['single_p99_ms']} ms，"
+                  f"批量64 {item['batch64_ms']} ms，峰值内存 {item['peak_rss_mb']} MB")
+        print("=" * 60)
+
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"检查报告已保存至：{args.report}")
+
+if __name__ == '__main__':
+    main()
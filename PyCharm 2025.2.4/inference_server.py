@@ -0,0 +1,226 @@
+"""
+星系分类推理边车（inference sidecar）
+在单独的进程中加载一份星系分类模型，通过Unix套接字为同机的多个Web进程提供推理，
+来自不同进程的并发请求由微批处理器合并为一次前向计算
+
+用法：
+    python inference_server.py --socket /tmp/galaxy_inference.sock --threads 8
+Web进程设置 GALAXY_INFERENCE_SOCKET=/tmp/galaxy_inference.sock 后即不再各自加载模型
+"""
+import argparse
+import os
+import socketserver
+import threading
+import time
+import numpy as np
+from services.inference_client import send_message, recv_message
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='星系分类推理边车')
+    parser.add_argument('--socket', default=os.getenv('GALAXY_INFERENCE_SOCKET', '/tmp/galaxy_inference.sock'),
+                        help='Unix套接字路径')
+    parser.add_argument('--backend', default=os.getenv('GALAXY_BACKEND', 'keras'),
+                        help='推理后端：keras / tflite / onnxruntime')
+    parser.add_argument('--model', default=os.getenv('GALAXY_MODEL_PATH'), help='模型文件路径')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('GALAXY_INFERENCE_THREADS', 0)),
+                        help='推理计算线程数，0表示由运行时决定')
+    parser.add_argument('--batch-window-ms', type=float, default=float(os.getenv('GALAXY_BATCH_WINDOW_MS', 5)),
+                        help='微批处理等待窗口（毫秒）')
+    parser.add_argument('--max-batch-size', type=int, default=int(os.getenv('GALAXY_MAX_BATCH_SIZE', 64)),
+                        help='单次前向计算的最大图片数')
+    return parser.parse_args()
+
+def configure_threads(threads):
+    """限制计算线程数，避免与Web进程争抢CPU；必须在导入推理库之前设置"""
+    if threads <= 0:
+        return
+    os.environ['GALAXY_INFERENCE_THREADS'] = str(threads)
+    os.environ.setdefault('OMP_NUM_THREADS', str(threads))
+    os.environ.setdefault('TF_NUM_INTRAOP_THREADS', str(threads))
+    os.environ.setdefault('TF_NUM_INTEROP_THREADS', '1')
+
+class VersionedOutput:
+    """
+    一次前向计算的结果：分类概率、特征向量（后端不支持时为None）与实际计算所用的模型版本号
+
+    按行切片时三者一起切分，微批处理器把批次结果分发回各请求后版本号仍随结果走
+    """
+
+    def __init__(self, probabilities, embeddings, model_version):
+        self.probabilities = probabilities
+        self.embeddings = embeddings
+        self.model_version = model_version
+
+    def __getitem__(self, index):
+        embeddings = self.embeddings[index] if self.embeddings is not None else None
+        return VersionedOutput(self.probabilities[index], embeddings, self.model_version)
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """多线程Unix套接字服务器，每个Web进程连接由独立线程处理"""
+    daemon_threads = True
+    # 多个Web进程同时建立连接时避免因监听队列已满而被拒绝
+    request_queue_size = 128
+
+    def __init__(self, socket_path, model, model_version):
+        # (模型, 版本号) 作为一个整体替换，读取方总是拿到同一版本的模型与版本号
+        self._active = (model, model_version)
+        self.batcher = None
+        # activate(version)：加载、预热并切换到模型仓库中的版本；固定模型文件时为None
+        self.activate = None
+        self.started_at = time.time()
+        self.requests = 0
+        super().__init__(socket_path, InferenceHandler)
+
+    @property
+    def model(self):
+        return self._active[0]
+
+    @property
+    def model_version(self):
+        return self._active[1]
+
+    def predict(self, batch):
+        """
+        使用当前模型推理，返回 VersionedOutput
+
+        后端支持特征提取时在同一次前向计算中一并得到特征向量，是否发回由各请求自行决定
+        """
+        model, model_version = self._active
+        if hasattr(model, 'predict_with_embeddings'):
+            probabilities, embeddings = model.predict_with_embeddings(batch)
+        else:
+            probabilities, embeddings = model.predict(batch), None
+        return VersionedOutput(np.asarray(probabilities, dtype=np.float32),
+                               None if embeddings is None else np.asarray(embeddings, dtype=np.float32),
+                               model_version)
+
+    def swap(self, model, model_version):
+        """热切换模型：模型与版本号一起原子替换，切换前已取得旧模型的请求继续用旧模型算完"""
+        self._active = (model, model_version)
+        print(f"推理边车模型已切换: {model_version}")
+
+class InferenceHandler(socketserver.BaseRequestHandler):
+    """处理单个连接上的多次请求"""
+
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                header, array = recv_message(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+
+            try:
+                op = header.get('op')
+                if op == 'predict':
+                    server.requests += 1
+                    batch = np.asarray(array, dtype=np.float32)
+                    if server.batcher is not None:
+                        output = server.batcher.submit(batch)
+                    else:
+                        output = server.predict(batch)
+                    response = {'status': 'ok', 'model_version': output.model_version}
+                    result = output.probabilities
+                    # 特征向量拼接在分类概率之后，classes 为分类概率的列数
+                    if header.get('embeddings') and output.embeddings is not None:
+                        response['classes'] = int(result.shape[-1])
+                        result = np.concatenate([result, output.embeddings], axis=-1)
+                    send_message(self.request, response, result)
+                elif op == 'activate':
+                    if server.activate is None:
+                        raise Exception('推理边车固定使用模型文件，不跟随模型仓库')
+                    send_message(self.request, {
+                        'status': 'ok',
+                        'model_version': server.activate(header.get('version'))
+                    })
+                elif op == 'info':
+                    model, model_version = server._active
+                    send_message(self.request, {
+                        'status': 'ok',
+                        'model_version': model_version,
+                        'backend': model.name,
+                        'embeddings': hasattr(model, 'predict_with_embeddings'),
+                        'uptime': time.time() - server.started_at,
+                        'requests': server.requests,
+                        'batching': server.batcher.get_stats() if server.batcher else None
+                    })
+                else:
+                    send_message(self.request, {'status': 'error', 'error': f'未知操作: {op}'})
+            except (ConnectionError, OSError):
+                return
+            except Exception as e:
+                try:
+                    send_message(self.request, {'status': 'error', 'error': str(e)})
+                except OSError:
+                    return
+
+def main():
+    """主函数"""
+    args = parse_args()
+    configure_threads(args.threads)
+
+    from services.inference_backends import create_backend, file_version, DEFAULT_MODEL_PATHS
+    from services.batch_inference import MicroBatcher
+    from services.model_registry import ModelRegistry
+
+    def load(backend, model_path):
+        print(f"正在加载模型: {model_path}（后端: {backend}）")
+        model = create_backend(backend, model_path)
+        warmup = np.zeros((1, 69, 69, 3), dtype=np.float32)
+        # 边车推理走 predict_with_embeddings（后端支持时），预热同一条计算路径
+        if hasattr(model, 'predict_with_embeddings'):
+            model.predict_with_embeddings(warmup)
+        else:
+            model.predict(warmup)
+        return model
+
+    # 未指定模型文件时跟随模型仓库的线上版本
+    registry = ModelRegistry()
+    current = None if args.model else registry.current_version()
+    if current:
+        info = registry.get(current)
+        model, model_version = load(info['backend'], info['path']), current
+    else:
+        model_path = args.model or DEFAULT_MODEL_PATHS[args.backend]
+        model, model_version = load(args.backend, model_path), file_version(model_path)
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+
+    server = InferenceServer(args.socket, model, model_version)
+    if args.batch_window_ms > 0 and args.max_batch_size > 1:
+        server.batcher = MicroBatcher(server.predict, max_batch_size=args.max_batch_size,
+                                      window_ms=args.batch_window_ms)
+
+    if not args.model:
+        swap_lock = threading.Lock()
+
+        def activate(version):
+            # Web进程的 activate 请求与监视线程可能同时切换同一版本，已是该版本时不再重复加载
+            with swap_lock:
+                if version == server.model_version:
+                    return version
+                info = registry.get(version)
+                if info is None:
+                    raise Exception(f"模型版本不存在: {version}")
+                server.swap(load(info['backend'], info['path']), version)
+                return version
+
+        server.activate = activate
+        registry.watch(activate, float(os.getenv('GALAXY_REGISTRY_POLL', 5)))
+
+    os.chmod(args.socket, 0o660)
+    print(f"推理边车已启动: {args.socket}（模型版本 {model_version}，线程数 {args.threads or '自动'}）")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+if __name__ == '__main__':
+    main()
@@ -16,13 +16,22 @@ class CelestialPositioning(db.Model):
     field_width = db.Column(db.Float, nullable=True, comment='视场宽度（度）')
     field_height = db.Column(db.Float, nullable=True, comment='视场高度（度）')
     orientation = db.Column(db.Float, nullable=True, comment='方向角（度）')
+    wcs = db.Column(db.Text, nullable=True, comment='WCS头（JSON格式）')
     solved = db.Column(db.Boolean, default=False, comment='是否成功解析')
     solve_time = db.Column(db.Float, nullable=True, comment='解析耗时（秒）')
+    status = db.Column(db.String(20), default='pending', index=True, comment='解析状态（pending/processing/success/failure）')
+    job_id = db.Column(db.String(64), nullable=True, comment='Astrometry任务ID')
+    error = db.Column(db.Text, nullable=True, comment='失败原因')
+    hints = db.Column(db.Text, nullable=True, comment='解析提示（JSON格式：比例范围、大致指向）')
+    image_hash = db.Column(db.String(64), nullable=True, index=True, comment='图片内容SHA-256')
+    source_record_id = db.Column(db.Integer, nullable=True, comment='复用解析结果的记录ID')
     created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='创建时间')
+    completed_at = db.Column(db.DateTime, nullable=True, comment='解析完成时间')
     
     user = db.relationship('User', backref='celestial_positionings')
     
     def to_dict(self):
+        import json
         return {
             'id': self.id,
             'user_id': self.user_id,
@@ -32,8 +41,15 @@ class CelestialPositioning(db.Model):
             'field_width': self.field_width,
             'field_height': self.field_height,
             'orientation': self.orientation,
+            'wcs': json.loads(self.wcs) if self.wcs else None,
             'solved': self.solved,
             'solve_time': self.solve_time,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'status': self.status,
+            'job_id': self.job_id,
+            'error': self.error,
+            'hints': json.loads(self.hints) if self.hints else None,
+            'source_record_id': self.source_record_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None
         }
 
@@ -13,6 +13,10 @@ class ConstellationRecognition(db.Model):
     image_path = db.Column(db.String(255), nullable=False, comment='图片路径')
     detected_constellations = db.Column(db.Text, nullable=True, comment='检测到的星座（JSON格式）')
     confidence = db.Column(db.Float, nullable=True, comment='置信度')
+    image_phash = db.Column(db.String(16), nullable=True, comment='图片感知哈希（pHash，十六进制）')
+    image_dhash = db.Column(db.String(16), nullable=True, comment='图片差值哈希（dHash，十六进制）')
+    source_record_id = db.Column(db.Integer, nullable=True, comment='复用结果的近重复记录ID')
+    positioning_id = db.Column(db.Integer, nullable=True, comment='所用天体定位记录ID（按定位结果离线识别时）')
     created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='创建时间')
     
     user = db.relationship('User', backref='constellation_recognitions')
@@ -25,6 +29,8 @@ class ConstellationRecognition(db.Model):
             'image_path': self.image_path,
             'detected_constellations': json.loads(self.detected_constellations) if self.detected_constellations else None,
             'confidence': self.confidence,
+            'source_record_id': self.source_record_id,
+            'positioning_id': self.positioning_id,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
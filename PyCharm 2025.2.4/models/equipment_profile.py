@@ -0,0 +1,36 @@
+"""
+器材配置模型
+"""
+from models import db
+from datetime import datetime
+
+class EquipmentProfile(db.Model):
+    """器材配置表（望远镜/镜头 + 相机），用于推算天体定位的像素比例"""
+    __tablename__ = 'equipment_profiles'
+    
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, comment='用户ID')
+    name = db.Column(db.String(100), nullable=False, comment='配置名称')
+    focal_length = db.Column(db.Float, nullable=False, comment='焦距（mm）')
+    pixel_size = db.Column(db.Float, nullable=True, comment='像元尺寸（µm）')
+    sensor_width = db.Column(db.Float, nullable=True, comment='传感器宽度（mm）')
+    sensor_pixels = db.Column(db.Integer, nullable=True, comment='传感器宽度方向像素数（原始分辨率）')
+    binning = db.Column(db.Integer, default=1, comment='像素合并')
+    is_default = db.Column(db.Boolean, default=False, comment='是否默认配置')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='创建时间')
+    
+    user = db.relationship('User', backref='equipment_profiles')
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'name': self.name,
+            'focal_length': self.focal_length,
+            'pixel_size': self.pixel_size,
+            'sensor_width': self.sensor_width,
+            'sensor_pixels': self.sensor_pixels,
+            'binning': self.binning,
+            'is_default': self.is_default,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
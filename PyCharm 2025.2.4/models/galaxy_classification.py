@@ -14,6 +14,9 @@ class GalaxyClassification(db.Model):
     predicted_class = db.Column(db.Integer, nullable=False, comment='预测类别')
     confidence = db.Column(db.Float, nullable=False, comment='置信度')
     class_name = db.Column(db.String(50), nullable=True, comment='类别名称')
+    model_version = db.Column(db.String(64), nullable=True, comment='模型版本')
+    corrected_class = db.Column(db.Integer, nullable=True, comment='用户修正的类别')
+    corrected_at = db.Column(db.DateTime, nullable=True, index=True, comment='修正时间')
     created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='创建时间')
     
     user = db.relationship('User', backref='galaxy_classifications')
@@ -26,6 +29,9 @@ class GalaxyClassification(db.Model):
             'predicted_class': self.predicted_class,
             'confidence': self.confidence,
             'class_name': self.class_name,
+            'model_version': self.model_version,
+            'corrected_class': self.corrected_class,
+            'corrected_at': self.corrected_at.isoformat() if self.corrected_at else None,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
 
@@ -1,7 +1,7 @@
 """
 天体定位路由
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context, url_for
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from services.celestial_positioning_service import CelestialPositioningService
 from utils.file_upload import save_uploaded_file
@@ -12,7 +12,18 @@ positioning_service = CelestialPositioningService()
 @positioning_bp.route('/solve', methods=['POST'])
 @jwt_required()
 def solve():
-    """解析天体定位"""
+    """
+    提交天体定位任务
+
+    立即返回 202 与定位记录（status 为 pending），解析在后台进行；
+    通过 GET /jobs/<id> 查询状态，或订阅 GET /jobs/<id>/events（SSE）等待结果
+
+    同一张图片解析成功过时直接返回 200 与已完成的记录（source_record_id 为复用结果的记录）
+
+    可选表单字段（解析提示，缩小 solve-field 的搜索范围）：
+    equipment_id（器材配置，未指定时用默认配置）、ra/dec/radius（度）、
+    scale_low/scale_high（角秒/像素）、hints=0（不使用提示）
+    """
     try:
         user_id = get_jwt_identity()
         
@@ -23,15 +34,90 @@ def solve():
         if file.filename == '':
             return jsonify({'error': '请选择文件'}), 400
         
+        overrides = {
+            key: request.form.get(key, type=float)
+            for key in ('ra', 'dec', 'radius', 'scale_low', 'scale_high')
+        }
+        if (overrides['ra'] is None) != (overrides['dec'] is None):
+            return jsonify({'error': 'ra 和 dec 需要同时提供'}), 400
+        if (overrides['scale_low'] is None) != (overrides['scale_high'] is None):
+            return jsonify({'error': 'scale_low 和 scale_high 需要同时提供'}), 400
+        if overrides['scale_low'] is not None and not 0 < overrides['scale_low'] <= overrides['scale_high']:
+            return jsonify({'error': '像素比例范围无效'}), 400
+        if overrides['dec'] is not None and not -90 <= overrides['dec'] <= 90:
+            return jsonify({'error': 'dec 超出范围'}), 400
+        
         # 保存文件
         image_path = save_uploaded_file(file, 'positioning')
         
-        # 解析
-        result = positioning_service.solve_field(image_path, user_id)
+        # 提交任务
+        job = positioning_service.submit(
+            image_path, user_id,
+            equipment_id=request.form.get('equipment_id', type=int),
+            overrides=overrides,
+            use_hints=request.form.get('hints', '1') != '0'
+        )
+        
+        return jsonify({
+            'message': '任务已提交',
+            'job': job,
+            'status_url': url_for('positioning.get_job', record_id=job['id']),
+            'events_url': url_for('positioning.job_events', record_id=job['id'])
+        }), 200 if job['status'] == 'success' else 202
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@positioning_bp.route('/jobs/<int:record_id>', methods=['GET'])
+@jwt_required()
+def get_job(record_id):
+    """查询定位任务状态（pending / processing / success / failure），成功时含解析结果"""
+    try:
+        user_id = get_jwt_identity()
+        
+        job = positioning_service.get_job(record_id, user_id)
+        if job is None:
+            return jsonify({'error': '定位记录不存在'}), 404
+        
+        return jsonify({
+            'job': job
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@positioning_bp.route('/jobs/<int:record_id>/events', methods=['GET'])
+@jwt_required()
+def job_events(record_id):
+    """定位任务的SSE事件流，状态每变化一次推送一个事件，解析结束后关闭"""
+    try:
+        user_id = get_jwt_identity()
+        
+        if positioning_service.get_job(record_id, user_id) is None:
+            return jsonify({'error': '定位记录不存在'}), 404
+        
+        return Response(
+            stream_with_context(positioning_service.stream_events(record_id, user_id)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@positioning_bp.route('/callback/<int:record_id>', methods=['POST'])
+def solve_callback(record_id):
+    """Astrometry服务的完成回调（不需要JWT，凭回调地址中的签名验证）"""
+    try:
+        job = request.get_json(silent=True)
+        if not job or 'status' not in job:
+            return jsonify({'error': '回调内容无效'}), 400
+        
+        if not positioning_service.handle_callback(record_id, request.args.get('token'), job):
+            return jsonify({'error': '签名无效或记录不存在'}), 403
         
         return jsonify({
-            'message': '解析成功',
-            'result': result
+            'message': '已接收'
         }), 200
         
     except Exception as e:
@@ -54,3 +140,15 @@ def get_history():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@positioning_bp.route('/stats', methods=['GET'])
+@jwt_required()
+def get_stats():
+    """获取后台跟踪状态（跟踪中的任务数）与解析缓存命中率"""
+    try:
+        return jsonify({
+            'stats': positioning_service.get_stats()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
@@ -12,22 +12,36 @@ constellation_service = ConstellationRecognitionService()
 @constellation_bp.route('/recognize', methods=['POST'])
 @jwt_required()
 def recognize():
-    """识别星座"""
+    """
+    识别星座
+
+    可选表单字段 positioning_id：该图片已解析的天体定位记录，提供时直接按定位结果离线识别；
+    只传 positioning_id 不上传图片时使用定位记录中的图片
+    """
     try:
         user_id = get_jwt_identity()
         
-        if 'image' not in request.files:
-            return jsonify({'error': '请上传图片'}), 400
-        
-        file = request.files['image']
-        if file.filename == '':
-            return jsonify({'error': '请选择文件'}), 400
+        solution = None
+        positioning_id = request.form.get('positioning_id', type=int)
+        if positioning_id is not None:
+            solution = constellation_service.get_solution(positioning_id, user_id)
+            if solution is None:
+                return jsonify({'error': '天体定位记录不存在或未解析成功'}), 404
         
-        # 保存文件
-        image_path = save_uploaded_file(file, 'constellation')
+        if 'image' in request.files:
+            file = request.files['image']
+            if file.filename == '':
+                return jsonify({'error': '请选择文件'}), 400
+            
+            # 保存文件
+            image_path = save_uploaded_file(file, 'constellation')
+        elif solution is not None:
+            image_path = solution['image_path']
+        else:
+            return jsonify({'error': '请上传图片'}), 400
         
         # 识别
-        result = constellation_service.recognize(image_path, user_id)
+        result = constellation_service.recognize(image_path, user_id, solution)
         
         return jsonify({
             'message': '识别成功',
@@ -54,3 +68,15 @@ def get_history():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@constellation_bp.route('/stats', methods=['GET'])
+@jwt_required()
+def get_stats():
+    """获取近重复缓存统计（命中率、条目数）"""
+    try:
+        return jsonify({
+            'stats': constellation_service.get_stats()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
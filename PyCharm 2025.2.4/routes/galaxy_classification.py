@@ -1,14 +1,22 @@
 """
 星系分类路由
 """
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from services.galaxy_classification_service import GalaxyClassificationService
-from utils.file_upload import save_uploaded_file
+from services.model_registry import is_valid_version
+from utils.readiness import register_readiness_check
+from utils.admin import admin_required
+from utils.file_upload import (
+    save_uploaded_file, read_uploaded_file, is_archive, iter_archive_images, ARCHIVE_EXTENSIONS
+)
 import os
+import json
+import time
 
 galaxy_bp = Blueprint('galaxy', __name__)
 galaxy_service = GalaxyClassificationService()
+register_readiness_check('galaxy_classification', galaxy_service.is_ready)
 
 @galaxy_bp.route('/classify', methods=['POST'])
 @jwt_required()
@@ -24,11 +32,11 @@ def classify():
         if file.filename == '':
             return jsonify({'error': '请选择文件'}), 400
         
-        # 保存文件
-        image_path = save_uploaded_file(file, 'galaxy')
+        # 直接在内存中解码，原始文件在后台归档
+        image_path, data = read_uploaded_file(file, 'galaxy')
         
         # 分类
-        result = galaxy_service.classify(image_path, user_id)
+        result = galaxy_service.classify(image_path, user_id, data=data)
         
         return jsonify({
             'message': '分类成功',
@@ -38,6 +46,117 @@ def classify():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@galaxy_bp.route('/classify-batch', methods=['POST'])
+@jwt_required()
+def classify_batch():
+    """
+    批量分类星系图片
+
+    表单字段 images 可包含多张图片或 zip/tar 压缩包，
+    结果以 NDJSON 逐行流式返回，最后一行为汇总信息
+    """
+    try:
+        user_id = get_jwt_identity()
+        
+        files = [f for f in request.files.getlist('images') if f.filename]
+        if not files:
+            return jsonify({'error': '请上传图片或压缩包'}), 400
+        
+        galaxy_service.require_model()
+        
+        # 图片直接读入内存（后台归档），压缩包落盘后在流式处理时再逐个解出成员
+        sources = []
+        for file in files:
+            if is_archive(file.filename):
+                sources.append(('archive', save_uploaded_file(file, 'galaxy', ARCHIVE_EXTENSIONS), None))
+            else:
+                sources.append(('image', *read_uploaded_file(file, 'galaxy')))
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    def iter_items():
+        for kind, path, data in sources:
+            if kind == 'image':
+                yield path, data
+            else:
+                for member, data in iter_archive_images(path):
+                    yield f"{path}#{member}"[:255], data
+    
+    def generate():
+        started = time.time()
+        succeeded = failed = 0
+        try:
+            for result in galaxy_service.classify_batch(iter_items(), user_id):
+                if 'error' in result:
+                    failed += 1
+                else:
+                    succeeded += 1
+                yield json.dumps(result, ensure_ascii=False) + '\n'
+        except Exception as e:
+            yield json.dumps({'error': f"批量分类失败: {e}"}, ensure_ascii=False) + '\n'
+        
+        yield json.dumps({
+            'done': True,
+            'succeeded': succeeded,
+            'failed': failed,
+            'elapsed': time.time() - started
+        }, ensure_ascii=False) + '\n'
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@galaxy_bp.route('/survey', methods=['POST'])
+@jwt_required()
+def survey():
+    """宽视场巡天模式：检测大幅图像中的所有星系并批量分类"""
+    try:
+        user_id = get_jwt_identity()
+        
+        if 'image' not in request.files:
+            return jsonify({'error': '请上传图片'}), 400
+        
+        file = request.files['image']
+        if file.filename == '':
+            return jsonify({'error': '请选择文件'}), 400
+        
+        threshold = request.form.get('threshold', 3.0, type=float)
+        min_area = request.form.get('min_area', 25, type=int)
+        
+        # 大图需要落盘，供内存映射分块读取
+        image_path = save_uploaded_file(file, 'galaxy')
+        
+        result = galaxy_service.classify_survey(
+            image_path, user_id, threshold=threshold, min_area=min_area
+        )
+        
+        return jsonify({
+            'message': '分类成功',
+            'result': result
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@galaxy_bp.route('/similar', methods=['GET', 'POST'])
+@jwt_required()
+def similar():
+    """检索相似星系：指定历史记录ID（record_id）或上传图片（image）"""
+    try:
+        record_id = request.values.get('record_id', type=int)
+        k = min(request.values.get('k', 10, type=int), 100)
+        
+        data = None
+        if record_id is None:
+            if 'image' not in request.files or request.files['image'].filename == '':
+                return jsonify({'error': '请提供记录ID或上传图片'}), 400
+            data = request.files['image'].read()
+        
+        result = galaxy_service.find_similar(record_id=record_id, data=data, k=k)
+        return jsonify(result), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @galaxy_bp.route('/history', methods=['GET'])
 @jwt_required()
 def get_history():
@@ -55,3 +174,82 @@ def get_history():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+
+@galaxy_bp.route('/history/<int:record_id>/correction', methods=['POST'])
+@jwt_required()
+def correct_classification(record_id):
+    """修正分类结果（用于模型增量微调）"""
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json() or {}
+        
+        corrected_class = data.get('corrected_class')
+        if not isinstance(corrected_class, int) or corrected_class not in galaxy_service.GALAXY10_CLASSES:
+            return jsonify({'error': '类别无效'}), 400
+        
+        record = galaxy_service.correct_classification(record_id, user_id, corrected_class)
+        if record is None:
+            return jsonify({'error': '分类记录不存在'}), 404
+        
+        return jsonify({
+            'message': '修正成功',
+            'record': record
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@galaxy_bp.route('/stats', methods=['GET'])
+@jwt_required()
+def get_stats():
+    """获取推理统计（批次大小、排队等待时间）"""
+    try:
+        return jsonify({
+            'stats': galaxy_service.get_stats()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@galaxy_bp.route('/admin/models', methods=['GET'])
+@admin_required
+def list_models():
+    """列出模型仓库中的所有版本"""
+    try:
+        registry = galaxy_service.registry
+        
+        return jsonify({
+            'versions': registry.list_versions(),
+            'current': registry.current_version(),
+            'serving': galaxy_service.model_version,
+            'swap': galaxy_service.swap_state
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@galaxy_bp.route('/admin/models/<version>/activate', methods=['POST'])
+@admin_required
+def activate_model(version):
+    """
+    切换线上模型版本
+
+    本进程（推理边车模式下为边车）在后台加载、预热成功后才原子替换并写入线上版本，
+    加载失败时线上版本不变（见 GET /admin/models 的 swap）；其他进程通过监视模型仓库在数秒内跟进
+    """
+    try:
+        registry = galaxy_service.registry
+        if not is_valid_version(version):
+            return jsonify({'error': '无效的模型版本号'}), 400
+        if registry.get(version) is None:
+            return jsonify({'error': '模型版本不存在'}), 404
+        
+        galaxy_service.activate_version_async(version, publish=True)
+        
+        return jsonify({
+            'message': '模型切换中',
+            'version': version
+        }), 202
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
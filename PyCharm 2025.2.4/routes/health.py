@@ -0,0 +1,23 @@
+"""
+健康检查路由
+"""
+from flask import Blueprint, jsonify
+from utils.readiness import get_readiness
+
+health_bp = Blueprint('health', __name__)
+
+@health_bp.route('/live', methods=['GET'])
+def live():
+    """存活检查：进程能响应请求即可"""
+    return jsonify({'status': 'ok'}), 200
+
+@health_bp.route('/ready', methods=['GET'])
+def ready():
+    """就绪检查：所有耗时服务预热完成后才返回200"""
+    services = get_readiness()
+    is_ready = all(services.values())
+    
+    return jsonify({
+        'ready': is_ready,
+        'services': services
+    }), 200 if is_ready else 503
@@ -5,6 +5,7 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db
 from models.user import User
+from models.equipment_profile import EquipmentProfile
 
 user_bp = Blueprint('user', __name__)
 
@@ -54,3 +55,81 @@ def update_profile():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@user_bp.route('/equipment', methods=['GET'])
+@jwt_required()
+def get_equipment():
+    """获取器材配置列表"""
+    try:
+        user_id = get_jwt_identity()
+        profiles = EquipmentProfile.query.filter_by(user_id=user_id).order_by(EquipmentProfile.id).all()
+        
+        return jsonify({
+            'equipment': [profile.to_dict() for profile in profiles]
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@user_bp.route('/equipment', methods=['POST'])
+@jwt_required()
+def add_equipment():
+    """
+    添加器材配置
+
+    必填 name、focal_length（mm）；pixel_size（µm）与 sensor_width（mm）至少填一个，
+    用于天体定位时推算像素比例；只填 pixel_size 时建议同时填 sensor_pixels（传感器宽度方向像素数），
+    上传缩小过的图片时据此修正比例
+    """
+    try:
+        user_id = get_jwt_identity()
+        data = request.get_json() or {}
+        
+        if not data.get('name') or not data.get('focal_length'):
+            return jsonify({'error': '请填写配置名称和焦距'}), 400
+        if not data.get('pixel_size') and not data.get('sensor_width'):
+            return jsonify({'error': '请填写像元尺寸或传感器宽度'}), 400
+        
+        profile = EquipmentProfile(
+            user_id=user_id,
+            name=data['name'],
+            focal_length=float(data['focal_length']),
+            pixel_size=float(data['pixel_size']) if data.get('pixel_size') else None,
+            sensor_width=float(data['sensor_width']) if data.get('sensor_width') else None,
+            sensor_pixels=int(data['sensor_pixels']) if data.get('sensor_pixels') else None,
+            binning=int(data.get('binning') or 1),
+            is_default=bool(data.get('is_default'))
+        )
+        if profile.is_default:
+            EquipmentProfile.query.filter_by(user_id=user_id).update({'is_default': False})
+        db.session.add(profile)
+        db.session.commit()
+        
+        return jsonify({
+            'message': '添加成功',
+            'equipment': profile.to_dict()
+        }), 201
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@user_bp.route('/equipment/<int:profile_id>', methods=['DELETE'])
+@jwt_required()
+def delete_equipment(profile_id):
+    """删除器材配置"""
+    try:
+        user_id = get_jwt_identity()
+        profile = EquipmentProfile.query.filter_by(id=profile_id, user_id=user_id).first()
+        
+        if not profile:
+            return jsonify({'error': '器材配置不存在'}), 404
+        
+        db.session.delete(profile)
+        db.session.commit()
+        
+        return jsonify({
+            'message': '删除成功'
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
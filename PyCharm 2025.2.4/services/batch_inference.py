@@ -0,0 +1,179 @@
+"""
+微批处理推理服务
+将并发到达的单张推理请求在一个很短的时间窗口内聚合成一个批次，
+只做一次前向计算，再把每一行结果分发回对应的调用方
+"""
+import threading
+import queue
+import time
+from collections import deque, Counter
+import numpy as np
+
+
+class _PendingRequest:
+    """等待批处理的单个请求"""
+
+    __slots__ = ('samples', 'enqueued_at', 'event', 'result', 'error')
+
+    def __init__(self, samples):
+        self.samples = samples
+        self.enqueued_at = time.monotonic()
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """微批处理器（线程安全）"""
+
+    def __init__(self, predict_fn, max_batch_size=64, window_ms=5.0, stats_window=10000):
+        """
+        初始化批处理器
+
+        predict_fn: 接收形如 (N, ...) 的数组并返回 (N, ...) 预测结果的函数
+        max_batch_size: 单次前向计算的最大样本数
+        window_ms: 收到第一个请求后最多等待多少毫秒以凑满批次
+        stats_window: 统计队列等待时间时保留的最近样本数
+        """
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._carry = None  # 上一批放不下、留到下一批的请求
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+        # 统计信息
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._queue_waits = deque(maxlen=stats_window)
+        self._inference_times = deque(maxlen=stats_window)
+        self._total_batches = 0
+        self._total_samples = 0
+
+    def _ensure_started(self):
+        """按需启动后台线程"""
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._worker, name='micro-batcher', daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, samples):
+        """
+        提交一个或多个样本并阻塞等待结果
+
+        samples 的第0维为批次维度，返回与其行数相同的预测结果
+        """
+        samples = np.asarray(samples)
+        self._ensure_started()
+
+        request = _PendingRequest(samples)
+        self._queue.put(request)
+        request.event.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect_batch(self):
+        """从队列中收集一个批次"""
+        if self._carry is not None:
+            first, self._carry = self._carry, None
+        else:
+            first = self._queue.get()
+
+        batch = [first]
+        size = len(first.samples)
+        deadline = time.monotonic() + self.window
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + len(request.samples) > self.max_batch_size:
+                # 放不下则留给下一批，保证单批不超过上限
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request.samples)
+
+        return batch
+
+    def _worker(self):
+        """后台批处理循环"""
+        while True:
+            batch = self._collect_batch()
+            started = time.monotonic()
+
+            try:
+                inputs = np.concatenate([r.samples for r in batch], axis=0)
+                outputs = self.predict_fn(inputs)
+                offset = 0
+                for request in batch:
+                    count = len(request.samples)
+                    request.result = outputs[offset:offset + count]
+                    offset += count
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+
+            finished = time.monotonic()
+            self._record(batch, started, finished)
+
+            for request in batch:
+                request.event.set()
+
+    def _record(self, batch, started, finished):
+        """记录批次统计"""
+        size = sum(len(r.samples) for r in batch)
+        with self._stats_lock:
+            self._total_batches += 1
+            self._total_samples += size
+            self._batch_sizes[size] += 1
+            self._inference_times.append(finished - started)
+            for request in batch:
+                self._queue_waits.append(started - request.enqueued_at)
+
+    @staticmethod
+    def _percentiles_ms(values):
+        """计算毫秒级分位数"""
+        if not values:
+            return {'p50': None, 'p95': None, 'p99': None, 'max': None}
+        arr = np.asarray(values) * 1000.0
+        p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+        return {
+            'p50': round(float(p50), 3),
+            'p95': round(float(p95), 3),
+            'p99': round(float(p99), 3),
+            'max': round(float(arr.max()), 3)
+        }
+
+    def get_stats(self):
+        """获取批次大小与排队等待统计"""
+        with self._stats_lock:
+            batch_sizes = dict(sorted(self._batch_sizes.items()))
+            queue_waits = list(self._queue_waits)
+            inference_times = list(self._inference_times)
+            total_batches = self._total_batches
+            total_samples = self._total_samples
+
+        return {
+            'max_batch_size': self.max_batch_size,
+            'window_ms': self.window * 1000.0,
+            'total_batches': total_batches,
+            'total_samples': total_samples,
+            'avg_batch_size': round(total_samples / total_batches, 3) if total_batches else 0,
+            'batch_size_histogram': batch_sizes,
+            'queue_wait_ms': self._percentiles_ms(queue_waits),
+            'inference_ms': self._percentiles_ms(inference_times),
+            'queue_depth': self._queue.qsize()
+        }
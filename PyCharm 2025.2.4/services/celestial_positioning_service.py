@@ -2,113 +2,393 @@
 天体定位服务（Astrometry.net）
 """
 import os
-import requests
+import hashlib
+import hmac
+import json
 import time
+from datetime import datetime, timedelta
+from flask import current_app
 from models import db
 from models.celestial_positioning import CelestialPositioning
+from models.equipment_profile import EquipmentProfile
+from services.solve_hints import collect_hints
+from services.solve_tracker import EventsUnsupported, SolveTracker, TERMINAL_STATUSES
+from utils.http_client import HTTPClient, MultipartFile
+from utils.redis_client import get_redis_client
+from utils.result_cache import ResultCache
 
 class CelestialPositioningService:
-    """天体定位服务类（使用Astrometry.net API）"""
+    """天体定位服务类（使用Astrometry.net API，解析任务在后台跟踪）"""
     
-    def __init__(self, api_url=None, api_key=None):
-        """初始化服务"""
+    def __init__(self, api_url=None, api_key=None, http_client=None, cache=None):
+        """
+        初始化服务
+        
+        http_client: 访问Astrometry服务的共享HTTP客户端；默认按 ASTROMETRY_POOL_SIZE /
+        ASTROMETRY_MAX_RETRIES / ASTROMETRY_CONNECT_TIMEOUT / ASTROMETRY_READ_TIMEOUT 创建
+        ASTROMETRY_NOTIFY 选择得知任务结束的方式（events / long_poll / poll，见 services/solve_tracker.py）
+        cache: 解析结果缓存（ResultCache），为None时按环境变量自动创建
+        """
         self.api_url = api_url or os.getenv('ASTROMETRY_API_URL', 'http://localhost:5000')
         self.api_key = api_key or os.getenv('ASTROMETRY_API_KEY')
+        self.http = http_client or HTTPClient.from_env('ASTROMETRY')
+        # 最长等待时间（秒），超过后记录标记为解析失败
+        self.solve_timeout = float(os.getenv('ASTROMETRY_SOLVE_TIMEOUT', 300))
+        # SSE 在两次查库之间最多等待的秒数（其他Web进程写入的结果靠查库得知）
+        self.event_recheck = float(os.getenv('ASTROMETRY_EVENT_RECHECK', 2))
+        # 后端接收完成回调的地址（Astrometry服务可访问的 .../api/positioning/callback），为空时不使用回调
+        self.callback_url = os.getenv('ASTROMETRY_CALLBACK_URL', '').rstrip('/')
+        self.callback_secret = os.getenv('ASTROMETRY_CALLBACK_SECRET') or os.getenv('JWT_SECRET_KEY', 'jwt-secret-string')
+        # 进程重启时，pending 且没有任务ID的记录超过该秒数才重新上传（更新的可能仍在其他Web进程中上传）
+        self.upload_grace = float(os.getenv('ASTROMETRY_UPLOAD_GRACE', 120))
+        
+        # 解析结果缓存（按图片内容SHA-256）：同一张图片再次提交时直接复用结果，不再上传解析
+        if cache is None and os.getenv('ASTROMETRY_CACHE_ENABLED', '1') == '1':
+            cache = ResultCache(
+                'positioning:solve',
+                max_entries=int(os.getenv('ASTROMETRY_CACHE_MAX_ENTRIES', 10000)),
+                ttl=int(os.getenv('ASTROMETRY_CACHE_TTL', 30 * 24 * 3600)),
+                redis_factory=get_redis_client
+            )
+        self.cache = cache
+        self.tracker = SolveTracker(
+            self,
+            mode=os.getenv('ASTROMETRY_NOTIFY', 'events'),
+            poll_interval=float(os.getenv('ASTROMETRY_POLL_INTERVAL', 2)),
+            timeout=self.solve_timeout,
+            upload_workers=int(os.getenv('ASTROMETRY_UPLOAD_WORKERS', 4)),
+            wait_workers=int(os.getenv('ASTROMETRY_WAIT_WORKERS', 16)),
+            long_poll_wait=float(os.getenv('ASTROMETRY_LONG_POLL_WAIT', 30)),
+            reconcile_interval=float(os.getenv('ASTROMETRY_RECONCILE_INTERVAL', 30))
+        )
     
-    def solve_field(self, image_path, user_id):
-        """解析天体定位"""
-        try:
-            # 上传图片到Astrometry.net
-            with open(image_path, 'rb') as f:
-                files = {'file': f}
-                data = {}
-                if self.api_key:
-                    data['apikey'] = self.api_key
-                
-                # 提交任务
-                upload_url = f"{self.api_url}/upload"
-                response = requests.post(upload_url, files=files, data=data)
-                
-                if response.status_code != 200:
-                    raise Exception(f"上传失败: {response.status_code} - {response.text}")
-                
-                result = response.json()
-                job_id = result.get('job_id')
-                
-                if not job_id:
-                    raise Exception("未获取到任务ID")
-                
-                # 等待任务完成
-                max_wait_time = 300  # 最多等待5分钟
-                start_time = time.time()
-                
-                while time.time() - start_time < max_wait_time:
-                    status_url = f"{self.api_url}/jobs/{job_id}"
-                    status_response = requests.get(status_url)
-                    
-                    if status_response.status_code == 200:
-                        status_data = status_response.json()
-                        status = status_data.get('status')
-                        
-                        if status == 'success':
-                            # 获取结果
-                            result_url = f"{self.api_url}/jobs/{job_id}/info"
-                            result_response = requests.get(result_url)
-                            
-                            if result_response.status_code == 200:
-                                solve_result = result_response.json()
-                                
-                                # 解析结果
-                                calibration = solve_result.get('calibration', {})
-                                ra = calibration.get('ra')
-                                dec = calibration.get('dec')
-                                field_width = calibration.get('field_width')
-                                field_height = calibration.get('field_height')
-                                orientation = calibration.get('orientation')
-                                
-                                # 保存记录
-                                record = CelestialPositioning(
-                                    user_id=user_id,
-                                    image_path=image_path,
-                                    ra=ra,
-                                    dec=dec,
-                                    field_width=field_width,
-                                    field_height=field_height,
-                                    orientation=orientation,
-                                    solved=True,
-                                    solve_time=time.time() - start_time
-                                )
-                                db.session.add(record)
-                                db.session.commit()
-                                
-                                return {
-                                    'solved': True,
-                                    'ra': ra,
-                                    'dec': dec,
-                                    'field_width': field_width,
-                                    'field_height': field_height,
-                                    'orientation': orientation,
-                                    'solve_time': time.time() - start_time
-                                }
-                        
-                        elif status == 'failure':
-                            raise Exception("解析失败")
-                    
-                    time.sleep(2)  # 等待2秒后重试
-                
-                raise Exception("解析超时")
-                
-        except Exception as e:
-            # 保存失败记录
+    def submit(self, image_path, user_id, equipment_id=None, overrides=None, use_hints=True):
+        """
+        创建待解析的定位记录并交给后台跟踪，立即返回记录
+        
+        use_hints 为真时从图片（FITS头、EXIF）、器材配置（equipment_id，未指定时用默认配置）
+        和 overrides（请求中指定的 ra/dec/radius/scale_low/scale_high）推算解析提示
+        
+        同一张图片（内容SHA-256相同）解析成功过时直接写回缓存的结果，记录的 status 即为 success
+        """
+        self.tracker.start(current_app._get_current_object())
+        
+        image_hash = self.image_hash(image_path)
+        cached = self._cache_get(image_hash)
+        if cached is not None:
             record = CelestialPositioning(
                 user_id=user_id,
                 image_path=image_path,
-                solved=False
+                image_hash=image_hash,
+                source_record_id=cached['record_id'],
+                solve_time=0.0,
+                completed_at=datetime.utcnow()
             )
+            self._apply_calibration(record, cached['calibration'])
             db.session.add(record)
             db.session.commit()
+            return record.to_dict()
+        
+        hints = {}
+        if use_hints:
+            hints = collect_hints(image_path, self.get_equipment(user_id, equipment_id), overrides)
+        
+        record = CelestialPositioning(
+            user_id=user_id,
+            image_path=image_path,
+            status='pending',
+            solved=False,
+            hints=json.dumps(hints) if hints else None,
+            image_hash=image_hash
+        )
+        db.session.add(record)
+        db.session.commit()
+        
+        self.tracker.submit(record.id, image_path, hints)
+        return record.to_dict()
+    
+    @staticmethod
+    def image_hash(image_path):
+        """图片内容的SHA-256，读取失败返回None（不使用缓存）"""
+        try:
+            digest = hashlib.sha256()
+            with open(image_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+            return digest.hexdigest()
+        except OSError:
+            return None
+    
+    def _cache_get(self, image_hash):
+        """读取缓存的解析结果 {'record_id', 'calibration'}，未命中返回None"""
+        if self.cache is None or image_hash is None:
+            return None
+        value = self.cache.get(image_hash)
+        return json.loads(value) if value is not None else None
+    
+    def _cache_set(self, image_hash, record_id, calibration):
+        if self.cache is not None and image_hash is not None:
+            self.cache.set(image_hash, json.dumps({'record_id': record_id, 'calibration': calibration}).encode('utf-8'))
+    
+    def get_equipment(self, user_id, equipment_id=None):
+        """用户的器材配置（指定ID或默认配置），没有时返回None"""
+        query = EquipmentProfile.query.filter_by(user_id=user_id)
+        if equipment_id is not None:
+            profile = query.filter_by(id=equipment_id).first()
+        else:
+            profile = query.filter_by(is_default=True).first()
+        return profile.to_dict() if profile else None
+    
+    def upload(self, image_path, record_id=None, hints=None, use_cache=True):
+        """上传图片到Astrometry服务（附带解析提示），返回任务ID；use_cache 为假时服务端不查解析缓存"""
+        data = {}
+        if not use_cache:
+            data['cache'] = '0'
+        if self.api_key:
+            data['apikey'] = self.api_key
+        if self.callback_url and record_id is not None:
+            data['callback_url'] = f"{self.callback_url}/{record_id}?token={self.callback_token(record_id)}"
+        if hints:
+            if 'scale_low' in hints and 'scale_high' in hints:
+                data['scale_units'] = 'arcsecperpix'
+                data['scale_low'] = f"{hints['scale_low']:.4f}"
+                data['scale_high'] = f"{hints['scale_high']:.4f}"
+            if 'ra' in hints and 'dec' in hints:
+                data['ra'] = f"{hints['ra']:.6f}"
+                data['dec'] = f"{hints['dec']:.6f}"
+                data['radius'] = f"{hints.get('radius', 5):.4f}"
+            if hints.get('downsample'):
+                data['downsample'] = str(int(hints['downsample']))
+        
+        with MultipartFile(data, 'file', image_path) as body:
+            response = self.http.post(
+                f"{self.api_url}/upload",
+                data=body,
+                headers={'Content-Type': body.content_type, 'Content-Length': str(len(body))}
+            )
+        
+        if response.status_code != 200:
+            raise Exception(f"上传失败: {response.status_code} - {response.text}")
+        
+        job_id = response.json().get('job_id')
+        if not job_id:
+            raise Exception("未获取到任务ID")
+        return job_id
+    
+    def fetch_status(self, job_id, wait=0):
+        """查询Astrometry任务状态；wait 大于0时长轮询，任务结束或等待 wait 秒后返回"""
+        if wait > 0:
+            connect_timeout, read_timeout = self.http.timeout
+            response = self.http.get(f"{self.api_url}/jobs/{job_id}", params={'wait': wait},
+                                     timeout=(connect_timeout, read_timeout + wait))
+        else:
+            response = self.http.get(f"{self.api_url}/jobs/{job_id}")
+        if response.status_code == 404:
+            # Astrometry服务重启后任务丢失
+            return {'status': 'failure', 'error': "任务不存在"}
+        if response.status_code != 200:
+            raise Exception(f"查询失败: {response.status_code} - {response.text}")
+        return response.json()
+    
+    def fetch_result(self, job_id):
+        """获取解析结果（calibration）"""
+        response = self.http.get(f"{self.api_url}/jobs/{job_id}/info")
+        if response.status_code != 200:
+            raise Exception(f"获取结果失败: {response.status_code} - {response.text}")
+        return response.json().get('calibration', {})
+    
+    def job_events(self, last_event_id=None):
+        """
+        订阅Astrometry服务的任务事件流（SSE），逐个返回 (事件ID, 事件)；心跳返回 (None, None)
+
+        连接保持到服务端关闭或读取超时（服务端每15秒发送心跳）
+        """
+        headers = {'Accept': 'text/event-stream'}
+        if last_event_id is not None:
+            headers['Last-Event-ID'] = str(last_event_id)
+        connect_timeout, read_timeout = self.http.timeout
+        response = self.http.get(f"{self.api_url}/events", headers=headers, stream=True,
+                                 timeout=(connect_timeout, max(read_timeout, 45)))
+        with response:
+            if response.status_code == 404:
+                raise EventsUnsupported()
+            if response.status_code != 200:
+                raise Exception(f"订阅失败: {response.status_code} - {response.text}")
+            
+            event_id, data = None, []
+            # chunk_size=None：收到一个分块就处理，不等凑满缓冲区
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if line is None:
+                    continue
+                if line.startswith(':'):
+                    yield None, None
+                elif line.startswith('id:'):
+                    event_id = line[3:].strip()
+                elif line.startswith('data:'):
+                    data.append(line[5:].strip())
+                elif not line and data:
+                    yield event_id, json.loads('\n'.join(data))
+                    event_id, data = None, []
+    
+    def mark_processing(self, record_id, job_id):
+        """图片已上传，记录Astrometry任务ID；记录已经结束（回调先到）时返回False"""
+        record = CelestialPositioning.query.get(record_id)
+        record.job_id = str(job_id)
+        if record.status in TERMINAL_STATUSES:
+            db.session.commit()
+            return False
+        record.status = 'processing'
+        db.session.commit()
+        return True
+    
+    def complete(self, record_id, calibration, solve_time):
+        """写回解析结果"""
+        record = CelestialPositioning.query.get(record_id)
+        if record is None or record.status in TERMINAL_STATUSES:
+            return
+        self._apply_calibration(record, calibration)
+        record.solve_time = solve_time
+        record.completed_at = datetime.utcnow()
+        db.session.commit()
+        
+        if calibration.get('ra') is not None:
+            self._cache_set(record.image_hash, record.id, calibration)
+    
+    @staticmethod
+    def _apply_calibration(record, calibration):
+        wcs = calibration.get('wcs')
+        record.ra = calibration.get('ra')
+        record.dec = calibration.get('dec')
+        record.field_width = calibration.get('field_width')
+        record.field_height = calibration.get('field_height')
+        record.orientation = calibration.get('orientation')
+        record.wcs = json.dumps(wcs) if wcs else None
+        record.solved = True
+        record.status = 'success'
+    
+    def fail(self, record_id, error):
+        """标记解析失败"""
+        record = CelestialPositioning.query.get(record_id)
+        if record is None or record.status in TERMINAL_STATUSES:
+            return
+        record.solved = False
+        record.status = 'failure'
+        record.error = f"天体定位失败: {error}"
+        record.completed_at = datetime.utcnow()
+        db.session.commit()
+    
+    def retry_without_hints(self, record_id):
+        """
+        带提示的解析失败后准备不带提示重试一次：记录回到 pending，提示中标记 fallback，
+        被替换的任务ID记入 fallback_from（其迟到的回调不再写回记录），返回图片路径；
+        没有提示或已经重试过时返回None
+        """
+        record = CelestialPositioning.query.get(record_id)
+        if record is None or record.status in TERMINAL_STATUSES or not record.hints:
+            return None
+        hints = json.loads(record.hints)
+        if hints.get('fallback'):
+            return None
+        hints['fallback'] = True
+        hints['fallback_at'] = time.time()
+        if record.job_id:
+            hints['fallback_from'] = hints.get('fallback_from', []) + [record.job_id]
+        record.hints = json.dumps(hints)
+        record.status = 'pending'
+        record.job_id = None
+        db.session.commit()
+        return record.image_path
+    
+    def unfinished_jobs(self, timeout):
+        """
+        进程重启前未完成的任务，返回 (jobs, uploads)：
+            jobs：已上传的继续跟踪，[(记录ID, 任务ID, 提交时间戳)]
+            uploads：上传途中进程退出、没有任务ID的重新上传，[(记录ID, 图片路径, 解析提示)]；
+                     进入 pending 不足 upload_grace 秒的可能仍在其他Web进程中上传，不重复提交
+        超过 timeout 秒仍未完成的直接标记为超时
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=timeout)
+        records = CelestialPositioning.query.filter(
+            CelestialPositioning.status.in_(('pending', 'processing'))
+        ).all()
+        
+        jobs = []
+        uploads = []
+        for record in records:
+            submitted_at = time.time() - (datetime.utcnow() - record.created_at).total_seconds()
+            if record.created_at < cutoff:
+                record.status = 'failure'
+                record.error = "天体定位失败: 解析超时"
+                record.completed_at = datetime.utcnow()
+            elif record.status == 'processing' and record.job_id:
+                jobs.append((record.id, record.job_id, submitted_at))
+            elif record.status == 'pending' and not record.job_id:
+                hints = json.loads(record.hints) if record.hints else {}
+                if time.time() - hints.get('fallback_at', submitted_at) >= self.upload_grace:
+                    # 不带提示的重试仍不带提示上传
+                    uploads.append((record.id, record.image_path, None if hints.get('fallback') else hints))
+        db.session.commit()
+        return jobs, uploads
+    
+    def callback_token(self, record_id):
+        """回调地址中的签名，防止伪造回调"""
+        return hmac.new(self.callback_secret.encode('utf-8'), f"positioning:{record_id}".encode('utf-8'),
+                        hashlib.sha256).hexdigest()
+    
+    def handle_callback(self, record_id, token, job):
+        """处理Astrometry服务的完成回调，签名无效返回False"""
+        if not hmac.compare_digest(token or '', self.callback_token(record_id)):
+            return False
+        record = CelestialPositioning.query.get(record_id)
+        if record is None:
+            return False
+        job_id = str(job['job_id']) if job.get('job_id') else None
+        superseded = json.loads(record.hints).get('fallback_from', []) if record.hints else []
+        if job_id and (job_id in superseded or (record.job_id and job_id != record.job_id)):
+            # 不带提示重试前那次任务的迟到回调；重试任务上传完成前 job_id 为空，按 fallback_from 判断
+            return True
+        # 回调可能是本进程收到的第一个定位请求，跟踪器（重试时的后台上传）需要已启动
+        self.tracker.start(current_app._get_current_object())
+        if record.status not in TERMINAL_STATUSES:
+            elapsed = (datetime.utcnow() - record.created_at).total_seconds()
+            self.tracker.handle_callback(record_id, job, elapsed)
+        return True
+    
+    def get_job(self, record_id, user_id):
+        """获取用户的定位记录（含解析状态），不存在返回None"""
+        record = CelestialPositioning.query.filter_by(id=record_id, user_id=user_id).first()
+        return record.to_dict() if record else None
+    
+    def stream_events(self, record_id, user_id):
+        """
+        SSE事件流：状态每变化一次发送一个事件（event为状态，data为记录），到达终止状态后结束
+        
+        本进程的跟踪线程写回结果时立即唤醒；其他进程写回的结果最迟 event_recheck 秒后查库得知
+        """
+        deadline = time.time() + self.solve_timeout + 60
+        last_status = None
+        last_sent = time.time()
+        version = self.tracker.version(record_id)
+        
+        while True:
+            # 结束当前事务，读到其他线程/进程提交的最新状态
+            db.session.rollback()
+            record = self.get_job(record_id, user_id)
+            if record is None:
+                return
             
-            raise Exception(f"天体定位失败: {e}")
+            if record['status'] != last_status:
+                last_status = record['status']
+                last_sent = time.time()
+                yield f"event: {last_status}\ndata: {json.dumps(record, ensure_ascii=False)}\n\n"
+            elif time.time() - last_sent >= 15:
+                # 保持连接，避免被代理断开
+                last_sent = time.time()
+                yield ": keep-alive\n\n"
+            
+            if last_status in TERMINAL_STATUSES or time.time() > deadline:
+                return
+            version = self.tracker.wait(record_id, version, self.event_recheck)
     
     def get_history(self, user_id, limit=20):
         """获取用户历史记录"""
@@ -119,4 +399,11 @@ class CelestialPositioningService:
         ).limit(limit).all()
         
         return [record.to_dict() for record in records]
+    
+    def get_stats(self):
+        """获取后台跟踪状态与解析缓存命中率"""
+        return {
+            'tracker': self.tracker.get_stats(),
+            'cache': self.cache.get_stats() if self.cache else None
+        }
 
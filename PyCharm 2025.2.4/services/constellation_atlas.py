@@ -0,0 +1,361 @@
+"""
+离线星座图谱
+图片已经完成天体定位（有WCS，或中心赤经赤纬 + 视场大小 + 方向角）时，
+直接用几何关系计算视场覆盖了哪些星座及其在图片上的范围与连线，不必调用检测模型
+
+星座边界：IAU星座边界在B1875.0历元下全部由赤经线段和赤纬线段组成，
+Roman (1987, CDS VI/42) 把它表示为按顺序匹配的 (赤经下限, 赤经上限, 赤纬下限, 星座) 矩形表，
+数据文件随 astropy 一起安装（coordinates/data/constellation_data_roman87.dat），
+也可用 CONSTELLATION_BOUNDARY_FILE 指定同格式的文件。
+加载时把它预计算为赤纬分带 + 带内赤经区间的扁平数组，查询只需两次二分查找，结果与逐行匹配完全一致
+
+星座名称与亮星连线：data/constellations/constellations.json（可用 CONSTELLATION_ATLAS_FILE 替换）
+
+查询时在图片上取 samples x samples 的网格点，经TAN投影换算到天球并岁差到B1875.0后查表，
+由各星座占据的网格点得到覆盖比例、外接框与轮廓；小于网格间距的星座碎片可能漏掉
+"""
+import json
+import os
+import threading
+import importlib.util
+import numpy as np
+import cv2
+
+ATLAS_FILE = os.getenv('CONSTELLATION_ATLAS_FILE', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'constellations', 'constellations.json'))
+
+# B1875.0 的儒略日，边界表使用该历元的平赤道与平春分点
+B1875_JD = 2405889.258550475
+
+
+def _default_boundary_file():
+    spec = importlib.util.find_spec('astropy')
+    if spec is None or spec.origin is None:
+        raise Exception('未找到星座边界数据，请安装 astropy 或配置 CONSTELLATION_BOUNDARY_FILE')
+    return os.path.join(os.path.dirname(spec.origin), 'coordinates', 'data', 'constellation_data_roman87.dat')
+
+
+def precession_matrix(jd):
+    """J2000.0 平赤道坐标到儒略日 jd 平赤道坐标的岁差矩阵（IAU 1976）"""
+    t = (jd - 2451545.0) / 36525.0
+    arcsec = np.pi / 180.0 / 3600.0
+    zeta = (2306.2181 * t + 0.30188 * t ** 2 + 0.017998 * t ** 3) * arcsec
+    z = (2306.2181 * t + 1.09468 * t ** 2 + 0.018203 * t ** 3) * arcsec
+    theta = (2004.3109 * t - 0.42665 * t ** 2 - 0.041833 * t ** 3) * arcsec
+
+    def rot_z(angle):
+        c, s = np.cos(angle), np.sin(angle)
+        return np.array([[c, s, 0.0], [-s, c, 0.0], [0.0, 0.0, 1.0]])
+
+    def rot_y(angle):
+        c, s = np.cos(angle), np.sin(angle)
+        return np.array([[c, 0.0, -s], [0.0, 1.0, 0.0], [s, 0.0, c]])
+
+    return rot_z(-z) @ rot_y(theta) @ rot_z(-zeta)
+
+
+def unit_vectors(ra, dec):
+    """赤经、赤纬（度）转单位向量，形状 (..., 3)"""
+    ra, dec = np.radians(ra), np.radians(dec)
+    return np.stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+class FieldGeometry:
+    """
+    图片的TAN（gnomonic）投影
+
+    采用FITS WCS约定：crval 为参考点赤经、赤纬（度），crpix 为参考点像素坐标（从1开始，
+    像素中心为整数），cd 为 2x2 矩阵（度/像素），把像素偏移换算为切平面上的（向东, 向北）坐标。
+    像素坐标轴与图片数组一致：x 向右，y 为行号向下（astrometry.net 对JPEG/PNG的解算结果即如此）
+    """
+
+    def __init__(self, crval, crpix, cd, width, height):
+        self.crval = (float(crval[0]), float(crval[1]))
+        self.crpix = np.asarray(crpix, dtype=np.float64)
+        self.cd = np.asarray(cd, dtype=np.float64).reshape(2, 2)
+        self.cd_inv = np.linalg.inv(self.cd)
+        self.width = int(width)
+        self.height = int(height)
+
+        ra, dec = np.radians(self.crval)
+        east = np.array([-np.sin(ra), np.cos(ra), 0.0])
+        north = np.array([-np.sin(dec) * np.cos(ra), -np.sin(dec) * np.sin(ra), np.cos(dec)])
+        center = np.array([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)])
+        # 列为切平面的（东, 北, 视线）方向，(ξ, η, 1) 乘以它即为天球方向
+        self.basis = np.stack([east, north, center], axis=1)
+
+    @classmethod
+    def from_wcs(cls, header, width=None, height=None):
+        """
+        由WCS头创建：支持 FITS 头（dict 或 astropy Header，CD 或 PC+CDELT 或 CDELT+CROTA2）
+        以及 astropy.wcs.WCS 对象；width/height 为当前图片尺寸，缺省时取 IMAGEW/IMAGEH 或 NAXIS1/NAXIS2，
+        与头中记录的解算尺寸不同时（同一张图片的缩放版本）按比例换算
+        """
+        if hasattr(header, 'wcs') and hasattr(header, 'pixel_scale_matrix'):
+            wcs = header
+            width = width or (wcs.pixel_shape[0] if wcs.pixel_shape else None)
+            height = height or (wcs.pixel_shape[1] if wcs.pixel_shape else None)
+            if width is None or height is None:
+                raise Exception('WCS缺少图片尺寸')
+            return cls(wcs.wcs.crval, wcs.wcs.crpix, wcs.pixel_scale_matrix, width, height)
+
+        ctype = str(header.get('CTYPE1', 'RA---TAN'))
+        if not ctype.startswith('RA'):
+            raise Exception(f'不支持的坐标类型: {ctype}')
+        if 'CD1_1' in header:
+            cd = [[header.get('CD1_1', 0.0), header.get('CD1_2', 0.0)],
+                  [header.get('CD2_1', 0.0), header.get('CD2_2', 0.0)]]
+        else:
+            cdelt = np.array([header['CDELT1'], header['CDELT2']], dtype=np.float64)
+            if 'PC1_1' in header:
+                pc = np.array([[header.get('PC1_1', 1.0), header.get('PC1_2', 0.0)],
+                               [header.get('PC2_1', 0.0), header.get('PC2_2', 1.0)]])
+            else:
+                rotation = np.radians(float(header.get('CROTA2', 0.0)))
+                pc = np.array([[np.cos(rotation), -np.sin(rotation) * cdelt[1] / cdelt[0]],
+                               [np.sin(rotation) * cdelt[0] / cdelt[1], np.cos(rotation)]])
+            cd = pc * cdelt[:, np.newaxis]
+
+        solved_width = header.get('IMAGEW') or header.get('NAXIS1')
+        solved_height = header.get('IMAGEH') or header.get('NAXIS2')
+        width, height = width or solved_width, height or solved_height
+        if not width or not height:
+            raise Exception('WCS缺少图片尺寸')
+        crpix = np.array([header['CRPIX1'], header['CRPIX2']], dtype=np.float64)
+        if solved_width and solved_height and (solved_width, solved_height) != (width, height):
+            # 解算用的图片与当前图片只差缩放时，按比例换算像素坐标
+            ratio = np.array([solved_width / width, solved_height / height])
+            cd = np.asarray(cd, dtype=np.float64) * ratio
+            crpix = (crpix - 0.5) / ratio + 0.5
+        return cls((header['CRVAL1'], header['CRVAL2']), crpix, cd, width, height)
+
+    @classmethod
+    def from_center(cls, ra, dec, field_width, field_height, width, height, orientation=0.0, flipped=False):
+        """
+        由视场中心与大小创建
+
+        field_width/field_height 为视场宽高（度），orientation 为图片"上方"相对正北向东偏转的角度（度，
+        即 astrometry.net 的 "up is N degrees E of N"）；未翻转的图片在正北朝上时东方朝左，flipped=True 表示左右镜像
+        """
+        scale_x, scale_y = field_width / width, field_height / height
+        angle = np.radians(orientation or 0.0)
+        cos, sin = np.cos(angle), np.sin(angle)
+        cd = np.array([[-scale_x * cos, -scale_y * sin],
+                       [scale_x * sin, -scale_y * cos]])
+        if flipped:
+            cd[:, 0] = -cd[:, 0]
+        return cls((ra, dec), (width / 2.0 + 0.5, height / 2.0 + 0.5), cd, width, height)
+
+    def pixel_matrix(self):
+        """3x3矩阵 A：图片坐标 (x, y, 1) 左乘 A 即得天球方向（未归一化）"""
+        affine = np.zeros((3, 3))
+        affine[:2, :2] = np.radians(self.cd)
+        affine[:2, 2] = -affine[:2, :2] @ (self.crpix - 0.5)
+        affine[2, 2] = 1.0
+        return self.basis @ affine
+
+    def pixel_to_vectors(self, x, y):
+        """图片坐标（左上角为原点，像素边缘为整数）转天球方向（未归一化），形状 (..., 3)"""
+        matrix = self.pixel_matrix()
+        return np.asarray(x, dtype=np.float64)[..., np.newaxis] * matrix[:, 0] \
+            + np.asarray(y, dtype=np.float64)[..., np.newaxis] * matrix[:, 1] + matrix[:, 2]
+
+    def vectors_to_pixel(self, vectors):
+        """天球单位向量转图片坐标，返回 (x, y, 是否在视线前方)"""
+        local = vectors @ self.basis
+        front = local[..., 2] > 1e-6
+        depth = np.where(front, local[..., 2], 1.0)
+        plane = np.degrees(local[..., :2] / depth[..., np.newaxis])
+        pixels = plane @ self.cd_inv.T
+        return pixels[..., 0] + self.crpix[0] - 0.5, pixels[..., 1] + self.crpix[1] - 0.5, front
+
+
+class _SortedLookup:
+    """
+    searchsorted(edges, values, side='right') - 1 的常数时间版本
+
+    把取值范围均匀分桶，预先记下每个桶起点之前的最后一个断点；查询时先按桶定位，
+    再把后面仍不大于查询值的断点逐个跳过（桶宽远小于断点间距时通常一步都不用走）。
+    二分查找在无序输入上分支预测失败严重，几千个点就要几百微秒
+    """
+
+    def __init__(self, edges, bucket, upper):
+        edges = np.asarray(edges, dtype=np.float64)
+        self.next_edges = np.append(edges[1:], np.inf)
+        self.origin = edges[0]
+        self.scale = 1.0 / bucket
+        count = int(np.ceil((upper - self.origin) * self.scale)) + 2
+        # 起点略微前移，浮点误差只会让定位偏前（随后向后修正），不会越过正确位置
+        starts = self.origin + (np.arange(count) - 1e-6) * bucket
+        self.table = np.maximum(np.searchsorted(edges, starts, side='right') - 1, 0).astype(np.intp)
+
+    def __call__(self, values):
+        """values 须在 [edges[0], upper] 内"""
+        index = self.table[((values - self.origin) * self.scale).astype(np.intp)]
+        while True:
+            step = values >= self.next_edges[index]
+            if not step.any():
+                return index
+            index += step
+
+
+class ConstellationAtlas:
+    """星座边界索引与连线数据"""
+
+    def __init__(self, boundary_file=None, atlas_file=None):
+        boundary_file = boundary_file or os.getenv('CONSTELLATION_BOUNDARY_FILE') or _default_boundary_file()
+        with open(atlas_file or ATLAS_FILE, encoding='utf-8') as f:
+            catalog = json.load(f)['constellations']
+
+        self.abbrs = list(catalog)
+        self.info = [catalog[abbr] for abbr in self.abbrs]
+        self._build_boundaries(boundary_file)
+        self._build_lines()
+        self.precession = precession_matrix(B1875_JD)
+
+    def _build_boundaries(self, boundary_file):
+        """
+        把按顺序匹配的边界矩形表预计算为分带查找表
+
+        某赤纬落在相邻两个不同的"赤纬下限"之间时，满足"赤纬 >= 下限"的行集合相同，
+        于是每个赤纬带内星座只随赤经分段变化；各带的赤经断点加上 带号*24 后拼成一个递增数组
+        """
+        index = {abbr: i for i, abbr in enumerate(self.abbrs)}
+        rows = []
+        with open(boundary_file, encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) < 4 or line.startswith('#'):
+                    continue
+                rows.append((float(parts[0]), float(parts[1]), float(parts[2]), index[parts[3]]))
+        ra_low, ra_high, dec_low, labels = (np.array(column) for column in zip(*rows))
+
+        self.dec_edges = np.unique(np.append(dec_low, -90.0))
+        keys, values = [], []
+        for band, edge in enumerate(self.dec_edges):
+            candidates = np.flatnonzero(dec_low <= edge)
+            breaks = np.unique(np.concatenate([[0.0, 24.0], ra_low[candidates], ra_high[candidates]]))
+            starts = breaks[:-1]
+            middles = (breaks[:-1] + breaks[1:]) / 2.0
+            # 每个区间取表中第一个覆盖它的行
+            covers = (ra_low[candidates][:, np.newaxis] <= middles) & (middles < ra_high[candidates][:, np.newaxis])
+            first = covers.argmax(axis=0)
+            band_labels = np.where(covers.any(axis=0), labels[candidates][first], -1)
+            # 合并相邻的同名区间
+            keep = np.concatenate([[True], band_labels[1:] != band_labels[:-1]])
+            keys.append(band * 24.0 + starts[keep])
+            values.append(band_labels[keep])
+        self.band_keys = np.concatenate(keys)
+        self.band_labels = np.concatenate(values).astype(np.int16)
+        self._find_band = _SortedLookup(self.dec_edges, 0.01, 90.0)
+        self._find_interval = _SortedLookup(self.band_keys, 1.0 / 60.0, len(self.dec_edges) * 24.0)
+
+    def _build_lines(self):
+        """连线拆成线段，端点为J2000单位向量"""
+        starts, ends, owners = [], [], []
+        for i, info in enumerate(self.info):
+            stars = info.get('stars')
+            if not stars:
+                continue
+            vectors = unit_vectors(*np.array(stars, dtype=np.float64).T)
+            for polyline in info.get('lines', []):
+                for a, b in zip(polyline[:-1], polyline[1:]):
+                    starts.append(vectors[a])
+                    ends.append(vectors[b])
+                    owners.append(i)
+        # 起点在前、终点在后拼成一个数组，查询时一次投影
+        self.segment_points = np.concatenate([np.array(starts).reshape(-1, 3), np.array(ends).reshape(-1, 3)])
+        self.segment_owners = np.array(owners, dtype=np.int16)
+
+    def lookup_vectors(self, vectors):
+        """J2000天球方向（不必归一化）所属星座的下标"""
+        precessed = np.moveaxis(vectors @ self.precession.T, -1, 0)
+        return self._lookup_components(*(np.ascontiguousarray(c) for c in precessed))
+
+    def _lookup_components(self, x, y, z):
+        """B1875.0天球方向（x, y, z 分量各为一个数组）所属星座的下标"""
+        ra = np.arctan2(y, x)
+        ra *= 12.0 / np.pi
+        ra %= 24.0
+        dec = np.arctan2(z, np.sqrt(x * x + y * y))
+        dec *= 180.0 / np.pi
+        ra += self._find_band(dec) * 24.0
+        return self.band_labels[self._find_interval(ra)]
+
+    def lookup(self, ra, dec):
+        """J2000赤经、赤纬（度）所属星座的缩写"""
+        labels = self.lookup_vectors(unit_vectors(ra, dec))
+        return np.array(self.abbrs)[labels]
+
+    def identify(self, field, samples=None, with_lines=True):
+        """
+        识别视场内的星座
+
+        返回按覆盖比例降序的列表，每项与检测模型的结果格式一致（x、y、width、height 为外接框中心与宽高），
+        另含 abbr、name_zh、coverage（覆盖图片的比例）、footprint（轮廓多边形列表）与 lines（连线线段）
+        """
+        samples = samples or int(os.getenv('CONSTELLATION_ATLAS_SAMPLES', 48))
+        step_x, step_y = field.width / (samples - 1), field.height / (samples - 1)
+        # 岁差并入投影矩阵；网格点天球方向的三个分量分别由行、列两个方向的增量相加得到
+        matrix = self.precession @ field.pixel_matrix()
+        steps = np.arange(samples, dtype=np.float64)
+        x, y, z = (np.add.outer(steps * (step_y * matrix[i, 1]) + matrix[i, 2], steps * (step_x * matrix[i, 0]))
+                   for i in range(3))
+        labels = self._lookup_components(x, y, z)
+
+        segments = self._visible_segments(field) if with_lines else {}
+        scale = np.array([step_x, step_y])
+        counts = np.bincount(labels.ravel(), minlength=len(self.abbrs))
+        results = []
+        for label in np.flatnonzero(counts):
+            contours, _ = cv2.findContours((labels == label).view(np.uint8),
+                                           cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            footprint = [contour.reshape(-1, 2) * scale for contour in contours]
+            points = np.concatenate(footprint)
+            (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+            info = self.info[label]
+            results.append({
+                'class': info['name'],
+                'abbr': self.abbrs[label],
+                'name_zh': info['name_zh'],
+                'confidence': 1.0,
+                'x': float(x0 + x1) / 2.0,
+                'y': float(y0 + y1) / 2.0,
+                'width': float(x1 - x0),
+                'height': float(y1 - y0),
+                'coverage': round(float(counts[label]) / labels.size, 4),
+                'footprint': [polygon.round(1).tolist() for polygon in footprint],
+                'lines': segments.get(int(label), [])
+            })
+        results.sort(key=lambda item: item['coverage'], reverse=True)
+        return results
+
+    def _visible_segments(self, field):
+        """投影连线线段，保留与图片相交的（两端都在视线前方），按星座分组"""
+        if not len(self.segment_owners):
+            return {}
+        x, y, front = field.vectors_to_pixel(self.segment_points)
+        count = len(self.segment_owners)
+        x0, x1, y0, y1 = x[:count], x[count:], y[:count], y[count:]
+        visible = front[:count] & front[count:] \
+            & (np.maximum(x0, x1) >= 0) & (np.minimum(x0, x1) <= field.width) \
+            & (np.maximum(y0, y1) >= 0) & (np.minimum(y0, y1) <= field.height)
+        segments = {}
+        for i in np.flatnonzero(visible):
+            segments.setdefault(int(self.segment_owners[i]), []).append(
+                [round(float(x0[i]), 1), round(float(y0[i]), 1), round(float(x1[i]), 1), round(float(y1[i]), 1)])
+        return segments
+
+
+_atlas = None
+_atlas_lock = threading.Lock()
+
+
+def get_atlas():
+    """进程内共享的星座图谱（首次使用时加载）"""
+    global _atlas
+    if _atlas is None:
+        with _atlas_lock:
+            if _atlas is None:
+                _atlas = ConstellationAtlas()
+    return _atlas
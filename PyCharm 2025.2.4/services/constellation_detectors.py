@@ -0,0 +1,287 @@
+"""
+本地星座检测模型
+在本进程内用CPU运行导出的轻量检测模型，代替每次调用 Roboflow 检测接口
+
+模型格式为 YOLO 系列导出的 ONNX / TFLite（例如在 Roboflow 上下载 YOLOv8 权重后
+`yolo export model=best.pt format=onnx imgsz=640`），推理复用星系分类的 onnxruntime / tflite 后端：
+    输入：(N, 3, H, W) 或 (N, H, W, 3)，RGB，0~1，等比缩放后四周填充灰色（letterbox）
+    输出：(N, 4+类别数, 候选数)（YOLOv8）或 (N, 候选数, 5+类别数)（YOLOv5，含目标置信度），
+          框为输入图上的中心点格式 (x, y, width, height)，也可为0~1的归一化坐标
+解码后按类别做NMS，框坐标换算回原图，输出与 Roboflow 相同的 class/confidence/x/y/width/height 格式
+
+并发的单张请求通过微批处理合并为一次前向计算
+"""
+import ast
+import json
+import os
+import threading
+from collections import deque
+import numpy as np
+import cv2
+from PIL import Image
+from services.batch_inference import MicroBatcher
+from services.inference_backends import create_backend
+
+# 单张图片最多保留的检测框数
+MAX_DETECTIONS = 100
+
+
+def iou(a, b):
+    """两个中心点格式 (x, y, width, height) 检测框的交并比"""
+    ax0, ay0, ax1, ay1 = a['x'] - a['width'] / 2, a['y'] - a['height'] / 2, a['x'] + a['width'] / 2, a['y'] + a['height'] / 2
+    bx0, by0, bx1, by1 = b['x'] - b['width'] / 2, b['y'] - b['height'] / 2, b['x'] + b['width'] / 2, b['y'] + b['height'] / 2
+    inter = max(0.0, min(ax1, bx1) - max(ax0, bx0)) * max(0.0, min(ay1, by1) - max(ay0, by0))
+    union = a['width'] * a['height'] + b['width'] * b['height'] - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match_detections(reference, candidate, threshold=0.5):
+    """按置信度从高到低贪心匹配同类别、IoU不低于阈值的检测框，返回 [(参考检测, 候选检测, IoU)]"""
+    remaining = list(candidate)
+    pairs = []
+    for ref in sorted(reference, key=lambda d: d.get('confidence', 0), reverse=True):
+        scored = [(iou(ref, c), c) for c in remaining if c.get('class') == ref.get('class')]
+        if not scored:
+            continue
+        score, best = max(scored, key=lambda item: item[0])
+        if score >= threshold:
+            pairs.append((ref, best, score))
+            remaining.remove(best)
+    return pairs
+
+
+def _load_labels(labels, model_path, runner):
+    """
+    类别名称：labels 参数（列表，或每行一个名称的文本文件 / JSON列表文件），
+    其次是 ultralytics 导出的ONNX模型元数据中的 names
+    """
+    if isinstance(labels, (list, tuple)):
+        return list(labels)
+    if labels:
+        with open(labels, encoding='utf-8') as f:
+            if labels.endswith('.json'):
+                data = json.load(f)
+                return [data[str(i)] for i in range(len(data))] if isinstance(data, dict) else list(data)
+            return [line.strip() for line in f if line.strip()]
+    session = getattr(runner, 'session', None)
+    if session is not None:
+        names = session.get_modelmeta().custom_metadata_map.get('names')
+        if names:
+            names = ast.literal_eval(names)
+            return [names[i] for i in sorted(names)] if isinstance(names, dict) else list(names)
+    raise Exception(f'未找到星座检测模型的类别名称，请配置 CONSTELLATION_LOCAL_LABELS（{model_path}）')
+
+
+class LocalConstellationDetector:
+    """本地星座检测模型（线程安全）"""
+
+    def __init__(self, model_path, backend=None, labels=None, confidence=0.4, overlap=0.3,
+                 max_batch_size=8, window_ms=5.0):
+        """
+        backend: onnxruntime / tflite，默认按模型文件扩展名选择
+        confidence、overlap: 与 Roboflow 请求参数（confidence=40、overlap=30）对应的置信度阈值与NMS的IoU阈值
+        max_batch_size、window_ms: 微批处理的最大批次与等待窗口，window_ms 为0时不合并请求
+        """
+        self.backend_name = backend or ('tflite' if model_path.endswith('.tflite') else 'onnxruntime')
+        self.model_path = model_path
+        self.runner = create_backend(self.backend_name, model_path)
+        self.labels = _load_labels(labels, model_path, self.runner)
+        self.confidence = confidence
+        self.overlap = overlap
+
+        if self.backend_name == 'tflite':
+            shape = [int(d) for d in self.runner.input_detail['shape']]
+            # TFLite 可以按批次大小重新分配输入张量
+            self._fixed_batch = None
+        else:
+            shape = self.runner.session.get_inputs()[0].shape
+            self._fixed_batch = shape[0] if isinstance(shape[0], int) and shape[0] > 0 else None
+        self.channels_first = shape[1] == 3
+        self.input_height, self.input_width = (shape[2], shape[3]) if self.channels_first else (shape[1], shape[2])
+
+        self.batcher = MicroBatcher(self._predict, max_batch_size=max_batch_size, window_ms=window_ms) \
+            if window_ms > 0 else None
+
+    @classmethod
+    def from_env(cls):
+        model_path = os.getenv('CONSTELLATION_LOCAL_MODEL_PATH', 'models/constellation_detector.onnx')
+        if not os.path.exists(model_path):
+            raise Exception(f"本地星座检测模型不存在: {model_path}")
+        return cls(
+            model_path,
+            backend=os.getenv('CONSTELLATION_LOCAL_BACKEND') or None,
+            labels=os.getenv('CONSTELLATION_LOCAL_LABELS') or None,
+            confidence=float(os.getenv('CONSTELLATION_LOCAL_CONFIDENCE', 0.4)),
+            overlap=float(os.getenv('CONSTELLATION_LOCAL_OVERLAP', 0.3)),
+            max_batch_size=int(os.getenv('CONSTELLATION_LOCAL_MAX_BATCH', 8)),
+            window_ms=float(os.getenv('CONSTELLATION_LOCAL_BATCH_WINDOW_MS', 5))
+        )
+
+    def _predict(self, batch):
+        """一次前向计算；导出时固定了批次大小的模型按固定大小分块"""
+        if self._fixed_batch is None or len(batch) == self._fixed_batch:
+            return self.runner.predict(batch)
+        outputs = []
+        for start in range(0, len(batch), self._fixed_batch):
+            chunk = batch[start:start + self._fixed_batch]
+            count = len(chunk)
+            if count < self._fixed_batch:
+                chunk = np.concatenate([chunk, np.zeros((self._fixed_batch - count,) + chunk.shape[1:], chunk.dtype)])
+            outputs.append(self.runner.predict(chunk)[:count])
+        return np.concatenate(outputs)
+
+    def preprocess(self, image_path):
+        """
+        等比缩放并填充到模型输入尺寸，返回 (输入张量, 换算参数)
+
+        换算参数为 (x方向缩放, y方向缩放, 左填充, 上填充)，JPEG用draft模式按比例解码
+        """
+        with Image.open(image_path) as img:
+            width, height = img.size
+            scale = min(self.input_width / width, self.input_height / height)
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            img.draft('RGB', size)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            if img.size != size:
+                img = img.resize(size, Image.BILINEAR, reducing_gap=1.0)
+            pixels = np.asarray(img)
+
+        left, top = (self.input_width - size[0]) // 2, (self.input_height - size[1]) // 2
+        canvas = np.full((self.input_height, self.input_width, 3), 114, dtype=np.uint8)
+        canvas[top:top + size[1], left:left + size[0]] = pixels
+        tensor = canvas.astype(np.float32) * (1.0 / 255.0)
+        if self.channels_first:
+            tensor = tensor.transpose(2, 0, 1)
+        return tensor, (size[0] / width, size[1] / height, left, top)
+
+    def decode(self, output, transform):
+        """把单张图片的原始输出解码为检测结果（原图坐标），按置信度降序"""
+        output = np.asarray(output, dtype=np.float32)
+        # 统一为 (候选数, 通道数)：候选数远多于通道数
+        rows = output.T if output.shape[0] < output.shape[1] else output
+        if rows.shape[1] == 5 + len(self.labels):
+            scores = rows[:, 5:] * rows[:, 4:5]
+        else:
+            scores = rows[:, 4:4 + len(self.labels)]
+
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences >= self.confidence
+        boxes, class_ids, confidences = rows[keep, :4].copy(), class_ids[keep], confidences[keep]
+        if not len(boxes):
+            return []
+        if boxes.max() <= 2.0:
+            # 归一化坐标（部分TFLite导出）
+            boxes *= [self.input_width, self.input_height, self.input_width, self.input_height]
+
+        corners = np.concatenate([boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, 2:]], axis=1)
+        kept = cv2.dnn.NMSBoxesBatched(corners.tolist(), confidences.tolist(), class_ids.tolist(),
+                                       self.confidence, self.overlap)
+        kept = np.asarray(kept, dtype=np.int64).reshape(-1)[:MAX_DETECTIONS]
+
+        scale_x, scale_y, left, top = transform
+        detections = []
+        for i in kept:
+            x, y, w, h = boxes[i]
+            detections.append({
+                'class': self.labels[class_ids[i]],
+                'confidence': float(confidences[i]),
+                'x': float((x - left) / scale_x),
+                'y': float((y - top) / scale_y),
+                'width': float(w / scale_x),
+                'height': float(h / scale_y)
+            })
+        detections.sort(key=lambda d: d['confidence'], reverse=True)
+        return detections
+
+    def detect_batch(self, image_paths):
+        """检测多张图片，返回每张图片的检测结果列表"""
+        if not image_paths:
+            return []
+        prepared = [self.preprocess(path) for path in image_paths]
+        batch = np.stack([tensor for tensor, _ in prepared])
+        outputs = self.batcher.submit(batch) if self.batcher else self._predict(batch)
+        return [self.decode(output, transform) for output, (_, transform) in zip(outputs, prepared)]
+
+    def detect(self, image_path):
+        """检测单张图片，并发调用会被合并为同一批次"""
+        return self.detect_batch([image_path])[0]
+
+
+class DetectorStats:
+    """单个检测后端的调用统计：请求数、失败数、平均检测数与延迟分位数（线程安全）"""
+
+    def __init__(self, window=10000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.detections = 0
+
+    def record(self, seconds, detections=None):
+        """detections 为None表示调用失败"""
+        with self._lock:
+            self.requests += 1
+            if detections is None:
+                self.errors += 1
+                return
+            self.detections += len(detections)
+            self._latencies.append(seconds)
+
+    def get_stats(self):
+        with self._lock:
+            latencies = list(self._latencies)
+            requests, errors, detections = self.requests, self.errors, self.detections
+        succeeded = requests - errors
+        return {
+            'requests': requests,
+            'errors': errors,
+            'avg_detections': round(detections / succeeded, 3) if succeeded else None,
+            'latency_ms': MicroBatcher._percentiles_ms(latencies)
+        }
+
+
+class AgreementStats:
+    """
+    本地模型与 Roboflow 对同一张图片的检测结果的一致性（以 Roboflow 为参考）
+
+    precision / recall 按同类别、IoU不低于阈值的匹配计数，top1 为置信度最高的类别相同的比例
+    """
+
+    def __init__(self, iou_threshold=0.5):
+        self.iou_threshold = iou_threshold
+        self._lock = threading.Lock()
+        self.compared = 0
+        self.matched = 0
+        self.reference = 0
+        self.candidate = 0
+        self.top1_matched = 0
+        self._iou_sum = 0.0
+
+    def record(self, reference, candidate):
+        pairs = match_detections(reference, candidate, self.iou_threshold)
+        top = lambda detections: max(detections, key=lambda d: d['confidence'])['class'] if detections else None
+        with self._lock:
+            self.compared += 1
+            self.matched += len(pairs)
+            self.reference += len(reference)
+            self.candidate += len(candidate)
+            self.top1_matched += top(reference) == top(candidate)
+            self._iou_sum += sum(score for _, _, score in pairs)
+
+    def get_stats(self):
+        with self._lock:
+            compared, matched, reference, candidate = self.compared, self.matched, self.reference, self.candidate
+            top1_matched, iou_sum = self.top1_matched, self._iou_sum
+        precision = matched / candidate if candidate else None
+        recall = matched / reference if reference else None
+        return {
+            'compared': compared,
+            'iou_threshold': self.iou_threshold,
+            'precision': round(precision, 4) if precision is not None else None,
+            'recall': round(recall, 4) if recall is not None else None,
+            'f1': round(2 * matched / (reference + candidate), 4) if reference + candidate else None,
+            'top1_agreement': round(top1_matched / compared, 4) if compared else None,
+            'mean_iou': round(iou_sum / matched, 4) if matched else None
+        }
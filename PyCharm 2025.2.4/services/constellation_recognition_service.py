@@ -1,57 +1,334 @@
 """
 星座识别服务
 """
+import io
 import os
-import requests
 import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
 from models import db
+from models.celestial_positioning import CelestialPositioning
 from models.constellation_recognition import ConstellationRecognition
+from services.constellation_atlas import FieldGeometry, get_atlas
+from services.constellation_detectors import AgreementStats, DetectorStats, LocalConstellationDetector
+from utils.http_client import HTTPClient, MultipartFile
+from utils.near_duplicate_cache import NearDuplicateCache
+from utils.perceptual_hash import image_hashes, to_hex, from_hex
+from utils.redis_client import get_redis_client
+
+# 检测路由：remote 只用Roboflow，local 只用本地模型，local_first 先用本地模型、失败或没有可信结果时再调用Roboflow
+DETECTOR_MODES = ('remote', 'local', 'local_first')
 
 class ConstellationRecognitionService:
-    """星座识别服务类（使用Roboflow API）"""
+    """星座识别服务类（已有天体定位结果时用离线星座图谱，否则使用本地检测模型或Roboflow API）"""
     
-    def __init__(self, api_key=None, model_id=None):
-        """初始化服务"""
+    def __init__(self, api_key=None, model_id=None, http_client=None, dedup_cache=None,
+                 detector_mode=None, local_detector=None):
+        """
+        初始化服务
+
+        http_client: 共享的HTTP客户端；默认按 ROBOFLOW_POOL_SIZE / ROBOFLOW_MAX_RETRIES /
+        ROBOFLOW_CONNECT_TIMEOUT / ROBOFLOW_READ_TIMEOUT 创建，所有请求复用同一个连接池
+        dedup_cache: 近重复结果缓存（NearDuplicateCache），为None时按环境变量自动创建
+        detector_mode: 检测路由（remote / local / local_first），默认读取 CONSTELLATION_DETECTOR
+        local_detector: 本地检测模型（LocalConstellationDetector），为None时首次使用时按环境变量加载
+        """
         self.api_key = api_key or os.getenv('ROBOFLOW_API_KEY')
         self.model_id = model_id or os.getenv('ROBOFLOW_MODEL_ID', 'ws-qwbuh/constellation-dsphi/1')
-        self.base_url = f"https://detect.roboflow.com/{self.model_id}"
-    
-    def recognize(self, image_path, user_id):
-        """识别星座"""
-        if not self.api_key:
-            raise Exception("Roboflow API密钥未配置")
+        self.api_url = os.getenv('ROBOFLOW_API_URL', 'https://detect.roboflow.com').rstrip('/')
+        self.base_url = f"{self.api_url}/{self.model_id}"
+        self.http = http_client or HTTPClient.from_env('ROBOFLOW')
+        # 上传前把图片长边缩小到该尺寸并重新编码为JPEG，0 表示上传原图
+        self.max_dimension = int(os.getenv('ROBOFLOW_MAX_DIMENSION', 1280))
+        self.jpeg_quality = int(os.getenv('ROBOFLOW_JPEG_QUALITY', 90))
         
+        # 近重复缓存：与之前识别过的图片感知哈希足够接近时直接复用其结果，不再调用Roboflow
+        if dedup_cache is None and os.getenv('CONSTELLATION_DEDUP_ENABLED', '1') == '1':
+            dedup_cache = NearDuplicateCache(
+                'constellation:dedup',
+                max_distance=int(os.getenv('CONSTELLATION_DEDUP_DISTANCE', 8)),
+                max_entries=int(os.getenv('CONSTELLATION_DEDUP_MAX_ENTRIES', 10000)),
+                ttl=int(os.getenv('CONSTELLATION_DEDUP_TTL', 30 * 24 * 3600)),
+                redis_client=get_redis_client()
+            )
+        self.dedup = dedup_cache
+        self._warmed = False
+        self._warm_lock = threading.Lock()
+        
+        self.detector_mode = detector_mode or os.getenv('CONSTELLATION_DETECTOR', 'remote')
+        if self.detector_mode not in DETECTOR_MODES:
+            raise ValueError(f"不支持的检测路由: {self.detector_mode}（可选: {', '.join(DETECTOR_MODES)}）")
+        self._local_detector = local_detector
+        self._local_lock = threading.Lock()
+        # local_first 模式下本地结果的最高置信度低于该值时改用Roboflow
+        self.fallback_confidence = float(os.getenv('CONSTELLATION_LOCAL_FALLBACK_CONFIDENCE', 0.5))
+        # 按该比例在后台用另一个后端重复检测同一张图片，统计两者结果的一致性（会额外消耗Roboflow调用次数）
+        self.shadow_rate = float(os.getenv('CONSTELLATION_SHADOW_RATE', 0))
+        self._shadow_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='constellation-shadow')
+        self.detector_stats = {'local': DetectorStats(), 'remote': DetectorStats()}
+        self.agreement = AgreementStats()
+        self.fallbacks = 0
+    
+    def prepare_image(self, image_path):
+        """
+        准备上传的图片
+
+        长边超过 max_dimension 或不是JPEG时，缩小并重新编码为JPEG（JPEG用draft模式按比例解码）；
+        返回 (文件路径或内存文件, 文件名, (x方向比例, y方向比例))，比例用于把检测框换算回原图坐标。
+        无法解码或为16位/浮点图像时原样上传
+        """
+        if not self.max_dimension:
+            return image_path, None, (1.0, 1.0)
         try:
-            # 读取图片
-            with open(image_path, 'rb') as f:
-                image_data = f.read()
+            img = Image.open(image_path)
+        except Exception:
+            return image_path, None, (1.0, 1.0)
+        
+        with img:
+            width, height = img.size
+            if (max(width, height) <= self.max_dimension and img.format == 'JPEG') \
+                    or img.mode in ('I', 'I;16', 'F'):
+                return image_path, None, (1.0, 1.0)
+            
+            scale = min(self.max_dimension / max(width, height), 1.0)
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            img.draft('RGB', size)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            if img.size != size:
+                # 先按整数倍做区域平均降采样再插值，大图缩放耗时降到几分之一
+                img = img.resize(size, Image.LANCZOS, reducing_gap=1.0)
             
-            # 调用Roboflow API
-            response = requests.post(
+            # draft 已按目标尺寸解码时 img 仍是原文件的延迟解码对象，须在文件关闭前编码
+            buffer = io.BytesIO()
+            img.save(buffer, 'JPEG', quality=self.jpeg_quality)
+            buffer.seek(0)
+        return buffer, 'image.jpg', (width / size[0], height / size[1])
+    
+    def detect(self, image_path):
+        """调用Roboflow检测接口，返回 predictions 列表（坐标已换算为原图坐标）"""
+        upload, filename, (scale_x, scale_y) = self.prepare_image(image_path)
+        
+        # 图片按块流式上传；5xx/429 由客户端带抖动重试，重试时请求体自动回绕
+        with MultipartFile({'overlap': 30, 'confidence': 40}, 'file', upload, filename) as body:
+            response = self.http.post(
                 self.base_url,
                 params={'api_key': self.api_key},
-                files={'file': image_data},
-                data={'overlap': 30, 'confidence': 40}
+                data=body,
+                headers={'Content-Type': body.content_type}
             )
+        
+        if response.status_code != 200:
+            raise Exception(f"API调用失败: {response.status_code} - {response.text}")
+        
+        predictions = response.json().get('predictions', [])
+        if scale_x != 1.0 or scale_y != 1.0:
+            for prediction in predictions:
+                for key, scale in (('x', scale_x), ('width', scale_x), ('y', scale_y), ('height', scale_y)):
+                    if key in prediction:
+                        prediction[key] = prediction[key] * scale
+        return predictions
+    
+    def get_local_detector(self):
+        """本地检测模型（首次使用时加载）"""
+        if self._local_detector is None:
+            with self._local_lock:
+                if self._local_detector is None:
+                    self._local_detector = LocalConstellationDetector.from_env()
+        return self._local_detector
+    
+    def _timed_detect(self, backend, image_path):
+        """用指定后端检测并记录耗时"""
+        detect = self.get_local_detector().detect if backend == 'local' else self.detect
+        started = time.perf_counter()
+        try:
+            predictions = detect(image_path)
+        except Exception:
+            self.detector_stats[backend].record(time.perf_counter() - started, None)
+            raise
+        self.detector_stats[backend].record(time.perf_counter() - started, predictions)
+        return predictions
+    
+    def run_detection(self, image_path):
+        """按检测路由选择后端，返回 (检测结果, 后端名)"""
+        if self.detector_mode == 'remote':
+            backend, predictions = 'remote', self._timed_detect('remote', image_path)
+        elif self.detector_mode == 'local':
+            backend, predictions = 'local', self._timed_detect('local', image_path)
+        else:
+            try:
+                predictions = self._timed_detect('local', image_path)
+            except Exception as e:
+                if not self.api_key:
+                    raise
+                print(f"本地星座检测失败，改用Roboflow: {e}")
+                predictions = None
             
-            if response.status_code != 200:
-                raise Exception(f"API调用失败: {response.status_code} - {response.text}")
-            
-            result = response.json()
-            
-            # 解析结果
-            detections = result.get('predictions', [])
-            detected_constellations = []
+            if predictions is not None and \
+                    max((p.get('confidence', 0) for p in predictions), default=0) >= self.fallback_confidence:
+                backend = 'local'
+            elif self.api_key:
+                self.fallbacks += 1
+                backend, predictions = 'remote', self._timed_detect('remote', image_path)
+            else:
+                backend = 'local'
+        
+        if self.shadow_rate > 0 and random.random() < self.shadow_rate:
+            self._shadow_executor.submit(self._shadow_detect, image_path, backend, predictions)
+        return predictions, backend
+    
+    def _shadow_detect(self, image_path, backend, predictions):
+        """用另一个后端重复检测，以Roboflow结果为参考记录一致性"""
+        other = 'remote' if backend == 'local' else 'local'
+        if other == 'remote' and not self.api_key:
+            return
+        try:
+            shadow = self._timed_detect(other, image_path)
+        except Exception as e:
+            print(f"星座检测对照失败（{other}）: {e}")
+            return
+        if backend == 'remote':
+            self.agreement.record(predictions, shadow)
+        else:
+            self.agreement.record(shadow, predictions)
+    
+    def _warm_dedup(self):
+        """
+        进程内缓存首次使用时，用最近的识别记录（已保存感知哈希的）预热；
+        使用Redis时缓存本身是持久的，无需预热
+        """
+        if self._warmed or self.dedup is None or self.dedup.redis is not None:
+            return
+        with self._warm_lock:
+            if self._warmed:
+                return
+            records = ConstellationRecognition.query.filter(
+                ConstellationRecognition.image_phash.isnot(None),
+                ConstellationRecognition.source_record_id.is_(None)
+            ).order_by(
+                ConstellationRecognition.id.desc()
+            ).limit(self.dedup.max_entries).all()
             
-            for detection in detections:
-                detected_constellations.append({
-                    'class': detection.get('class', ''),
-                    'confidence': detection.get('confidence', 0),
-                    'x': detection.get('x', 0),
-                    'y': detection.get('y', 0),
-                    'width': detection.get('width', 0),
-                    'height': detection.get('height', 0)
+            for record in reversed(records):
+                try:
+                    with Image.open(record.image_path) as img:
+                        size = img.size
+                except Exception:
+                    continue
+                self.dedup.add(record.id, from_hex(record.image_phash), from_hex(record.image_dhash), {
+                    'record_id': record.id,
+                    'size': list(size),
+                    'detected_constellations': json.loads(record.detected_constellations or '[]')
                 })
+            self._warmed = True
+    
+    @staticmethod
+    def _rescale(detections, from_size, to_size):
+        """把近重复图片的检测框按两张图片的尺寸比例换算到当前图片坐标"""
+        scale_x, scale_y = to_size[0] / from_size[0], to_size[1] / from_size[1]
+        return [dict(d, x=d['x'] * scale_x, y=d['y'] * scale_y,
+                     width=d['width'] * scale_x, height=d['height'] * scale_y) for d in detections]
+    
+    def get_solution(self, positioning_id, user_id):
+        """取用户已成功解析的天体定位记录，返回定位结果（dict）或 None"""
+        record = CelestialPositioning.query.filter_by(id=positioning_id, user_id=user_id, solved=True).first()
+        if record is None or record.ra is None:
+            return None
+        return dict(record.to_dict(), positioning_id=record.id)
+    
+    @staticmethod
+    def _fits_solution(image_path):
+        """带天球坐标WCS的FITS图片本身就是定位结果"""
+        if image_path.rsplit('.', 1)[-1].lower() not in ('fits', 'fit'):
+            return None
+        from astropy.io import fits
+        with fits.open(image_path) as hdul:
+            for hdu in hdul:
+                if hdu.header.get('NAXIS', 0) >= 2 and str(hdu.header.get('CTYPE1', '')).startswith('RA'):
+                    return {'wcs': dict(hdu.header)}
+        return None
+    
+    @staticmethod
+    def _image_size(image_path, solution):
+        wcs = solution.get('wcs') or {}
+        if wcs.get('NAXIS1') and wcs.get('NAXIS2'):
+            return wcs['NAXIS1'], wcs['NAXIS2']
+        with Image.open(image_path) as img:
+            return img.size
+    
+    def identify_from_solution(self, image_path, solution):
+        """
+        由天体定位结果离线计算视场内的星座（不调用Roboflow）
+
+        solution 含 wcs（WCS头）时按WCS投影，否则用 ra、dec、field_width、field_height、orientation；
+        结果与检测结果格式一致，另含星座缩写、中文名、覆盖比例、轮廓与连线
+        """
+        width, height = self._image_size(image_path, solution)
+        if solution.get('wcs'):
+            field = FieldGeometry.from_wcs(solution['wcs'], width, height)
+        else:
+            field = FieldGeometry.from_center(
+                solution['ra'], solution['dec'], solution['field_width'], solution['field_height'],
+                width, height, orientation=solution.get('orientation') or 0.0
+            )
+        return get_atlas().identify(field)
+    
+    def recognize(self, image_path, user_id, solution=None):
+        """
+        识别星座
+
+        solution: 该图片的天体定位结果（见 get_solution）；为None时若图片是带WCS的FITS则直接使用其WCS。
+        有定位结果时优先用离线星座图谱计算，不调用Roboflow
+        """
+        try:
+            if solution is None:
+                try:
+                    solution = self._fits_solution(image_path)
+                except Exception:
+                    solution = None
+            if solution is not None:
+                return self._recognize_from_solution(image_path, user_id, solution)
+        except Exception as e:
+            raise Exception(f"星座识别失败: {e}")
+        
+        if self.detector_mode == 'remote' and not self.api_key:
+            raise Exception("Roboflow API密钥未配置")
+        
+        try:
+            # 计算感知哈希并查找近重复图片（无法解码时跳过缓存）
+            hashes = match = None
+            if self.dedup is not None:
+                try:
+                    hashes = image_hashes(image_path)
+                except Exception:
+                    hashes = None
+            if hashes is not None:
+                self._warm_dedup()
+                match = self.dedup.lookup(hashes[0], hashes[1])
+            
+            backend = None
+            if match is not None:
+                cached, distance = match
+                detected_constellations = self._rescale(cached['detected_constellations'], cached['size'], hashes[2])
+            else:
+                # 按检测路由调用本地模型或Roboflow API
+                detections, backend = self.run_detection(image_path)
+                
+                # 解析结果
+                detected_constellations = []
+                
+                for detection in detections:
+                    detected_constellations.append({
+                        'class': detection.get('class', ''),
+                        'confidence': detection.get('confidence', 0),
+                        'x': detection.get('x', 0),
+                        'y': detection.get('y', 0),
+                        'width': detection.get('width', 0),
+                        'height': detection.get('height', 0)
+                    })
             
             # 计算平均置信度
             avg_confidence = sum(d['confidence'] for d in detected_constellations) / len(detected_constellations) if detected_constellations else 0
@@ -61,20 +338,73 @@ class ConstellationRecognitionService:
                 user_id=user_id,
                 image_path=image_path,
                 detected_constellations=json.dumps(detected_constellations, ensure_ascii=False),
-                confidence=avg_confidence
+                confidence=avg_confidence,
+                image_phash=to_hex(hashes[0]) if hashes else None,
+                image_dhash=to_hex(hashes[1]) if hashes else None,
+                source_record_id=match[0]['record_id'] if match else None
             )
             db.session.add(record)
             db.session.commit()
             
+            if hashes is not None and match is None:
+                self.dedup.add(record.id, hashes[0], hashes[1], {
+                    'record_id': record.id,
+                    'size': list(hashes[2]),
+                    'detected_constellations': detected_constellations
+                })
+            
             return {
                 'detected_constellations': detected_constellations,
                 'count': len(detected_constellations),
-                'confidence': avg_confidence
+                'confidence': avg_confidence,
+                'method': 'detection',
+                'detector': backend,
+                'cached': match is not None,
+                'source_record_id': record.source_record_id,
+                'hash_distance': match[1] if match else None
             }
             
         except Exception as e:
             raise Exception(f"星座识别失败: {e}")
     
+    def _recognize_from_solution(self, image_path, user_id, solution):
+        """按天体定位结果识别并保存记录"""
+        detected_constellations = self.identify_from_solution(image_path, solution)
+        
+        record = ConstellationRecognition(
+            user_id=user_id,
+            image_path=image_path,
+            detected_constellations=json.dumps(detected_constellations, ensure_ascii=False),
+            confidence=1.0 if detected_constellations else 0,
+            positioning_id=solution.get('positioning_id')
+        )
+        db.session.add(record)
+        db.session.commit()
+        
+        return {
+            'detected_constellations': detected_constellations,
+            'count': len(detected_constellations),
+            'confidence': record.confidence,
+            'method': 'plate_solve',
+            'positioning_id': record.positioning_id,
+            'cached': False,
+            'source_record_id': None,
+            'hash_distance': None
+        }
+    
+    def get_stats(self):
+        """获取近重复缓存与各检测后端的统计"""
+        return {
+            'dedup': self.dedup.get_stats() if self.dedup else None,
+            'detector': {
+                'mode': self.detector_mode,
+                'backends': {name: stats.get_stats() for name, stats in self.detector_stats.items()},
+                'fallbacks': self.fallbacks,
+                'shadow_rate': self.shadow_rate,
+                'agreement': self.agreement.get_stats()
+            }
+        }
+    
     def get_history(self, user_id, limit=20):
         """获取用户历史记录"""
         records = ConstellationRecognition.query.filter_by(
@@ -0,0 +1,265 @@
+"""
+星系图像特征向量索引
+保存分类模型倒数第二层输出的特征向量，用于"查找与这张图相似的星系"
+
+目录结构（每个模型版本一个目录，不同版本的特征不可混用）：
+    models/embeddings/<模型版本>/
+        meta.json        {"dim": 256}
+        vectors.f16      L2归一化后的float16向量，按行追加
+        ids.i64          与向量逐行对应的分类记录ID
+        ivf.npz          可选的倒排索引（聚类中心与各行所属的簇）
+
+多个进程可以同时追加和查询：追加时持有文件锁，查询前按文件大小发现新写入的行
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+import numpy as np
+
+_VECTOR_DTYPE = np.dtype(np.float16)
+_ID_DTYPE = np.dtype(np.int64)
+
+
+def _normalize(vectors):
+    """L2归一化，归一化后内积即余弦相似度"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(scores, k):
+    """返回得分最高的 k 个位置（按得分降序）"""
+    if len(scores) <= k:
+        return np.argsort(-scores)
+    top = np.argpartition(-scores, k)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class EmbeddingIndex:
+    """
+    增量更新的特征向量索引
+
+    默认在内存中保留一份float32矩阵做暴力内积检索；
+    构建倒排索引（build_ivf）后只在最近的 nprobe 个簇内检索，适合百万级以上的向量
+    """
+
+    def __init__(self, root, nprobe=None):
+        self.root = root
+        self.nprobe = nprobe or int(os.getenv('GALAXY_IVF_NPROBE', 16))
+        self.dim = None
+        self.count = 0
+
+        self._lock = threading.RLock()
+        self._ids = np.empty(0, dtype=_ID_DTYPE)
+        self._rows = {}           # 记录ID -> 行号
+        self._vectors = None      # float16内存映射
+        self._matrix = None       # 暴力检索用的float32矩阵（预留容量，按需翻倍）
+        self._ivf = None          # (聚类中心, 各簇行号列表, 构建时的行数)
+        self._ivf_mtime = None
+
+        self._queries = 0
+        self._query_time = 0.0
+
+        self._load_meta()
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def _load_meta(self):
+        try:
+            with open(self._path('meta.json'), 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+        except (OSError, ValueError, KeyError):
+            self.dim = None
+
+    def _stored_count(self):
+        """磁盘上完整写入的行数"""
+        if self.dim is None:
+            return 0
+        try:
+            ids = os.path.getsize(self._path('ids.i64')) // _ID_DTYPE.itemsize
+            vectors = os.path.getsize(self._path('vectors.f16')) // (self.dim * _VECTOR_DTYPE.itemsize)
+        except OSError:
+            return 0
+        return min(ids, vectors)
+
+    def add(self, ids, vectors):
+        """追加向量（可由多个进程并发调用）"""
+        vectors = _normalize(vectors).astype(_VECTOR_DTYPE)
+        ids = np.asarray(ids, dtype=_ID_DTYPE)
+        if len(ids) != len(vectors):
+            raise ValueError('ids 与 vectors 行数不一致')
+        if not len(ids):
+            return
+
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._path('.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            self._load_meta()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                with open(self._path('meta.json'), 'w', encoding='utf-8') as f:
+                    json.dump({'dim': self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"特征维度不一致: {vectors.shape[1]} != {self.dim}")
+
+            # 上次写入中途失败时两个文件行数可能不一致，先截断到一致的行数
+            count = self._stored_count()
+            with open(self._path('vectors.f16'), 'ab') as f:
+                f.truncate(count * self.dim * _VECTOR_DTYPE.itemsize)
+                f.write(vectors.tobytes())
+            with open(self._path('ids.i64'), 'ab') as f:
+                f.truncate(count * _ID_DTYPE.itemsize)
+                f.write(ids.tobytes())
+
+    def refresh(self):
+        """加载其他进程（或本进程）新追加的行"""
+        with self._lock:
+            if self.dim is None:
+                self._load_meta()
+            count = self._stored_count()
+            self._refresh_ivf()
+            if count == self.count:
+                return
+
+            self._vectors = np.memmap(self._path('vectors.f16'), dtype=_VECTOR_DTYPE,
+                                      mode='r', shape=(count, self.dim))
+            ids = np.fromfile(self._path('ids.i64'), dtype=_ID_DTYPE, count=count)
+            for row in range(self.count, count):
+                self._rows[int(ids[row])] = row
+
+            if self._ivf is None:
+                self._grow_matrix(count)
+            self._ids = ids
+            self.count = count
+
+    def _grow_matrix(self, count):
+        """把新增的行转换为float32追加到内存矩阵"""
+        capacity = 0 if self._matrix is None else len(self._matrix)
+        if count > capacity:
+            matrix = np.empty((max(count, capacity * 2, 1024), self.dim), dtype=np.float32)
+            if self._matrix is not None:
+                matrix[:self.count] = self._matrix[:self.count]
+            self._matrix = matrix
+        self._matrix[self.count:count] = self._vectors[self.count:count]
+
+    def _refresh_ivf(self):
+        """倒排索引文件有更新时重新加载"""
+        try:
+            mtime = os.path.getmtime(self._path('ivf.npz'))
+        except OSError:
+            return
+        if mtime == self._ivf_mtime:
+            return
+
+        with np.load(self._path('ivf.npz')) as data:
+            centroids, assignments = data['centroids'], data['assignments']
+        order = np.argsort(assignments, kind='stable')
+        bounds = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+        lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(centroids))]
+
+        self._ivf = (centroids, lists, len(assignments))
+        self._ivf_mtime = mtime
+        # 倒排索引模式下直接从内存映射读取候选行，不再保留整份float32矩阵
+        self._matrix = None
+
+    def __contains__(self, record_id):
+        return int(record_id) in self._rows
+
+    def vector(self, record_id):
+        """取出某条记录的向量，不存在返回None"""
+        self.refresh()
+        row = self._rows.get(int(record_id))
+        if row is None:
+            return None
+        return np.asarray(self._vectors[row], dtype=np.float32)
+
+    def search(self, query, k=10, exclude=None):
+        """
+        检索与 query 最相似的 k 条记录
+
+        返回 [(记录ID, 余弦相似度), ...]，按相似度降序；exclude 为要排除的记录ID
+        """
+        self.refresh()
+        if not self.count:
+            return []
+
+        started = time.perf_counter()
+        query = _normalize(query).reshape(-1)
+        want = k + (1 if exclude is not None else 0)
+
+        with self._lock:
+            if self._ivf is None:
+                candidates = None
+                scores = self._matrix[:self.count] @ query
+            else:
+                centroids, lists, built = self._ivf
+                probe = _top_k(centroids @ query, self.nprobe)
+                # 构建倒排索引之后新增的行尚未分簇，全部参与比较
+                candidates = np.concatenate(
+                    [lists[i] for i in probe] + [np.arange(built, self.count)]
+                )
+                candidates.sort()
+                scores = np.asarray(self._vectors[candidates], dtype=np.float32) @ query
+
+            top = _top_k(scores, want)
+            rows = top if candidates is None else candidates[top]
+            matches = [(int(self._ids[row]), float(score)) for row, score in zip(rows, scores[top])]
+
+        matches = [(record_id, score) for record_id, score in matches if record_id != exclude][:k]
+        self._queries += 1
+        self._query_time += time.perf_counter() - started
+        return matches
+
+    def build_ivf(self, nlist=None, iterations=10, sample_size=200000, chunk_size=65536):
+        """
+        用k-means构建倒排索引并写入 ivf.npz
+
+        nlist: 簇数，默认约为 sqrt(行数)
+        """
+        self.refresh()
+        if not self.count:
+            raise ValueError('索引为空')
+
+        count = self.count
+        nlist = nlist or max(int(np.sqrt(count)), 1)
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(count, min(sample_size, count), replace=False))
+        sample = np.asarray(self._vectors[sample], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), min(nlist, len(sample)), replace=False)]
+
+        # 球面k-means：按内积分配，中心归一化
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+
+        assignments = np.empty(count, dtype=np.int32)
+        for start in range(0, count, chunk_size):
+            block = np.asarray(self._vectors[start:start + chunk_size], dtype=np.float32)
+            assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        tmp_path = self._path(f'ivf.{os.getpid()}.tmp.npz')
+        np.savez(tmp_path, centroids=centroids.astype(np.float32), assignments=assignments)
+        os.replace(tmp_path, self._path('ivf.npz'))
+        print(f"倒排索引已构建: {count} 条向量，{len(centroids)} 个簇")
+        return len(centroids)
+
+    def get_stats(self):
+        """索引统计"""
+        self.refresh()
+        return {
+            'count': self.count,
+            'dim': self.dim,
+            'mode': 'ivf' if self._ivf is not None else 'flat',
+            'ivf_lists': len(self._ivf[0]) if self._ivf is not None else None,
+            'unclustered': self.count - self._ivf[2] if self._ivf is not None else None,
+            'queries': self._queries,
+            'avg_query_ms': self._query_time / self._queries * 1000 if self._queries else None
+        }
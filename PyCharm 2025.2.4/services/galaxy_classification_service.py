@@ -2,11 +2,23 @@
 星系分类服务
 """
 import os
+import hashlib
+import threading
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from PIL import Image
-import tensorflow as tf
 from models import db
 from models.galaxy_classification import GalaxyClassification
+from services.batch_inference import MicroBatcher
+from services.inference_backends import create_backend, file_version, DEFAULT_MODEL_PATHS
+from services.inference_client import SidecarBackend
+from services.model_registry import ModelRegistry, FORMAT_BACKENDS
+from utils.redis_client import get_redis_client
+from utils.result_cache import ResultCache
+from utils.image_preprocess import load_image_tensor
+from services.source_detection import load_frame, detect_sources, extract_cutout
+from services.embedding_index import EmbeddingIndex
 
 class GalaxyClassificationService:
     """星系分类服务类"""
@@ -25,77 +37,764 @@ class GalaxyClassificationService:
         9: '恒星（Star）'
     }
     
-    def __init__(self, model_path='models/galaxy_classification_model.h5'):
-        """初始化服务"""
-        self.model_path = model_path
-        self.model = None
-        self.load_model()
+    # 模型输入尺寸
+    INPUT_SHAPE = (69, 69, 3)
+    
+    def __init__(self, model_path=None, backend=None,
+                 batch_window_ms=None, max_batch_size=None, cache=None,
+                 background_load=True, watch_registry=True):
+        """
+        初始化服务
+
+        model_path: 模型文件路径；未指定时优先使用模型仓库的线上版本，否则取所选后端的默认路径
+        backend: 推理后端（keras / tflite / onnxruntime），默认读取 GALAXY_BACKEND
+        batch_window_ms: 微批处理等待窗口（毫秒），为0时关闭微批处理
+        max_batch_size: 单次前向计算的最大图片数
+        cache: 预测结果缓存（ResultCache），为None时按环境变量自动创建
+        background_load: 是否在后台线程中加载并预热模型，不阻塞进程启动
+        watch_registry: 是否监视模型仓库并跟进其他进程切换的线上版本（离线脚本可关闭）
+        """
+        # 配置了推理边车时，本进程不加载模型，张量发给边车推理
+        self.sidecar_socket = os.getenv('GALAXY_INFERENCE_SOCKET')
+        self.backend_name = backend or os.getenv('GALAXY_BACKEND', 'keras')
+        
+        # 显式指定模型路径时固定使用该文件，否则跟随模型仓库的线上版本
+        self.registry = ModelRegistry()
+        self.pinned_path = model_path or os.getenv('GALAXY_MODEL_PATH')
+        self.model_path = self.pinned_path or DEFAULT_MODEL_PATHS.get(
+            self.backend_name, DEFAULT_MODEL_PATHS['keras']
+        )
+        
+        # 当前模型与版本号作为一个整体替换，热切换时不会出现新模型配旧版本号
+        self._active = (None, None)
+        self._swap_lock = threading.Lock()
+        self.swap_state = None
+        
+        # 加载状态：pending / loading / ready / failed
+        self.state = 'pending'
+        self.load_time = None
+        self._loaded = threading.Event()
+        
+        # 预测结果缓存（按图片内容哈希+模型版本）
+        if cache is None and os.getenv('GALAXY_CACHE_ENABLED', '1') == '1':
+            cache = ResultCache(
+                'galaxy:pred',
+                max_entries=int(os.getenv('GALAXY_CACHE_MAX_ENTRIES', 10000)),
+                ttl=int(os.getenv('GALAXY_CACHE_TTL', 7 * 24 * 3600)),
+                redis_factory=get_redis_client
+            )
+        self.cache = cache
+        
+        # 相似星系检索：特征向量按模型版本分目录保存
+        self.similarity_enabled = os.getenv('GALAXY_SIMILARITY_ENABLED', '1') == '1'
+        self.embedding_root = os.getenv('GALAXY_EMBEDDING_DIR', 'models/embeddings')
+        self._indexes = {}
+        self._indexes_lock = threading.Lock()
+        
+        # 级联推理：配置了小模型时先用小模型分类，置信度低于阈值的图片再交给完整模型
+        self.fast_model_path = os.getenv('GALAXY_FAST_MODEL_PATH')
+        self.cascade_threshold = float(os.getenv('GALAXY_CASCADE_THRESHOLD', 0.9))
+        self.fast_model = None
+        self.fast_version = None
+        self._cascade_lock = threading.Lock()
+        self._cascade_stats = {
+            'images': 0,
+            'fast_accepted': 0,
+            'fast_time': 0.0,
+            'full_images': 0,
+            'full_time': 0.0
+        }
+        
+        # 微批处理配置
+        if batch_window_ms is None:
+            batch_window_ms = float(os.getenv('GALAXY_BATCH_WINDOW_MS', 5))
+        if max_batch_size is None:
+            max_batch_size = int(os.getenv('GALAXY_MAX_BATCH_SIZE', 64))
+        
+        self.batcher = None
+        if batch_window_ms > 0 and max_batch_size > 1:
+            self.batcher = MicroBatcher(
+                self._predict_batch,
+                max_batch_size=max_batch_size,
+                window_ms=batch_window_ms
+            )
+        
+        if background_load:
+            threading.Thread(target=self.load_model, name='galaxy-model-loader', daemon=True).start()
+        else:
+            self.load_model()
+        
+        # 其他进程切换线上版本后，本进程自动跟进
+        if watch_registry and not self.pinned_path and not self.sidecar_socket:
+            self.registry.watch(self.activate_version, float(os.getenv('GALAXY_REGISTRY_POLL', 5)))
+    
+    @property
+    def model(self):
+        """当前使用的推理后端"""
+        return self._active[0]
+    
+    @property
+    def model_version(self):
+        """当前模型版本（推理边车模式下取边车最近一次返回的版本）"""
+        model, version = self._active
+        return getattr(model, 'model_version', None) or version
+    
+    def _resolve_model(self, version=None):
+        """确定要加载的模型，返回 (后端名, 模型路径, 版本号)"""
+        if self.pinned_path is None:
+            version = version or self.registry.current_version()
+            if version:
+                info = self.registry.get(version)
+                if info is None:
+                    raise Exception(f"模型版本不存在: {version}")
+                return info['backend'], info['path'], version
+        
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"模型文件不存在: {self.model_path}")
+        return self.backend_name, self.model_path, file_version(self.model_path)
+    
+    def _load_and_warm(self, backend_name, model_path):
+        """加载模型并做一次预热前向计算，触发图追踪与内存分配，避免首个请求承担这部分开销"""
+        model = create_backend(backend_name, model_path)
+        warmup = np.zeros((1,) + self.INPUT_SHAPE, dtype=np.float32)
+        model.predict(warmup)
+        if self.similarity_enabled and hasattr(model, 'predict_with_embeddings'):
+            model.predict_with_embeddings(warmup)
+        return model
     
     def load_model(self):
-        """加载模型"""
-        if os.path.exists(self.model_path):
+        """加载模型并做一次预热前向计算"""
+        self.state = 'loading'
+        started = time.time()
+        try:
+            if self.fast_model_path:
+                self._load_fast_model()
+            
+            if self.sidecar_socket:
+                self._connect_sidecar(started)
+                return
+            
             try:
-                self.model = tf.keras.models.load_model(self.model_path)
-                print(f"模型加载成功: {self.model_path}")
+                backend_name, model_path, version = self._resolve_model()
+                model = self._load_and_warm(backend_name, model_path)
+                
+                self.backend_name, self.model_path = backend_name, model_path
+                self._active = (model, version)
+                self.load_time = time.time() - started
+                self.state = 'ready'
+                print(f"模型加载成功: {model_path}（后端: {backend_name}，版本 {version}，耗时 {self.load_time:.2f}s）")
             except Exception as e:
                 print(f"模型加载失败: {e}")
-                self.model = None
-        else:
-            print(f"模型文件不存在: {self.model_path}")
-            self.model = None
+                self.state = 'failed'
+        finally:
+            self._loaded.set()
     
-    def preprocess_image(self, image_path):
-        """预处理图片"""
+    def _load_fast_model(self):
+        """加载级联第一级的小模型（推理边车模式下同样在本进程中加载）；失败时关闭级联"""
         try:
-            img = Image.open(image_path)
-            img = img.convert('RGB')
-            img = img.resize((69, 69))  # Galaxy10数据集图片尺寸
-            img_array = np.array(img) / 255.0
-            img_array = np.expand_dims(img_array, axis=0)
-            return img_array
+            backend_name = os.getenv('GALAXY_FAST_BACKEND') or FORMAT_BACKENDS.get(
+                self.fast_model_path.rsplit('.', 1)[-1].lower(), 'keras'
+            )
+            model = create_backend(backend_name, self.fast_model_path)
+            model.predict(np.zeros((1,) + self.INPUT_SHAPE, dtype=np.float32))
+            self.fast_model = model
+            self.fast_version = file_version(self.fast_model_path)
+            print(f"级联小模型加载成功: {self.fast_model_path}（阈值 {self.cascade_threshold}）")
         except Exception as e:
-            raise Exception(f"图片预处理失败: {e}")
+            print(f"级联小模型加载失败，仅使用完整模型: {e}")
     
-    def classify(self, image_path, user_id):
-        """分类星系图片"""
+    def activate_version(self, version, publish=False):
+        """
+        热切换到模型仓库中的指定版本
+
+        新模型在调用线程中加载并预热，完成后与版本号一起原子替换；
+        切换前已取得旧模型的请求继续用旧模型算完，不会中断
+
+        publish 为真时在加载、预热成功后才把该版本写入模型仓库的线上版本，加载失败时线上版本不变，
+        其他进程不会跟进到无法加载的版本；推理边车模式下本进程不加载模型，见 _activate_sidecar
+        """
+        with self._swap_lock:
+            if self.sidecar_socket:
+                return self._activate_sidecar(version, publish)
+            
+            if version == self._active[1]:
+                if publish:
+                    self.registry.set_current(version)
+                return version
+            
+            requested = version
+            self.swap_state = {'version': version, 'status': 'loading', 'started_at': time.time()}
+            try:
+                backend_name, model_path, version = self._resolve_model(version)
+                model = self._load_and_warm(backend_name, model_path)
+                if publish:
+                    self.registry.set_current(requested)
+            except Exception as e:
+                self.swap_state.update(status='failed', error=str(e))
+                raise
+            
+            previous = self._active[1]
+            self.backend_name, self.model_path = backend_name, model_path
+            self._active = (model, version)
+            self.state = 'ready'
+            self._loaded.set()
+            self.swap_state.update(status='done', previous=previous, finished_at=time.time())
+            print(f"模型已切换: {previous} -> {version}")
+            return version
+    
+    def _activate_sidecar(self, version, publish):
+        """
+        推理边车模式下的热切换
+
+        模型由边车加载、预热并切换，Web进程不加载模型；边车切换成功后才写入线上版本。
+        边车会自行跟进其他进程发布的版本，比较前先向边车查询它当前的版本
+        """
+        model = self.model
+        if model is None:
+            raise Exception("推理边车未连接")
+        
+        model.info()
+        previous = model.model_version
+        if version != previous:
+            self.swap_state = {'version': version, 'status': 'loading', 'started_at': time.time()}
+            try:
+                model.activate(version)
+                if publish:
+                    self.registry.set_current(version)
+            except Exception as e:
+                self.swap_state.update(status='failed', error=str(e))
+                raise
+            self.swap_state.update(status='done', previous=previous, finished_at=time.time())
+            print(f"推理边车模型已切换: {previous} -> {version}")
+        elif publish:
+            self.registry.set_current(version)
+        
+        self._active = (model, model.model_version)
+        return version
+    
+    def activate_version_async(self, version, publish=False):
+        """在后台线程中热切换模型版本（publish 见 activate_version）"""
+        thread = threading.Thread(
+            target=self.activate_version, args=(version, publish), name='galaxy-model-swap', daemon=True
+        )
+        thread.start()
+        return thread
+    
+    def _connect_sidecar(self, started):
+        """连接推理边车；边车可能晚于Web进程启动，在超时前持续重试"""
+        model = SidecarBackend(self.sidecar_socket)
+        deadline = started + float(os.getenv('GALAXY_SIDECAR_CONNECT_TIMEOUT', 60))
+        
+        while True:
+            try:
+                model.predict(np.zeros((1,) + self.INPUT_SHAPE, dtype=np.float32))
+                break
+            except Exception as e:
+                if time.time() >= deadline:
+                    print(f"推理边车连接失败: {self.sidecar_socket}: {e}")
+                    self.state = 'failed'
+                    return
+                time.sleep(1)
+        
+        self.backend_name = 'sidecar'
+        self._active = (model, model.model_version)
+        self.load_time = time.time() - started
+        self.state = 'ready'
+        print(f"已连接推理边车: {self.sidecar_socket}（模型版本 {self.model_version}）")
+    
+    def is_ready(self):
+        """模型是否已加载并预热完成"""
+        return self.state == 'ready'
+    
+    def require_model(self, timeout=None):
+        """确保模型可用；模型仍在加载时最多等待 timeout 秒"""
+        if self.model:
+            return
+        if timeout is None:
+            timeout = float(os.getenv('GALAXY_READY_TIMEOUT', 30))
+        self._loaded.wait(timeout)
         if not self.model:
+            if self.state in ('pending', 'loading'):
+                raise Exception("模型正在加载，请稍后重试")
             raise Exception("模型未加载，请先训练模型")
+    
+    @staticmethod
+    def _cache_key(data, model_version):
+        """缓存键：模型版本 + 图片字节的SHA-256"""
+        return f"{model_version}:{hashlib.sha256(data).hexdigest()}"
+    
+    def _cache_get(self, key):
+        """读取缓存的预测向量，未命中返回None"""
+        if self.cache is None:
+            return None
+        value = self.cache.get(key)
+        if value is None:
+            return None
+        return np.frombuffer(value, dtype=np.float32)
+    
+    def _cache_set(self, key, prediction):
+        """写入预测向量"""
+        if self.cache is not None:
+            self.cache.set(key, np.asarray(prediction, dtype=np.float32).tobytes())
+    
+    def _predict_full(self, batch):
+        """
+        用完整模型执行一次前向计算
+
+        后端支持特征提取时，特征向量拼接在分类概率之后一并返回，由 _split 拆开；
+        推理边车的模型不支持特征提取时只返回分类概率
+        """
+        model = self.model
+        if self.similarity_enabled and hasattr(model, 'predict_with_embeddings'):
+            probabilities, features = model.predict_with_embeddings(batch)
+            if features is None:
+                return probabilities
+            return np.concatenate([probabilities, features], axis=-1)
+        return model.predict(batch)
+    
+    def _predict_batch(self, batch, cascade=True):
+        """
+        对一个批次执行推理
+
+        启用级联时先由小模型计算，top-1置信度不低于阈值的行直接采用小模型结果，
+        其余行再交给完整模型；小模型采纳的行没有特征向量，对应位置填NaN
+        """
+        batch = np.asarray(batch, dtype=np.float32)
+        fast_model = self.fast_model
+        if not cascade or fast_model is None:
+            return self._predict_full(batch)
+        
+        started = time.perf_counter()
+        fast_outputs = np.asarray(fast_model.predict(batch), dtype=np.float32)
+        fast_time = time.perf_counter() - started
         
+        uncertain = np.nonzero(fast_outputs.max(axis=1) < self.cascade_threshold)[0]
+        outputs = fast_outputs
+        full_time = 0.0
+        if len(uncertain):
+            started = time.perf_counter()
+            full_outputs = self._predict_full(batch[uncertain])
+            full_time = time.perf_counter() - started
+            if full_outputs.shape[1] > fast_outputs.shape[1]:
+                outputs = np.full((len(batch), full_outputs.shape[1]), np.nan, dtype=np.float32)
+                outputs[:, :fast_outputs.shape[1]] = fast_outputs
+            outputs[uncertain] = full_outputs
+        
+        with self._cascade_lock:
+            stats = self._cascade_stats
+            stats['images'] += len(batch)
+            stats['fast_accepted'] += len(batch) - len(uncertain)
+            stats['fast_time'] += fast_time
+            stats['full_images'] += len(uncertain)
+            stats['full_time'] += full_time
+        
+        return outputs
+    
+    def _result_version(self, model_version):
+        """写入结果与缓存键的版本号；启用级联时附加小模型版本与阈值"""
+        if self.fast_model is None:
+            return model_version
+        return f"{model_version}+{self.fast_version}@{self.cascade_threshold:g}"
+    
+    def get_cascade_stats(self):
+        """级联推理各级的命中率与耗时"""
+        if self.fast_model is None:
+            return None
+        with self._cascade_lock:
+            stats = dict(self._cascade_stats)
+        images, full_images = stats['images'], stats['full_images']
+        return {
+            'threshold': self.cascade_threshold,
+            'fast_version': self.fast_version,
+            'images': images,
+            'fast_hit_rate': stats['fast_accepted'] / images if images else None,
+            'full_rate': full_images / images if images else None,
+            'fast_ms_per_image': stats['fast_time'] / images * 1000 if images else None,
+            'full_ms_per_image': stats['full_time'] / full_images * 1000 if full_images else None,
+            'avg_ms_per_image': (stats['fast_time'] + stats['full_time']) / images * 1000 if images else None
+        }
+    
+    def _split(self, outputs):
+        """把 _predict_batch 的输出拆成 (分类概率, 特征向量或None)"""
+        num_classes = len(self.GALAXY10_CLASSES)
+        if outputs.shape[-1] > num_classes:
+            return outputs[..., :num_classes], outputs[..., num_classes:]
+        return outputs, None
+    
+    def embed_batch(self, batch):
+        """
+        只用完整模型计算一批预处理好的图片（N, 69, 69, 3）的特征向量
+
+        返回 (N, D) 的数组；当前推理后端不支持特征提取时返回None
+        """
+        _, embeddings = self._split(self._predict_batch(np.asarray(batch, dtype=np.float32), cascade=False))
+        return embeddings
+    
+    def get_index(self, model_version=None):
+        """取得指定模型版本（默认当前版本）的特征向量索引"""
+        model_version = model_version or self.model_version
+        with self._indexes_lock:
+            index = self._indexes.get(model_version)
+            if index is None:
+                index = EmbeddingIndex(os.path.join(self.embedding_root, model_version))
+                self._indexes[model_version] = index
+            return index
+    
+    def _index_add(self, model_version, record_ids, embeddings):
+        """把新记录的特征向量加入索引；失败不影响分类结果"""
+        # 级联中由小模型采纳的行没有特征向量
+        keep = np.isfinite(embeddings).all(axis=1)
+        record_ids = [record_id for record_id, ok in zip(record_ids, keep) if ok]
+        if not record_ids:
+            return
         try:
-            # 预处理图片
-            img_array = self.preprocess_image(image_path)
+            self.get_index(model_version).add(record_ids, embeddings[keep])
+        except Exception as e:
+            print(f"特征向量写入失败: {e}")
+    
+    def predict(self, img_array):
+        """预测，启用微批处理时与其他并发请求合并计算"""
+        if self.batcher is not None:
+            return self.batcher.submit(img_array)
+        return self._predict_batch(img_array)
+    
+    def get_stats(self):
+        """获取推理统计信息"""
+        return {
+            'model_loaded': self.model is not None,
+            'state': self.state,
+            'load_time': self.load_time,
+            'model_version': self.model_version,
+            'backend': self.backend_name,
+            'registry_version': None if self.pinned_path else self.registry.current_version(),
+            'swap': self.swap_state,
+            'cache': self.cache.get_stats() if self.cache else None,
+            'cascade': self.get_cascade_stats(),
+            'similarity': self.get_index().get_stats() if self.similarity_enabled and self.model else None,
+            'batching': self.batcher.get_stats() if self.batcher else None
+        }
+    
+    def preprocess_image(self, image_path):
+        """
+        预处理图片
+
+        image_path 可以是文件路径、文件对象或图片字节，返回 (1, 69, 69, 3) 的float32数组
+        """
+        try:
+            size = self.INPUT_SHAPE[1], self.INPUT_SHAPE[0]  # Galaxy10数据集图片尺寸
+            return load_image_tensor(image_path, size)[np.newaxis]
+        except Exception as e:
+            raise Exception(f"图片预处理失败: {e}")
+    
+    def _interpret(self, prediction):
+        """将单行预测向量转换为分类结果"""
+        predicted_class = int(np.argmax(prediction))
+        confidence = float(prediction[predicted_class])
+        
+        return {
+            'predicted_class': predicted_class,
+            'class_name': self.GALAXY10_CLASSES.get(predicted_class, '未知类别'),
+            'confidence': confidence,
+            'all_predictions': {
+                self.GALAXY10_CLASSES[i]: float(prediction[i])
+                for i in range(len(self.GALAXY10_CLASSES))
+            }
+        }
+    
+    @staticmethod
+    def _make_record(user_id, image_path, result):
+        """根据分类结果构造数据库记录"""
+        return GalaxyClassification(
+            user_id=user_id,
+            image_path=image_path,
+            predicted_class=result['predicted_class'],
+            confidence=result['confidence'],
+            class_name=result['class_name'],
+            model_version=result.get('model_version')
+        )
+    
+    def classify(self, image_path, user_id, data=None):
+        """
+        分类星系图片
+
+        data: 图片字节；提供时直接在内存中解码，不再读取 image_path
+        """
+        self.require_model()
+        
+        try:
+            if data is None:
+                with open(image_path, 'rb') as f:
+                    data = f.read()
+            
+            # 相同图片直接使用缓存的预测结果，跳过解码与推理
+            model_version = self.model_version
+            result_version = self._result_version(model_version)
+            key = self._cache_key(data, result_version)
+            prediction = self._cache_get(key)
+            cached = prediction is not None
+            embedding = None
             
-            # 预测
-            predictions = self.model.predict(img_array, verbose=0)
-            predicted_class = np.argmax(predictions[0])
-            confidence = float(predictions[0][predicted_class])
+            if not cached:
+                # 预处理图片
+                img_array = self.preprocess_image(data)
+                
+                # 预测
+                prediction, embedding = self._split(self.predict(img_array)[0])
+                self._cache_set(key, prediction)
             
-            # 获取类别名称
-            class_name = self.GALAXY10_CLASSES.get(predicted_class, '未知类别')
+            result = self._interpret(prediction)
+            result['cached'] = cached
+            result['model_version'] = result_version
             
             # 保存记录
-            record = GalaxyClassification(
-                user_id=user_id,
-                image_path=image_path,
-                predicted_class=int(predicted_class),
-                confidence=confidence,
-                class_name=class_name
-            )
+            record = self._make_record(user_id, image_path, result)
             db.session.add(record)
             db.session.commit()
             
+            if embedding is not None:
+                self._index_add(model_version, [record.id], embedding[np.newaxis])
+            result['record_id'] = record.id
+            
+            return result
+            
+        except Exception as e:
+            raise Exception(f"分类失败: {e}")
+    
+    def _prepare_item(self, source, result_version):
+        """
+        准备批量任务中的一项，source为文件路径或图片字节
+
+        返回 (缓存键, 缓存的预测向量或None, 预处理后的张量或None)
+        """
+        if isinstance(source, (bytes, bytearray)):
+            data = bytes(source)
+        else:
+            with open(source, 'rb') as f:
+                data = f.read()
+        
+        key = self._cache_key(data, result_version)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return key, cached, None
+        return key, None, self.preprocess_image(data)[0]
+    
+    def classify_batch(self, items, user_id, chunk_size=None, workers=None):
+        """
+        批量分类星系图片（生成器）
+
+        items: 可迭代的 (image_path, source) 对，source 为文件路径或图片字节
+        解码与预处理在线程池中并行进行，模型按 chunk_size 分块批量推理，
+        每块结果批量写入数据库后立即逐条产出，调用方可以边处理边返回
+        """
+        self.require_model()
+        
+        if chunk_size is None:
+            chunk_size = int(os.getenv('GALAXY_BULK_CHUNK_SIZE', 256))
+        if workers is None:
+            workers = int(os.getenv('GALAXY_PREPROCESS_WORKERS', os.cpu_count() or 4))
+        
+        def chunks():
+            chunk = []
+            for item in items:
+                chunk.append(item)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            def submit(chunk):
+                model_version = self.model_version
+                result_version = self._result_version(model_version)
+                return model_version, result_version, [
+                    (image_path, pool.submit(self._prepare_item, source, result_version))
+                    for image_path, source in chunk
+                ]
+            
+            chunk_iter = chunks()
+            pending = next(chunk_iter, None)
+            pending = submit(pending) if pending is not None else None
+            
+            while pending is not None:
+                model_version, result_version, current = pending
+                # 当前块推理时，下一块已经在线程池中解码
+                upcoming = next(chunk_iter, None)
+                pending = submit(upcoming) if upcoming is not None else None
+                
+                prepared, failures = [], []
+                for image_path, future in current:
+                    try:
+                        prepared.append((image_path, *future.result()))
+                    except Exception as e:
+                        failures.append({'image_path': image_path, 'error': str(e)})
+                
+                results = []
+                if prepared:
+                    # 只对缓存未命中的图片做推理
+                    predictions = [cached for _, _, cached, _ in prepared]
+                    misses = [i for i, prediction in enumerate(predictions) if prediction is None]
+                    embeddings = None
+                    if misses:
+                        batch_predictions, embeddings = self._split(self._predict_batch(
+                            np.stack([prepared[i][3] for i in misses])
+                        ))
+                        for i, prediction in zip(misses, batch_predictions):
+                            predictions[i] = prediction
+                            self._cache_set(prepared[i][1], prediction)
+                    
+                    results = [self._interpret(prediction) for prediction in predictions]
+                    for result in results:
+                        result['model_version'] = result_version
+                    
+                    # 每块只提交一次，批量插入
+                    records = [
+                        self._make_record(user_id, image_path, result)
+                        for (image_path, _, _, _), result in zip(prepared, results)
+                    ]
+                    db.session.add_all(records)
+                    db.session.commit()
+                    
+                    # 缓存命中的图片没有重新计算特征，不加入索引
+                    if embeddings is not None:
+                        self._index_add(model_version, [records[i].id for i in misses], embeddings)
+                    
+                    missed = set(misses)
+                    for i, ((image_path, _, _, _), result, record) in enumerate(
+                            zip(prepared, results, records)):
+                        result['image_path'] = image_path
+                        result['record_id'] = record.id
+                        result['cached'] = i not in missed
+                
+                yield from results
+                yield from failures
+    
+    def classify_survey(self, image_path, user_id, threshold=3.0, min_area=25,
+                        max_sources=None, chunk_size=None):
+        """
+        宽视场巡天模式：检测图中的延展源，逐个切图后批量分类
+
+        返回每个源的像素坐标、外接框和分类结果；每个源保存一条分类记录，
+        image_path 记为 "原图路径#x,y"
+        """
+        self.require_model()
+        
+        if chunk_size is None:
+            chunk_size = int(os.getenv('GALAXY_BULK_CHUNK_SIZE', 256))
+        if max_sources is None:
+            max_sources = int(os.getenv('SURVEY_MAX_SOURCES', 5000))
+        
+        try:
+            started = time.time()
+            frame = load_frame(image_path)
+            sources = detect_sources(
+                frame,
+                tile_size=int(os.getenv('SURVEY_TILE_SIZE', 2048)),
+                threshold=threshold,
+                min_area=min_area
+            )[:max_sources]
+            detect_time = time.time() - started
+            
+            size = self.INPUT_SHAPE[1], self.INPUT_SHAPE[0]
+            model_version = self.model_version
+            result_version = self._result_version(model_version)
+            results = []
+            for offset in range(0, len(sources), chunk_size):
+                chunk = sources[offset:offset + chunk_size]
+                cutouts = np.stack([extract_cutout(frame, source, size) for source in chunk])
+                predictions, embeddings = self._split(self._predict_batch(cutouts))
+                
+                records = []
+                for source, prediction in zip(chunk, predictions):
+                    result = self._interpret(prediction)
+                    result.pop('all_predictions')
+                    result['model_version'] = result_version
+                    result.update(source)
+                    results.append(result)
+                    records.append(self._make_record(
+                        user_id, f"{image_path}#{int(source['x'])},{int(source['y'])}"[:255], result
+                    ))
+                
+                db.session.add_all(records)
+                db.session.commit()
+                for result, record in zip(results[offset:], records):
+                    result['record_id'] = record.id
+                if embeddings is not None:
+                    self._index_add(model_version, [record.id for record in records], embeddings)
+            
             return {
-                'predicted_class': int(predicted_class),
-                'class_name': class_name,
-                'confidence': confidence,
-                'all_predictions': {
-                    self.GALAXY10_CLASSES[i]: float(predictions[0][i])
-                    for i in range(len(self.GALAXY10_CLASSES))
-                }
+                'image_size': [int(frame.shape[1]), int(frame.shape[0])],
+                'count': len(results),
+                'sources': results,
+                'detect_time': detect_time,
+                'total_time': time.time() - started
             }
             
         except Exception as e:
-            raise Exception(f"分类失败: {e}")
+            raise Exception(f"巡天分类失败: {e}")
+    
+    def find_similar(self, record_id=None, data=None, k=10):
+        """
+        检索与指定分类记录或上传图片最相似的历史记录
+
+        record_id: 以某条分类记录为查询；索引中没有该记录时重新读取其图片计算特征
+        data: 以上传的图片字节为查询
+        """
+        self.require_model()
+        
+        model_version = self.model_version
+        index = self.get_index(model_version)
+        query = None
+        
+        if record_id is not None:
+            record = GalaxyClassification.query.get(record_id)
+            if record is None:
+                raise Exception("分类记录不存在")
+            query = index.vector(record.id)
+            if query is None:
+                if not os.path.exists(record.image_path):
+                    raise Exception("该记录的图片已不存在，无法检索")
+                with open(record.image_path, 'rb') as f:
+                    data = f.read()
+        
+        if query is None:
+            if data is None:
+                raise Exception("请提供记录ID或图片")
+            embedding = self.embed_batch(self.preprocess_image(data))
+            if embedding is None:
+                raise Exception("当前推理后端不支持特征提取，无法检索相似星系")
+            query = embedding[0]
+        
+        started = time.perf_counter()
+        matches = index.search(query, k, exclude=record_id)
+        search_ms = (time.perf_counter() - started) * 1000
+        
+        ids = [match_id for match_id, _ in matches]
+        records = {
+            record.id: record
+            for record in GalaxyClassification.query.filter(GalaxyClassification.id.in_(ids)).all()
+        } if ids else {}
+        
+        return {
+            'model_version': model_version,
+            'index_size': index.count,
+            'search_ms': search_ms,
+            'results': [
+                dict(records[match_id].to_dict(), similarity=score)
+                for match_id, score in matches if match_id in records
+            ]
+        }
+    
+    def correct_classification(self, record_id, user_id, corrected_class):
+        """用户修正自己某条记录的类别，修正后的记录用于增量微调；记录不存在时返回None"""
+        record = GalaxyClassification.query.get(record_id)
+        if record is None or str(record.user_id) != str(user_id):
+            return None
+        
+        record.corrected_class = corrected_class
+        record.corrected_at = datetime.utcnow()
+        db.session.commit()
+        return record.to_dict()
     
     def get_history(self, user_id, limit=20):
         """获取用户历史记录"""
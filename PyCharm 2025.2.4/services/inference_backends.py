@@ -0,0 +1,179 @@
+"""
+星系分类推理后端
+支持 keras（.h5）、tflite（.tflite，可为float16/int8量化）和 onnxruntime（.onnx）三种后端，
+各后端的 predict 输入均为 (N, 69, 69, 3) 的float32数组，输出为 (N, 10) 的概率
+"""
+import os
+import hashlib
+import threading
+import numpy as np
+
+DEFAULT_MODEL_PATHS = {
+    'keras': 'models/galaxy_classification_model.h5',
+    'tflite': 'models/galaxy_classification_model.tflite',
+    'onnxruntime': 'models/galaxy_classification_model.onnx'
+}
+
+
+def file_hash(model_path):
+    """模型文件内容SHA-256的前12位"""
+    digest = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()[:12]
+
+
+def file_version(model_path):
+    """模型版本：优先取环境变量 GALAXY_MODEL_VERSION，否则为模型文件内容哈希"""
+    return os.getenv('GALAXY_MODEL_VERSION') or file_hash(model_path)
+
+
+def _num_threads():
+    """推理线程数，0表示由运行时自行决定"""
+    return int(os.getenv('GALAXY_INFERENCE_THREADS', 0))
+
+
+class KerasBackend:
+    """
+    TensorFlow/Keras后端
+
+    不走 model.predict（每次调用都要构建数据适配器和回调），
+    而是用固定输入签名的 tf.function 直接调用模型，只追踪一次计算图
+    """
+
+    name = 'keras'
+
+    def __init__(self, model_path):
+        import tensorflow as tf
+
+        threads = _num_threads()
+        if threads:
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(threads)
+            except RuntimeError:
+                # 运行时已初始化后不能再修改线程数
+                pass
+
+        self.model_path = model_path
+        self.model = tf.keras.models.load_model(model_path, compile=False)
+        input_shape = tuple(self.model.input_shape[1:])
+        self._infer = tf.function(
+            lambda x: self.model(x, training=False),
+            input_signature=[tf.TensorSpec((None,) + input_shape, tf.float32)]
+        )
+
+        # 倒数第二层（分类层之前）的输出作为图像特征向量，与分类概率在同一次前向计算中得到
+        features = self.model.layers[-2].output
+        feature_model = tf.keras.Model(self.model.inputs, [self.model.output, features])
+        self.embedding_dim = int(features.shape[-1])
+        self._infer_with_embeddings = tf.function(
+            lambda x: feature_model(x, training=False),
+            input_signature=[tf.TensorSpec((None,) + input_shape, tf.float32)]
+        )
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        return self._infer(batch).numpy()
+
+    def predict_with_embeddings(self, batch):
+        """返回 (分类概率, 特征向量)"""
+        batch = np.asarray(batch, dtype=np.float32)
+        probabilities, features = self._infer_with_embeddings(batch)
+        return probabilities.numpy(), features.numpy()
+
+
+class TFLiteBackend:
+    """TFLite后端，优先使用轻量的tflite_runtime"""
+
+    name = 'tflite'
+
+    def __init__(self, model_path):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+
+        self.model_path = model_path
+        threads = _num_threads() or None
+        self.interpreter = Interpreter(model_path=model_path, num_threads=threads)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self.input_detail['shape'][0])
+        # Interpreter 不是线程安全的
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size):
+        """按批次大小重新分配输入张量"""
+        if batch_size == self._batch_size:
+            return
+        shape = list(self.input_detail['shape'])
+        shape[0] = batch_size
+        self.interpreter.resize_tensor_input(self.input_detail['index'], shape)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+
+        with self._lock:
+            self._resize(len(batch))
+
+            # int8全整型量化模型需要按输入量化参数转换
+            input_dtype = self.input_detail['dtype']
+            if input_dtype != np.float32:
+                scale, zero_point = self.input_detail['quantization']
+                # 超出整型范围的值饱和到边界，不能在 astype 时回绕
+                limits = np.iinfo(input_dtype)
+                batch = np.clip(np.round(batch / scale + zero_point), limits.min, limits.max).astype(input_dtype)
+
+            self.interpreter.set_tensor(self.input_detail['index'], batch)
+            self.interpreter.invoke()
+            output = self.interpreter.get_tensor(self.output_detail['index'])
+
+            if self.output_detail['dtype'] != np.float32:
+                scale, zero_point = self.output_detail['quantization']
+                output = (output.astype(np.float32) - zero_point) * scale
+
+        return output
+
+
+class OnnxRuntimeBackend:
+    """ONNX Runtime后端"""
+
+    name = 'onnxruntime'
+
+    def __init__(self, model_path):
+        import onnxruntime as ort
+
+        self.model_path = model_path
+        options = ort.SessionOptions()
+        threads = _num_threads()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options, providers=['CPUExecutionProvider']
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+BACKENDS = {
+    'keras': KerasBackend,
+    'tflite': TFLiteBackend,
+    'onnxruntime': OnnxRuntimeBackend
+}
+
+
+def create_backend(name, model_path=None):
+    """按名称创建推理后端"""
+    if name not in BACKENDS:
+        raise ValueError(f"不支持的推理后端: {name}（可选: {', '.join(BACKENDS)}）")
+    return BACKENDS[name](model_path or DEFAULT_MODEL_PATHS[name])
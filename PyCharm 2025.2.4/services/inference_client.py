@@ -0,0 +1,160 @@
+"""
+推理边车（inference sidecar）客户端与通信协议
+多个Web进程通过Unix套接字把预处理好的张量发给同一个模型进程，
+模型在内存中只保留一份
+
+帧格式：4字节大端头部长度 + JSON头部 + 原始数组字节
+    请求头部：{"op": "predict", "shape": [N, 69, 69, 3], "dtype": "float32"}
+              {"op": "predict", "embeddings": true, ...}
+              {"op": "info"}
+              {"op": "activate", "version": "..."}
+    响应头部：{"status": "ok", "shape": [N, 10], "dtype": "float32", "model_version": "..."}
+              {"status": "ok", "shape": [N, 10 + D], "classes": 10, ...}
+              {"status": "error", "error": "..."}
+
+请求 embeddings 时，若边车当前模型支持特征提取，D维特征向量拼接在分类概率之后，
+classes 为分类概率的列数；不支持时（如 tflite、onnxruntime 后端）响应中没有 classes，只返回分类概率
+
+activate 让边车从模型仓库加载、预热并切换到指定版本，成功后返回切换后的 model_version；
+加载失败时边车继续使用原模型
+"""
+import json
+import socket
+import struct
+import threading
+import numpy as np
+
+_HEADER_SIZE = struct.Struct('>I')
+
+
+def _recv_exact(sock, size):
+    """从套接字读取恰好 size 字节"""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            raise ConnectionError('连接已关闭')
+        received += count
+    return buffer
+
+
+def send_message(sock, header, array=None):
+    """发送一帧消息"""
+    if array is not None:
+        array = np.ascontiguousarray(array)
+        header = dict(header, shape=list(array.shape), dtype=str(array.dtype))
+    encoded = json.dumps(header).encode('utf-8')
+    sock.sendall(_HEADER_SIZE.pack(len(encoded)) + encoded)
+    if array is not None:
+        sock.sendall(memoryview(array).cast('B'))
+
+
+def recv_message(sock):
+    """接收一帧消息，返回 (头部, 数组或None)"""
+    (length,) = _HEADER_SIZE.unpack(_recv_exact(sock, _HEADER_SIZE.size))
+    header = json.loads(_recv_exact(sock, length).decode('utf-8'))
+
+    array = None
+    if 'shape' in header:
+        dtype = np.dtype(header['dtype'])
+        shape = tuple(header['shape'])
+        size = int(np.prod(shape)) * dtype.itemsize
+        array = np.frombuffer(_recv_exact(sock, size), dtype=dtype).reshape(shape)
+    return header, array
+
+
+class SidecarBackend:
+    """
+    通过Unix套接字调用推理边车的后端，接口与 inference_backends 中的后端一致
+
+    每个线程持有自己的长连接，连接断开后自动重连一次
+    """
+
+    name = 'sidecar'
+
+    def __init__(self, socket_path, timeout=30.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+        self.model_version = None
+        self._warned_embeddings = False
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # 非阻塞模式下监听队列满时 connect 会直接返回 EAGAIN，先阻塞连接再设置超时
+        sock.connect(self.socket_path)
+        sock.settimeout(self.timeout)
+        self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+
+    def _request(self, header, array=None):
+        for attempt in range(2):
+            sock = getattr(self._local, 'sock', None) or self._connect()
+            try:
+                send_message(sock, header, array)
+                response, result = recv_message(sock)
+                break
+            except (ConnectionError, OSError):
+                self._close()
+                if attempt:
+                    raise
+
+        return self._check(response), result
+
+    def _check(self, response):
+        """检查响应状态并记录边车当前的模型版本"""
+        if response.get('status') != 'ok':
+            raise Exception(f"推理边车返回错误: {response.get('error')}")
+        if response.get('model_version'):
+            self.model_version = response['model_version']
+        return response
+
+    def info(self):
+        """获取边车的模型信息与统计"""
+        response, _ = self._request({'op': 'info'})
+        return response
+
+    def activate(self, version, timeout=600.0):
+        """让边车加载、预热并切换到模型仓库中的指定版本；加载耗时较长，使用单独的连接与超时"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            sock.settimeout(timeout)
+            send_message(sock, {'op': 'activate', 'version': version})
+            response, _ = recv_message(sock)
+        finally:
+            sock.close()
+        return self._check(response)
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        _, result = self._request({'op': 'predict'}, batch)
+        return result
+
+    def predict_with_embeddings(self, batch):
+        """
+        返回 (分类概率, 特征向量)
+
+        边车的模型不支持特征提取时特征向量为None，相似检索与特征索引在此期间不可用
+        """
+        batch = np.asarray(batch, dtype=np.float32)
+        response, result = self._request({'op': 'predict', 'embeddings': True}, batch)
+        classes = response.get('classes')
+        if classes is None:
+            if not self._warned_embeddings:
+                self._warned_embeddings = True
+                print(f"推理边车的模型（版本 {self.model_version}）不支持特征提取，相似检索与特征索引暂不可用")
+            return result, None
+        self._warned_embeddings = False
+        return result[..., :classes], result[..., classes:]
@@ -0,0 +1,155 @@
+"""
+星系分类模型仓库
+按版本保存模型文件及其元数据（精度、输入尺寸、导出格式等），
+并记录当前线上使用的版本
+
+目录结构：
+    models/registry/
+        current.json                 {"version": "v20260101_120000"}
+        v20260101_120000/
+            model.h5
+            metadata.json
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from services.inference_backends import file_hash
+
+# 文件扩展名与推理后端的对应关系
+FORMAT_BACKENDS = {
+    'h5': 'keras',
+    'keras': 'keras',
+    'tflite': 'tflite',
+    'onnx': 'onnxruntime'
+}
+
+
+def is_valid_version(version):
+    """版本号只能是单层目录名：不能为空、不能含路径分隔符或 ..（版本号直接拼接为仓库内的路径）"""
+    return bool(version) and version != '.' and '..' not in version \
+        and not any(sep in version for sep in ('/', '\\', os.sep))
+
+
+def _write_json(path, data):
+    """先写临时文件再重命名，保证读取方不会读到写了一半的文件"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+class ModelRegistry:
+    """模型仓库"""
+
+    def __init__(self, root=None):
+        self.root = root or os.getenv('GALAXY_MODEL_REGISTRY', 'models/registry')
+
+    @property
+    def current_file(self):
+        return os.path.join(self.root, 'current.json')
+
+    def publish(self, artifact_path, metadata=None, version=None, activate=False):
+        """
+        发布新版本
+
+        artifact_path: 模型文件路径（.h5 / .tflite / .onnx）
+        metadata: 附加元数据，如 accuracy、top3_accuracy、parent_version 等
+        activate: 是否同时设为线上版本
+        """
+        ext = artifact_path.rsplit('.', 1)[-1].lower()
+        if ext not in FORMAT_BACKENDS:
+            raise ValueError(f"不支持的模型格式: {ext}")
+
+        version = version or datetime.now().strftime('v%Y%m%d_%H%M%S')
+        if not is_valid_version(version):
+            raise ValueError(f"无效的模型版本号: {version}")
+        version_dir = os.path.join(self.root, version)
+        if os.path.exists(version_dir):
+            raise ValueError(f"模型版本已存在: {version}")
+        os.makedirs(version_dir)
+
+        target = os.path.join(version_dir, f'model.{ext}')
+        shutil.copy2(artifact_path, target)
+
+        info = {
+            'input_shape': [69, 69, 3],
+            **(metadata or {}),
+            'version': version,
+            'format': ext,
+            'backend': FORMAT_BACKENDS[ext],
+            'file': f'model.{ext}',
+            'file_hash': file_hash(target),
+            'file_size': os.path.getsize(target),
+            'created_at': datetime.now().isoformat()
+        }
+        _write_json(os.path.join(version_dir, 'metadata.json'), info)
+
+        if activate:
+            self.set_current(version)
+
+        print(f"模型已发布: {version}（{target}）")
+        return version
+
+    def get(self, version):
+        """获取指定版本的元数据（含模型文件的完整路径），不存在或版本号无效返回None"""
+        if not is_valid_version(version):
+            return None
+        meta_path = os.path.join(self.root, version, 'metadata.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        info['path'] = os.path.join(self.root, version, info['file'])
+        return info
+
+    def list_versions(self):
+        """列出所有版本，按创建时间倒序"""
+        if not os.path.isdir(self.root):
+            return []
+        versions = [self.get(name) for name in os.listdir(self.root)]
+        versions = [v for v in versions if v is not None]
+        return sorted(versions, key=lambda v: v.get('created_at', ''), reverse=True)
+
+    def current_version(self):
+        """当前线上版本，未设置时返回None"""
+        try:
+            with open(self.current_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get('version')
+        except (OSError, ValueError):
+            return None
+
+    def set_current(self, version):
+        """设置线上版本"""
+        if self.get(version) is None:
+            raise ValueError(f"模型版本不存在: {version}")
+        os.makedirs(self.root, exist_ok=True)
+        _write_json(self.current_file, {
+            'version': version,
+            'updated_at': datetime.now().isoformat()
+        })
+
+    def watch(self, callback, interval=5.0):
+        """
+        启动后台线程监视线上版本变化，变化时调用 callback(version)
+
+        多个Web进程与推理边车各自监视同一个 current.json，
+        任一进程切换版本后其他进程会在 interval 秒内跟进
+        """
+        def loop():
+            last = self.current_version()
+            while True:
+                time.sleep(interval)
+                version = self.current_version()
+                if version and version != last:
+                    last = version
+                    try:
+                        callback(version)
+                    except Exception as e:
+                        print(f"模型版本切换失败: {version}: {e}")
+
+        thread = threading.Thread(target=loop, name='model-registry-watcher', daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,216 @@
+"""
+天体定位的解析提示
+从图片本身（FITS头、EXIF）和用户的器材配置推算像素比例（角秒/像素）与大致指向，
+随任务传给Astrometry服务作为 solve-field 的 --scale-low/--scale-high 与 --ra/--dec/--radius，
+把全天、全比例的搜索缩小到很小的范围
+
+像素比例 = 206.265 × 像元尺寸(µm) × binning / 焦距(mm)；各来源的可信程度不同，按各自的容差给出上下限：
+    FITS 的 PIXSCALE/SECPIX、CD矩阵：±5%
+    FITS 的 FOCALLEN + XPIXSZ、器材配置（焦距 + 像元尺寸）：±15%
+    EXIF 的焦距 + 焦平面分辨率：±20%
+    EXIF 的焦距 + 35mm等效焦距（按画幅推算像元尺寸）：±35%
+"""
+import math
+import os
+from PIL import Image
+
+ARCSEC_PER_RADIAN_MM_UM = 206.265
+# 各来源像素比例的相对容差
+SCALE_TOLERANCE = {
+    'fits_scale': 0.05,
+    'fits_optics': 0.15,
+    'equipment': 0.15,
+    'exif_focal_plane': 0.2,
+    'exif_35mm': 0.35
+}
+# 只有大致指向时的最小搜索半径（度），覆盖望远镜赤道仪的指向误差
+MIN_RADIUS = float(os.getenv('ASTROMETRY_HINT_RADIUS', 5))
+FITS_EXTENSIONS = ('fits', 'fit', 'fts')
+
+# EXIF标签
+EXIF_IFD = 0x8769
+FOCAL_LENGTH = 0x920A
+FOCAL_PLANE_X_RESOLUTION = 0xA20E
+FOCAL_PLANE_RESOLUTION_UNIT = 0xA210
+PIXEL_X_DIMENSION = 0xA002
+FOCAL_LENGTH_35MM = 0xA405
+# 焦平面分辨率单位：2 英寸，3 厘米，4 毫米，5 微米
+RESOLUTION_UNIT_MM = {2: 25.4, 3: 10.0, 4: 1.0, 5: 0.001}
+
+
+def pixel_scale(pixel_size, focal_length, binning=1):
+    """像元尺寸(µm)与焦距(mm)换算为像素比例（角秒/像素）"""
+    return ARCSEC_PER_RADIAN_MM_UM * pixel_size * (binning or 1) / focal_length
+
+
+def parse_angle(value, hours=False):
+    """解析角度：数字（度）或六十进制字符串（'05 35 17.3'、'-05:23:28'），hours 为真时按时角"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    parts = text.replace(':', ' ').replace('h', ' ').replace('d', ' ').replace('m', ' ').replace('s', ' ').split()
+    if not 1 <= len(parts) <= 3:
+        return None
+    try:
+        numbers = [float(p) for p in parts]
+    except ValueError:
+        return None
+    sign = -1.0 if parts[0].startswith('-') else 1.0
+    degrees = abs(numbers[0]) + sum(n / 60 ** (i + 1) for i, n in enumerate(numbers[1:]))
+    return sign * degrees * (15.0 if hours else 1.0)
+
+
+def image_size(image_path):
+    """图片尺寸 (宽, 高)，FITS读头部的 NAXIS1/NAXIS2"""
+    if image_path.rsplit('.', 1)[-1].lower() in FITS_EXTENSIONS:
+        header = fits_header(image_path)
+        if header is not None:
+            return int(header['NAXIS1']), int(header['NAXIS2'])
+        return None
+    with Image.open(image_path) as img:
+        return img.size
+
+
+def fits_header(image_path):
+    """第一个二维图像HDU的头部"""
+    from astropy.io import fits
+    with fits.open(image_path) as hdul:
+        for hdu in hdul:
+            if hdu.header.get('NAXIS', 0) >= 2:
+                return hdu.header.copy()
+    return None
+
+
+def _scale_range(scale, source):
+    tolerance = SCALE_TOLERANCE[source]
+    return {'scale_low': scale * (1 - tolerance), 'scale_high': scale * (1 + tolerance), 'scale_source': source}
+
+
+def hints_from_fits(header):
+    """FITS头中的指向（RA/DEC、OBJCTRA/OBJCTDEC、CRVAL）与像素比例"""
+    hints = {}
+    # RA 为数字时是度，为六十进制字符串时是时角
+    ra, dec = parse_angle(header.get('RA'), hours=True), parse_angle(header.get('DEC'))
+    if ra is None or dec is None:
+        ra, dec = parse_angle(header.get('OBJCTRA'), hours=True), parse_angle(header.get('OBJCTDEC'))
+    if (ra is None or dec is None) and str(header.get('CTYPE1', '')).startswith('RA'):
+        ra, dec = header.get('CRVAL1'), header.get('CRVAL2')
+    if ra is not None and dec is not None and -90 <= dec <= 90:
+        hints.update(ra=float(ra) % 360.0, dec=float(dec), position_source='fits')
+
+    if header.get('PIXSCALE') or header.get('SECPIX'):
+        hints.update(_scale_range(float(header.get('PIXSCALE') or header.get('SECPIX')), 'fits_scale'))
+    elif 'CD1_1' in header and 'CD2_1' in header:
+        scale = math.hypot(header['CD1_1'], header['CD2_1']) * 3600.0
+        hints.update(_scale_range(scale, 'fits_scale'))
+    elif header.get('FOCALLEN') and (header.get('XPIXSZ') or header.get('PIXSIZE1')):
+        # XPIXSZ 已含 binning（MaxIm DL / N.I.N.A. 约定），PIXSIZE1 为未合并的像元尺寸
+        if header.get('XPIXSZ'):
+            pixel_size = float(header['XPIXSZ'])
+        else:
+            pixel_size = float(header['PIXSIZE1']) * (header.get('XBINNING') or 1)
+        hints.update(_scale_range(pixel_scale(pixel_size, float(header['FOCALLEN'])), 'fits_optics'))
+    return hints
+
+
+def hints_from_exif(image_path, width):
+    """EXIF中的焦距与焦平面分辨率 / 35mm等效焦距"""
+    with Image.open(image_path) as img:
+        exif = img.getexif()
+        exif_ifd = exif.get_ifd(EXIF_IFD) if exif else {}
+    if not exif_ifd:
+        return {}
+
+    focal_length = exif_ifd.get(FOCAL_LENGTH)
+    if not focal_length or float(focal_length) <= 0:
+        return {}
+    focal_length = float(focal_length)
+
+    resolution = exif_ifd.get(FOCAL_PLANE_X_RESOLUTION)
+    unit = RESOLUTION_UNIT_MM.get(exif_ifd.get(FOCAL_PLANE_RESOLUTION_UNIT, 2))
+    if resolution and unit and float(resolution) > 0:
+        # 焦平面分辨率对应相机输出的原始宽度，图片缩小过时按宽度比例修正
+        pixel_size = unit / float(resolution) * 1000.0
+        original_width = exif_ifd.get(PIXEL_X_DIMENSION)
+        if original_width and width:
+            pixel_size *= float(original_width) / width
+        return _scale_range(pixel_scale(pixel_size, focal_length), 'exif_focal_plane')
+
+    focal_35mm = exif_ifd.get(FOCAL_LENGTH_35MM)
+    if focal_35mm and width:
+        # 等效焦距 / 实际焦距 = 裁切系数，传感器宽度 = 36mm / 裁切系数
+        sensor_width = 36.0 * focal_length / float(focal_35mm)
+        return _scale_range(pixel_scale(sensor_width / width * 1000.0, focal_length), 'exif_35mm')
+    return {}
+
+
+def hints_from_equipment(profile, width):
+    """
+    器材配置：焦距 + 像元尺寸（或传感器宽度）
+
+    上传的图片常比传感器原始分辨率小（手机、预览JPEG），知道传感器宽度方向的像素数（sensor_pixels，
+    或由 sensor_width / pixel_size 推出）时按 原始宽度 / 图片宽度 放大像元尺寸，此时已包含 binning
+    """
+    if not profile or not profile.get('focal_length'):
+        return {}
+    pixel_size = profile.get('pixel_size')
+    sensor_width = profile.get('sensor_width')
+    binning = profile.get('binning') or 1
+    native_width = profile.get('sensor_pixels')
+    if pixel_size and sensor_width and not native_width:
+        native_width = sensor_width * 1000.0 / pixel_size
+    
+    if pixel_size and native_width and width:
+        pixel_size, binning = pixel_size * native_width / width, 1
+    elif not pixel_size and sensor_width and width:
+        pixel_size, binning = sensor_width / width * 1000.0, 1
+    if not pixel_size:
+        return {}
+    return _scale_range(pixel_scale(pixel_size, profile['focal_length'], binning), 'equipment')
+
+
+def collect_hints(image_path, equipment=None, overrides=None):
+    """
+    合并各来源的提示，返回 dict（可能为空）：
+    ra、dec、radius（度）；scale_low、scale_high（角秒/像素）；scale_source、position_source 记录来源
+
+    像素比例优先级：调用方指定 > FITS > 器材配置 > EXIF；指向：调用方指定 > FITS
+    """
+    hints = {}
+    size = None
+    try:
+        if image_path.rsplit('.', 1)[-1].lower() in FITS_EXTENSIONS:
+            header = fits_header(image_path)
+            if header is not None:
+                size = int(header['NAXIS1']), int(header['NAXIS2'])
+                hints = hints_from_fits(header)
+        else:
+            size = image_size(image_path)
+            hints = hints_from_exif(image_path, size[0])
+    except Exception as e:
+        print(f"读取解析提示失败: {image_path}: {e}")
+
+    if equipment and ('scale_low' not in hints or hints['scale_source'].startswith('exif')):
+        hints.update(hints_from_equipment(equipment, size[0] if size else None))
+
+    for key, value in (overrides or {}).items():
+        if value is not None:
+            hints[key] = value
+    if overrides and overrides.get('scale_low') is not None:
+        hints['scale_source'] = 'request'
+    if overrides and overrides.get('ra') is not None:
+        hints['position_source'] = 'request'
+
+    if 'ra' in hints and 'dec' in hints and 'radius' not in hints:
+        radius = MIN_RADIUS
+        if 'scale_high' in hints and size:
+            # 至少覆盖一个视场对角线
+            radius = max(radius, hints['scale_high'] * math.hypot(*size) / 3600.0)
+        hints['radius'] = radius
+    return hints
@@ -0,0 +1,300 @@
+"""
+天体定位任务的后台跟踪
+解析请求只创建定位记录（pending）就返回，图片上传到Astrometry服务、等待解析完成、
+写回结果都在后台进行，不再每个请求占用一个Web工作线程等待最长5分钟
+
+得知任务结束的方式（ASTROMETRY_NOTIFY）：
+    events：订阅Astrometry服务的 /events（SSE），一个连接接收所有任务的状态变化，毫秒级得知结果；
+            断线后带 Last-Event-ID 重连补发，并定期对账（查询一次每个任务），防止遗漏与超时
+    long_poll：每个任务在等待线程池中长轮询 /jobs/<id>?wait=N，任务结束时立即返回
+    poll：跟踪线程每隔 poll_interval 秒查询所有任务（兼容旧版Astrometry服务）
+配置了回调地址时，Astrometry服务在任务结束时直接POST结果到后端，由收到回调的Web进程写回记录
+
+记录状态变化时唤醒等待该记录的监听者（SSE），其他进程写入的变化由监听者定期查库得知
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# 定位记录的终止状态
+TERMINAL_STATUSES = ('success', 'failure')
+# 记录变化计数保留的记录数
+MAX_TRACKED_VERSIONS = 10000
+NOTIFY_MODES = ('events', 'long_poll', 'poll')
+# 事件流断线后重连的最长等待（秒）
+MAX_RECONNECT_DELAY = 30
+
+
+class EventsUnsupported(Exception):
+    """Astrometry服务不提供 /events（旧版本）"""
+
+
+class SolveTracker:
+    """
+    后台跟踪解析任务（线程安全）
+
+    service 提供 upload(image_path, record_id, hints) -> job_id、fetch_status(job_id, wait) -> dict、
+    fetch_result(job_id) -> calibration、job_events(last_event_id) -> [(事件ID, 事件)]、
+    unfinished_jobs(timeout) -> (待跟踪任务, 待重新上传记录)
+    以及 mark_processing / complete / fail / retry_without_hints 写回记录
+    """
+
+    def __init__(self, service, mode='events', poll_interval=2.0, timeout=300.0, upload_workers=4,
+                 wait_workers=16, long_poll_wait=30.0, reconcile_interval=30.0):
+        if mode not in NOTIFY_MODES:
+            raise ValueError(f"不支持的通知方式: {mode}（可选: {', '.join(NOTIFY_MODES)}）")
+        self.service = service
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.long_poll_wait = long_poll_wait
+        self.reconcile_interval = reconcile_interval
+        self.app = None
+        self._jobs = {}                  # 记录ID -> (Astrometry任务ID, 提交时间)
+        self._records = {}               # Astrometry任务ID -> 记录ID
+        self._versions = OrderedDict()   # 记录ID -> 变化计数
+        self._early = OrderedDict()      # 尚未登记的任务ID -> 已结束事件（任务在上传响应返回前就结束）
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._uploader = ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix='astrometry-upload')
+        self._waiters = ThreadPoolExecutor(max_workers=wait_workers, thread_name_prefix='astrometry-wait') \
+            if mode == 'long_poll' else None
+        self.completions = {'event': 0, 'callback': 0, 'long_poll': 0, 'poll': 0}
+        self.reconnects = 0
+
+    def start(self, app):
+        """首次提交任务时启动跟踪线程，并接管上次进程退出时未完成的任务"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self.app = app
+            self._thread = threading.Thread(target=self._run, name='astrometry-tracker', daemon=True)
+        with app.app_context():
+            jobs, uploads = self.service.unfinished_jobs(self.timeout)
+            for record_id, job_id, submitted_at in jobs:
+                self._track(record_id, job_id, submitted_at)
+        for record_id, image_path, hints in uploads:
+            self.submit(record_id, image_path, hints)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        self._uploader.shutdown(wait=False)
+        if self._waiters is not None:
+            self._waiters.shutdown(wait=False)
+
+    def submit(self, record_id, image_path, hints=None):
+        """后台上传图片（连同解析提示）并开始跟踪"""
+        self._uploader.submit(self._upload, record_id, image_path, time.time(), hints)
+
+    def _upload(self, record_id, image_path, submitted_at, hints=None):
+        with self.app.app_context():
+            try:
+                job_id = self.service.upload(image_path, record_id, hints)
+            except Exception as e:
+                self.service.fail(record_id, f"上传失败: {e}")
+                self.notify(record_id)
+                return
+            if not self.service.mark_processing(record_id, job_id):
+                # 回调比上传响应先到，记录已经写回
+                self.notify(record_id)
+                return
+        self.notify(record_id)
+        self._track(record_id, job_id, submitted_at)
+
+    def _track(self, record_id, job_id, submitted_at):
+        with self._cond:
+            self._jobs[record_id] = (job_id, submitted_at)
+            self._records[job_id] = record_id
+            early = self._early.pop(job_id, None)
+            self._cond.notify_all()
+        if early is not None:
+            with self.app.app_context():
+                self._finish(record_id, job_id, early, time.time() - submitted_at, 'event')
+            return
+        if self._waiters is not None:
+            self._waiters.submit(self._watch, record_id, job_id, submitted_at)
+
+    def _untrack(self, record_id):
+        """停止跟踪，返回是否仍在跟踪（避免同一结果被事件、回调、对账重复写回）"""
+        with self._cond:
+            job = self._jobs.pop(record_id, None)
+            if job is not None:
+                self._records.pop(job[0], None)
+            return job is not None
+
+    def _run(self):
+        if self.mode == 'events':
+            try:
+                self._listen()
+            except EventsUnsupported:
+                print("Astrometry服务不支持事件流，改为定时查询")
+                self.mode = 'poll'
+        if self.mode == 'poll':
+            self._poll()
+
+    def _poll(self):
+        while not self._stop.is_set():
+            with self._cond:
+                while not self._jobs and not self._stop.is_set():
+                    self._cond.wait()
+            self._reconcile('poll')
+            self._stop.wait(self.poll_interval)
+
+    def _reconcile(self, source):
+        """查询一次每个跟踪中的任务"""
+        with self._cond:
+            jobs = list(self._jobs.items())
+        with self.app.app_context():
+            for record_id, (job_id, submitted_at) in jobs:
+                self._check(record_id, job_id, submitted_at, source)
+
+    def _watch(self, record_id, job_id, submitted_at):
+        """长轮询单个任务直到结束"""
+        with self.app.app_context():
+            while not self._stop.is_set():
+                with self._cond:
+                    if record_id not in self._jobs:
+                        return
+                if self._check(record_id, job_id, submitted_at, 'long_poll', wait=self.long_poll_wait):
+                    return
+
+    def _listen(self):
+        """订阅事件流；断线后退避重连，重连后对账一次"""
+        last_event_id = None
+        delay = 1.0
+        while not self._stop.is_set():
+            last_reconcile = time.time()
+            try:
+                for event_id, event in self.service.job_events(last_event_id):
+                    delay = 1.0
+                    if event_id is not None:
+                        last_event_id = event_id
+                    if event is not None:
+                        self._on_event(event)
+                    # 心跳时顺带对账：补上遗漏的事件并处理超时
+                    if time.time() - last_reconcile >= self.reconcile_interval:
+                        self._reconcile('poll')
+                        last_reconcile = time.time()
+                    if self._stop.is_set():
+                        return
+            except EventsUnsupported:
+                raise
+            except Exception as e:
+                print(f"Astrometry事件流断开: {e}")
+            self.reconnects += 1
+            self._stop.wait(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+            self._reconcile('poll')
+
+    def _on_event(self, event):
+        """处理一个任务状态事件"""
+        if event.get('status') not in TERMINAL_STATUSES:
+            return
+        with self._cond:
+            record_id = self._records.get(event.get('job_id'))
+            job = self._jobs.get(record_id)
+            if job is None:
+                # 可能是本进程刚上传、还没登记的任务，先保留
+                self._early[event.get('job_id')] = event
+                while len(self._early) > MAX_TRACKED_VERSIONS:
+                    self._early.popitem(last=False)
+                return
+        with self.app.app_context():
+            self._finish(record_id, job[0], event, time.time() - job[1], 'event')
+
+    def _check(self, record_id, job_id, submitted_at, source, wait=0):
+        """查询一次任务状态，任务结束或超时时写回记录并停止跟踪，返回是否已结束"""
+        elapsed = time.time() - submitted_at
+        try:
+            job = self.service.fetch_status(job_id, wait=wait)
+            if job.get('status') in TERMINAL_STATUSES:
+                self._finish(record_id, job_id, job, time.time() - submitted_at, source)
+                return True
+            if elapsed <= self.timeout:
+                return False
+            error = "解析超时"
+        except Exception as e:
+            # 网络抖动等临时错误下一轮再查，超时后放弃
+            if elapsed <= self.timeout:
+                print(f"查询解析任务失败（记录 {record_id}，任务 {job_id}）: {e}")
+                return False
+            error = f"解析超时: {e}"
+        if self._untrack(record_id):
+            self.service.fail(record_id, error)
+            self.notify(record_id)
+        return True
+
+    def _finish(self, record_id, job_id, job, elapsed, source):
+        """按任务结果写回记录；结果不含 calibration 时再取一次"""
+        if not self._untrack(record_id):
+            return
+        try:
+            if job.get('status') == 'success':
+                calibration = job.get('calibration')
+                if calibration is None:
+                    calibration = self.service.fetch_result(job_id)
+                self.service.complete(record_id, calibration, elapsed)
+            elif not self._retry_without_hints(record_id):
+                self.service.fail(record_id, job.get('error') or "解析失败")
+        except Exception as e:
+            self.service.fail(record_id, f"获取结果失败: {e}")
+        with self._cond:
+            self.completions[source] += 1
+        self.notify(record_id)
+
+    def handle_callback(self, record_id, job, elapsed):
+        """Astrometry服务的完成回调；记录可能由其他进程跟踪，这里直接写回"""
+        self._untrack(record_id)
+        if job.get('status') == 'success':
+            self.service.complete(record_id, job.get('calibration') or {}, elapsed)
+        elif not self._retry_without_hints(record_id):
+            self.service.fail(record_id, job.get('error') or "解析失败")
+        with self._cond:
+            self.completions['callback'] += 1
+        self.notify(record_id)
+
+    def _retry_without_hints(self, record_id):
+        """
+        带提示的解析失败时去掉提示重新提交一次：提示有误（如器材配置不符）时真实比例或天区
+        不在搜索范围内，solve-field 不会在范围外搜索。返回是否已重新提交
+        """
+        image_path = self.service.retry_without_hints(record_id)
+        if image_path is None:
+            return False
+        self.submit(record_id, image_path)
+        return True
+
+    def notify(self, record_id):
+        """记录状态已变化，唤醒等待该记录的监听者"""
+        with self._cond:
+            self._versions[record_id] = self._versions.pop(record_id, 0) + 1
+            while len(self._versions) > MAX_TRACKED_VERSIONS:
+                self._versions.popitem(last=False)
+            self._cond.notify_all()
+
+    def version(self, record_id):
+        with self._cond:
+            return self._versions.get(record_id, 0)
+
+    def wait(self, record_id, version, timeout):
+        """等待记录变化（最多 timeout 秒），返回最新的变化计数"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._versions.get(record_id, 0) != version, timeout)
+            return self._versions.get(record_id, 0)
+
+    def get_stats(self):
+        with self._cond:
+            return {
+                'mode': self.mode,
+                'running': self._thread is not None and (self._thread.is_alive() or self.mode == 'long_poll'),
+                'tracking': len(self._jobs),
+                'completions': dict(self.completions),
+                'reconnects': self.reconnects,
+                'poll_interval': self.poll_interval,
+                'timeout': self.timeout
+            }
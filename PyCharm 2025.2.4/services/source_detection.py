@@ -0,0 +1,184 @@
+"""
+宽视场图像的源检测与切图
+对大幅图像分块做背景估计、阈值分割和连通域标记，找出延展源（星系），
+并在每个源周围切出固定尺寸的小图供星系分类模型使用
+"""
+import os
+import tempfile
+import numpy as np
+import cv2
+from PIL import Image
+
+# 宽视场图像可能超过Pillow默认的像素上限（约8900万像素）
+SURVEY_MAX_PIXELS = int(os.getenv('SURVEY_MAX_PIXELS', 400_000_000))
+if Image.MAX_IMAGE_PIXELS is not None and Image.MAX_IMAGE_PIXELS < SURVEY_MAX_PIXELS:
+    Image.MAX_IMAGE_PIXELS = SURVEY_MAX_PIXELS
+
+
+def load_frame(image_path, strip_rows=512):
+    """
+    加载宽视场图像为 (高, 宽, 通道) 的数组
+
+    FITS 通过 astropy 内存映射读取；其他格式解码后按行条写入临时文件上的 np.memmap，
+    随即释放解码缓冲区，后续分块处理只把用到的区域读入内存
+    """
+    ext = image_path.rsplit('.', 1)[-1].lower()
+    if ext in ('fits', 'fit'):
+        from astropy.io import fits
+        with fits.open(image_path, memmap=True) as hdul:
+            hdu = next(h for h in hdul if h.data is not None)
+            data = hdu.data
+            # (通道, 高, 宽) 的多通道FITS转为 (高, 宽, 通道)
+            if data.ndim == 3:
+                data = np.moveaxis(data, 0, -1)
+            elif data.ndim == 2:
+                data = data[:, :, np.newaxis]
+            return data
+
+    with Image.open(image_path) as img:
+        img = img.convert('RGB') if img.mode not in ('RGB', 'L') else img
+        width, height = img.size
+        channels = 3 if img.mode == 'RGB' else 1
+
+        tmp = tempfile.NamedTemporaryFile(prefix='survey_', suffix='.u8', delete=False)
+        tmp.close()
+        frame = np.memmap(tmp.name, dtype=np.uint8, mode='w+', shape=(height, width, channels))
+        # 文件已被映射，删除目录项后由内核在映射释放时回收
+        os.unlink(tmp.name)
+
+        for top in range(0, height, strip_rows):
+            bottom = min(top + strip_rows, height)
+            strip = np.asarray(img.crop((0, top, width, bottom)))
+            frame[top:bottom] = strip.reshape(bottom - top, width, channels)
+
+    return frame
+
+
+def _to_gray(region):
+    """将区域转为float32灰度图"""
+    region = np.nan_to_num(np.asarray(region, dtype=np.float32))
+    if region.shape[2] == 1:
+        return region[:, :, 0]
+    return region[:, :, :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _background(gray, mesh=64):
+    """
+    网格背景估计：每个 mesh x mesh 网格取中位数，再双线性插值回原尺寸，
+    噪声取整块的中位绝对偏差（MAD）估计，避免被亮源拉高
+    """
+    height, width = gray.shape
+    if height < mesh or width < mesh:
+        grid = np.full((1, 1), np.median(gray), dtype=np.float32)
+    else:
+        rows, cols = height // mesh, width // mesh
+        blocks = gray[:rows * mesh, :cols * mesh].reshape(rows, mesh, cols, mesh)
+        blocks = blocks.transpose(0, 2, 1, 3).reshape(rows, cols, -1)
+        grid = np.median(blocks, axis=2).astype(np.float32)
+    background = cv2.resize(grid, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    residual = gray - background
+    noise = 1.4826 * np.median(np.abs(residual - np.median(residual)))
+    return background, max(float(noise), 1e-6)
+
+
+def detect_sources(frame, tile_size=2048, overlap=128, threshold=3.0, min_area=25,
+                   max_area=None, mesh=64):
+    """
+    分块检测延展源
+
+    frame: (高, 宽, 通道) 数组，可以是 np.memmap
+    tile_size/overlap: 分块大小与重叠宽度，重叠保证跨块边界的源完整出现在某一块中
+    threshold: 检测阈值（背景噪声的倍数）
+    min_area/max_area: 源的像素面积范围，小于 min_area 的视为噪声或热像素
+    返回按亮度降序排列的源列表，每个源含中心坐标、外接框、面积和累计流量
+    """
+    height, width = frame.shape[:2]
+    step = max(tile_size - overlap, 1)
+    kernel = np.ones((3, 3), np.uint8)
+    sources = []
+
+    for top in range(0, height, step):
+        for left in range(0, width, step):
+            bottom, right = min(top + tile_size, height), min(left + tile_size, width)
+            gray = _to_gray(frame[top:bottom, left:right])
+            background, noise = _background(gray, mesh)
+            residual = gray - background
+
+            mask = (residual > threshold * noise).astype(np.uint8)
+            # 开运算去除孤立热像素
+            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+            count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+            if count <= 1:
+                continue
+
+            areas = stats[1:, cv2.CC_STAT_AREA]
+            keep = areas >= min_area
+            if max_area:
+                keep &= areas <= max_area
+            indices = np.nonzero(keep)[0] + 1
+            if not len(indices):
+                continue
+
+            # 每个连通域的累计流量
+            fluxes = np.bincount(labels.ravel(), weights=np.clip(residual, 0, None).ravel(),
+                                 minlength=count)
+
+            # 只保留质心落在本块“核心区”的源，重叠区由相邻块负责，避免重复
+            core_top = 0 if top == 0 else overlap // 2
+            core_left = 0 if left == 0 else overlap // 2
+            core_bottom = bottom - top if bottom == height else bottom - top - overlap // 2
+            core_right = right - left if right == width else right - left - overlap // 2
+
+            for index in indices:
+                cx, cy = centroids[index]
+                if not (core_left <= cx < core_right and core_top <= cy < core_bottom):
+                    continue
+                x, y, w, h, area = stats[index]
+                sources.append({
+                    'x': float(cx + left),
+                    'y': float(cy + top),
+                    'bbox': [int(x + left), int(y + top), int(w), int(h)],
+                    'area': int(area),
+                    'flux': float(fluxes[index])
+                })
+
+    sources.sort(key=lambda s: s['flux'], reverse=True)
+    return sources
+
+
+def _stretch(region):
+    """非8位数据（如FITS）按百分位做asinh拉伸到[0, 1]"""
+    region = np.nan_to_num(np.asarray(region, dtype=np.float32))
+    low, high = np.percentile(region, [1, 99.5])
+    scaled = np.clip((region - low) / max(high - low, 1e-6), 0, 1)
+    return np.arcsinh(10 * scaled) / np.arcsinh(10)
+
+
+def extract_cutout(frame, source, size=(69, 69), padding=1.5, min_box=24):
+    """
+    在源周围切出正方形小图并缩放到模型输入尺寸，返回 (高, 宽, 3) 的float32数组
+    """
+    height, width = frame.shape[:2]
+    _, _, w, h = source['bbox']
+    half = max(int(max(w, h) * padding / 2), min_box // 2)
+    cx, cy = int(round(source['x'])), int(round(source['y']))
+    top, bottom = max(cy - half, 0), min(cy + half, height)
+    left, right = max(cx - half, 0), min(cx + half, width)
+
+    region = np.asarray(frame[top:bottom, left:right])
+    if region.dtype == np.uint8:
+        region = region.astype(np.float32) * (1.0 / 255.0)
+    else:
+        region = _stretch(region)
+    if region.shape[2] == 1:
+        region = np.repeat(region, 3, axis=2)
+
+    # 贴边的源补齐为以源为中心的正方形，保持形态不被拉伸
+    pad_top, pad_left = top - (cy - half), left - (cx - half)
+    pad_bottom = 2 * half - region.shape[0] - pad_top
+    pad_right = 2 * half - region.shape[1] - pad_left
+    if pad_top or pad_left or pad_bottom or pad_right:
+        region = np.pad(region, ((pad_top, pad_bottom), (pad_left, pad_right), (0, 0)))
+
+    return cv2.resize(region[:, :, :3], size, interpolation=cv2.INTER_AREA)
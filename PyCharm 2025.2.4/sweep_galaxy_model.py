@@ -0,0 +1,311 @@
+"""
+星系分类模型超参数搜索脚本
+按搜索空间生成若干组超参数（学习率、批次大小、Dropout），在进程池中并行训练；
+每个进程只使用固定的几个CPU核心与计算线程，所有进程共享同一份内存映射的预处理缓存。
+采用逐轮减半（successive halving）：每轮训练到指定轮数后只保留验证准确率靠前的 1/eta，
+其余提前停止，最后写出排行榜
+
+用法示例：
+    python sweep_galaxy_model.py --trials 27 --threads 4
+    python sweep_galaxy_model.py --space sweep_space.json --min-epochs 2 --max-epochs 18
+
+搜索空间文件示例（列表表示候选值；min/max 表示连续区间，log 为 true 时按对数均匀采样）：
+    {
+        "learning_rate": {"min": 0.0001, "max": 0.003, "log": true},
+        "batch_size": [32, 64, 128],
+        "conv_dropout": [0.1, 0.25, 0.4],
+        "dense_dropout": [0.3, 0.5]
+    }
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+import traceback
+from datetime import datetime
+from utils.galaxy10_cache import CACHE_DIR, Galaxy10Cache, load_cache
+
+SWEEP_DIR = 'models/sweep'
+# 传给 build_model 的超参数；batch_size 用于输入流水线
+MODEL_PARAMS = ('learning_rate', 'conv_dropout', 'dense_dropout')
+
+# 默认搜索空间（27组组合）
+DEFAULT_SPACE = {
+    'learning_rate': [0.0003, 0.001, 0.003],
+    'batch_size': [32, 64, 128],
+    'conv_dropout': [0.1, 0.25, 0.4],
+    'dense_dropout': [0.5]
+}
+
+def parse_args():
+    """解析命令行参数"""
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description='星系分类模型超参数搜索')
+    parser.add_argument('--space', default=None, help='搜索空间JSON文件，默认使用内置搜索空间')
+    parser.add_argument('--trials', type=int, default=27, help='试验组数')
+    parser.add_argument('--data', default='Galaxy10_DECals.h5', help='Galaxy10数据集路径')
+    parser.add_argument('--threads', type=int, default=4, help='每个试验进程的计算线程数')
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f'并行进程数，默认 CPU核数 / 线程数（本机 {cpus} 核）')
+    parser.add_argument('--min-epochs', type=int, default=3, help='第一轮的训练轮数')
+    parser.add_argument('--max-epochs', type=int, default=27, help='最终保留的试验训练到的轮数')
+    parser.add_argument('--eta', type=int, default=3, help='每轮只保留前 1/eta 的试验')
+    parser.add_argument('--precision', choices=['float32', 'mixed_float16', 'mixed_bfloat16'],
+                        default='float32', help='训练精度')
+    parser.add_argument('--seed', type=int, default=42, help='采样随机种子')
+    parser.add_argument('--output', default=None, help='输出目录，默认 models/sweep/<时间>')
+    return parser.parse_args()
+
+def sample_configs(space, trials, seed=42):
+    """
+    从搜索空间生成超参数组合
+
+    全部为离散候选值时在网格中无放回抽取（组数不超过网格大小）；
+    含连续区间时逐组随机采样
+    """
+    rng = random.Random(seed)
+    names = sorted(space)
+
+    def draw(spec):
+        if isinstance(spec, dict):
+            low, high = float(spec['min']), float(spec['max'])
+            if spec.get('log'):
+                return math.exp(rng.uniform(math.log(low), math.log(high)))
+            return rng.uniform(low, high)
+        return rng.choice(spec)
+
+    if all(isinstance(space[name], list) for name in names):
+        grid = [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+        rng.shuffle(grid)
+        return grid[:trials]
+    return [{name: draw(space[name]) for name in names} for _ in range(trials)]
+
+def rung_schedule(min_epochs, max_epochs, eta):
+    """逐轮减半各轮的累计训练轮数，如 3, 9, 27"""
+    epochs = [min_epochs]
+    while epochs[-1] * eta <= max_epochs:
+        epochs.append(epochs[-1] * eta)
+    if epochs[-1] < max_epochs:
+        epochs.append(max_epochs)
+    return epochs
+
+# ---------------------------------------------------------------- 试验进程
+
+_trainer = None
+
+def _init_worker(threads, precision, core_sets):
+    """
+    试验进程初始化：绑定到一组互不重叠的CPU核心，限制计算线程数，
+    须在导入TensorFlow之前设置
+    """
+    global _trainer
+    cores = core_sets.get()
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '2'
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+    import train_galaxy_model
+    train_galaxy_model.configure_training(precision, threads)
+    _trainer = train_galaxy_model
+
+def run_trial(task):
+    """
+    训练一组超参数到 task['epochs'] 轮
+
+    上一轮保存的模型（含优化器状态）存在时从断点继续，
+    训练输出写入试验目录下的 train.log，每轮指标追加到 history.json；
+    训练出错（内存不足、损失为NaN、超参数无效等）时返回 status 为 failed 的结果，不影响其他试验
+    """
+    try:
+        return _train_trial(task)
+    except Exception as e:
+        os.makedirs(task['dir'], exist_ok=True)
+        with open(os.path.join(task['dir'], 'train.log'), 'a', encoding='utf-8') as log:
+            traceback.print_exc(file=log)
+        return {'trial': task['trial'], 'status': 'failed', 'error': str(e) or type(e).__name__}
+
+def _train_trial(task):
+    trainer = _trainer
+    keras = trainer.keras
+    params = task['params']
+    trial_dir = task['dir']
+    model_file = os.path.join(trial_dir, 'model.keras')
+    history_file = os.path.join(trial_dir, 'history.json')
+    os.makedirs(trial_dir, exist_ok=True)
+
+    started = time.time()
+    keras.backend.clear_session()
+    cache = Galaxy10Cache(task['cache_dir'])
+    history = {}
+    if os.path.exists(history_file):
+        with open(history_file, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+    start_epoch = len(history.get('val_accuracy', []))
+
+    with open(os.path.join(trial_dir, 'train.log'), 'a', encoding='utf-8') as log, \
+            contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        if start_epoch:
+            model = keras.models.load_model(model_file)
+        else:
+            model = trainer.build_model(**{name: params[name] for name in MODEL_PARAMS if name in params})
+        batch_size = int(params.get('batch_size', 32))
+        result = model.fit(
+            trainer.make_dataset(cache, 'train', batch_size, training=True, in_memory=False),
+            initial_epoch=start_epoch,
+            epochs=task['epochs'],
+            validation_data=trainer.make_dataset(cache, 'val', 256, in_memory=False),
+            callbacks=[trainer.ThroughputLogger(batch_size)],
+            verbose=2
+        )
+        if any(math.isnan(float(v)) for v in result.history.get('loss', [])):
+            raise ValueError('训练损失为NaN')
+        model.save(model_file)
+
+    for key, values in result.history.items():
+        history.setdefault(key, []).extend(float(v) for v in values)
+    with open(history_file, 'w', encoding='utf-8') as f:
+        json.dump(history, f, indent=2)
+
+    val_accuracy = history['val_accuracy']
+    best_epoch = max(range(len(val_accuracy)), key=val_accuracy.__getitem__)
+    return {
+        'trial': task['trial'],
+        'epochs': len(val_accuracy),
+        'val_accuracy': val_accuracy[best_epoch],
+        'best_epoch': best_epoch + 1,
+        'images_per_sec': history['images_per_sec'][-1],
+        'seconds': time.time() - started
+    }
+
+# ---------------------------------------------------------------- 主进程
+
+def write_leaderboard(path, rows, meta):
+    """排行榜：训练轮数多（存活更久）的在前，同轮数按最佳验证准确率排序"""
+    ranked = sorted(rows.values(), key=lambda r: (r['epochs'], r['val_accuracy'] or 0), reverse=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({**meta, 'updated_at': datetime.now().isoformat(), 'trials': ranked},
+                  f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return ranked
+
+def print_leaderboard(ranked, limit=10):
+    """打印排行榜前几名"""
+    print(f"\n{'排名':>4} {'试验':>6} {'轮数':>6} {'验证准确率':>10} {'状态':>8}  超参数")
+    for rank, row in enumerate(ranked[:limit], 1):
+        params = ', '.join(f"{k}={v:.4g}" if isinstance(v, float) else f"{k}={v}"
+                           for k, v in row['params'].items())
+        accuracy = f"{row['val_accuracy']:.4f}" if row['val_accuracy'] is not None else '-'
+        print(f"{rank:>6} {row['trial']:>8} {row['epochs']:>8} {accuracy:>15} {row['status']:>10}  {params}")
+
+def main():
+    """主函数"""
+    args = parse_args()
+    cpus = os.cpu_count() or 1
+    threads = max(1, min(args.threads, cpus))
+    workers = args.workers or max(1, cpus // threads)
+
+    space = DEFAULT_SPACE
+    if args.space:
+        with open(args.space, 'r', encoding='utf-8') as f:
+            space = json.load(f)
+    configs = sample_configs(space, args.trials, args.seed)
+    rungs = rung_schedule(args.min_epochs, args.max_epochs, args.eta)
+    output = args.output or os.path.join(SWEEP_DIR, datetime.now().strftime('%Y%m%d_%H%M%S'))
+    os.makedirs(output, exist_ok=True)
+    leaderboard_path = os.path.join(output, 'leaderboard.json')
+
+    print("=" * 60)
+    print("星系分类模型超参数搜索")
+    print(f"试验组数：{len(configs)}，并行进程：{workers} x {threads} 线程")
+    print(f"逐轮减半：各轮训练到 {rungs} 轮，每轮保留前 1/{args.eta}")
+    print(f"输出目录：{output}")
+    print("=" * 60)
+
+    # 主进程先构建好预处理缓存，试验进程只读打开同一份内存映射文件
+    load_cache(args.data)
+
+    rows = {
+        f'{i:03d}': {'trial': f'{i:03d}', 'params': params, 'status': 'pending', 'epochs': 0,
+                     'val_accuracy': None, 'best_epoch': None, 'images_per_sec': None, 'seconds': 0.0,
+                     'error': None}
+        for i, params in enumerate(configs)
+    }
+    meta = {'space': space, 'rungs': rungs, 'eta': args.eta, 'workers': workers, 'threads': threads}
+
+    # 每个进程绑定一组不重叠的核心；核心不够分时不绑定
+    core_list = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else []
+    ctx = multiprocessing.get_context('spawn')
+    core_sets = ctx.Queue()
+    for i in range(workers):
+        cores = core_list[i * threads:(i + 1) * threads]
+        core_sets.put(cores if len(cores) == threads else None)
+
+    started = time.time()
+    alive = list(rows)
+    with ctx.Pool(workers, initializer=_init_worker,
+                  initargs=(threads, args.precision, core_sets)) as pool:
+        for rung, epochs in enumerate(rungs):
+            print(f"\n第 {rung + 1}/{len(rungs)} 轮：{len(alive)} 组试验训练到 {epochs} 轮")
+            tasks = [{
+                'trial': trial,
+                'params': rows[trial]['params'],
+                'epochs': epochs,
+                'dir': os.path.join(output, trial),
+                'cache_dir': CACHE_DIR
+            } for trial in alive]
+            for trial in alive:
+                rows[trial]['status'] = 'running'
+
+            for result in pool.imap_unordered(run_trial, tasks):
+                row = rows[result['trial']]
+                if result.get('status') == 'failed':
+                    # 失败的试验保留上一轮的指标，不再参加后续各轮
+                    row.update(result)
+                    alive.remove(row['trial'])
+                    print(f"  试验 {row['trial']} 失败：{row['error']}")
+                else:
+                    row['seconds'] += result.pop('seconds')
+                    row.update(result)
+                    print(f"  试验 {row['trial']}：{row['epochs']} 轮，最佳验证准确率 {row['val_accuracy']:.4f}，"
+                          f"{row['images_per_sec']:.0f} 张/秒")
+                write_leaderboard(leaderboard_path, rows, meta)
+
+            if not alive:
+                print("本轮所有试验均失败，停止搜索")
+                break
+            alive.sort(key=lambda trial: rows[trial]['val_accuracy'], reverse=True)
+            if rung == len(rungs) - 1:
+                for trial in alive:
+                    rows[trial]['status'] = 'finished'
+                break
+            keep = max(1, len(alive) // args.eta)
+            for trial in alive[keep:]:
+                rows[trial]['status'] = 'stopped'
+            alive = alive[:keep]
+
+    ranked = write_leaderboard(leaderboard_path, rows, meta)
+    print_leaderboard(ranked)
+
+    finished = [row for row in ranked if row['status'] == 'finished']
+    if not finished:
+        print(f"\n没有完成全部轮次的试验（各试验的错误见排行榜与 train.log）：{leaderboard_path}")
+        return
+    best = finished[0]
+    params = best['params']
+    print(f"\n搜索完成，耗时 {(time.time() - started) / 60:.1f} 分钟；排行榜已保存至：{leaderboard_path}")
+    print(f"最佳试验 {best['trial']}：验证准确率 {best['val_accuracy']:.4f}（第 {best['best_epoch']} 轮）")
+    options = ' '.join(f"--{name.replace('_', '-')} {value:.4g}" for name, value in params.items()
+                       if name in MODEL_PARAMS + ('batch_size',))
+    print(f"完整训练：python train_galaxy_model.py {options}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+天体定位回调与不带提示重试的时序测试
+
+Astrometry服务在 update_job 中先发布事件、再发送回调，同一个失败任务的事件与回调会先后到达：
+事件触发不带提示重试后、重试任务上传完成前记录的 job_id 为空，随后到达的旧任务回调不能把记录标记为失败
+"""
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from models import db, CelestialPositioning
+from services.celestial_positioning_service import CelestialPositioningService
+from utils.result_cache import ResultCache
+
+HINTS = {'scale_low': 1.0, 'scale_high': 2.0}
+CALIBRATION = {'ra': 10.0, 'dec': 20.0, 'field_width': 1.0, 'field_height': 0.8, 'orientation': 0.0}
+
+
+class StubPositioningService(CelestialPositioningService):
+    """不访问Astrometry服务：上传依次返回 job-2、job-3……，可阻塞上传模拟上传途中"""
+
+    def __init__(self):
+        super().__init__(api_url='http://astrometry.invalid', cache=ResultCache('test:solve'))
+        self.uploads = []
+        self.upload_gate = threading.Event()
+        self.upload_gate.set()
+
+    def upload(self, image_path, record_id=None, hints=None, use_cache=True):
+        self.upload_gate.wait(5)
+        self.uploads.append((record_id, hints))
+        return f"job-{len(self.uploads) + 1}"
+
+    def fetch_status(self, job_id, wait=0):
+        return {'job_id': job_id, 'status': 'solving'}
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    monkeypatch.setenv('ASTROMETRY_NOTIFY', 'poll')
+    monkeypatch.setenv('ASTROMETRY_POLL_INTERVAL', '60')
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'test.db'}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+@pytest.fixture
+def service():
+    service = StubPositioningService()
+    yield service
+    service.tracker.stop()
+
+
+def create_record(app, hints=HINTS, **fields):
+    with app.app_context():
+        fields.setdefault('status', 'pending')
+        record = CelestialPositioning(user_id=1, image_path='sky.fits', solved=False,
+                                      hints=json.dumps(hints) if hints else None, **fields)
+        db.session.add(record)
+        db.session.commit()
+        return record.id
+
+
+def load(app, record_id):
+    with app.app_context():
+        return CelestialPositioning.query.get(record_id).to_dict()
+
+
+def wait_for(app, record_id, predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        record = load(app, record_id)
+        if predicate(record):
+            return record
+        time.sleep(0.01)
+    pytest.fail(f"记录状态未按预期变化: {load(app, record_id)}")
+
+
+def callback(app, service, record_id, job):
+    with app.test_request_context():
+        return service.handle_callback(record_id, service.callback_token(record_id), job)
+
+
+def test_late_callback_after_event_triggered_retry(app, service):
+    record_id = create_record(app)
+    service.tracker.start(app)
+    with app.app_context():
+        service.mark_processing(record_id, 'job-1')
+    service.tracker._track(record_id, 'job-1', time.time())
+
+    # 事件先到：带提示的任务失败，去掉提示重试，重试任务还在上传
+    service.upload_gate.clear()
+    service.tracker._on_event({'job_id': 'job-1', 'status': 'failure', 'error': '未解析'})
+    record = load(app, record_id)
+    assert record['status'] == 'pending'
+    assert record['job_id'] is None
+    assert record['hints']['fallback_from'] == ['job-1']
+
+    # 同一任务的回调随后到达，此时 job_id 仍为空
+    assert callback(app, service, record_id, {'job_id': 'job-1', 'status': 'failure', 'error': '未解析'})
+    assert load(app, record_id)['status'] == 'pending'
+
+    service.upload_gate.set()
+    record = wait_for(app, record_id, lambda r: r['status'] == 'processing')
+    assert record['job_id'] == 'job-2'
+    assert service.uploads == [(record_id, None)]
+
+    # 重试任务上传完成后旧任务的回调同样忽略，新任务的回调正常写回
+    assert callback(app, service, record_id, {'job_id': 'job-1', 'status': 'failure'})
+    assert load(app, record_id)['status'] == 'processing'
+    assert callback(app, service, record_id, {'job_id': 'job-2', 'status': 'success', 'calibration': CALIBRATION})
+    record = load(app, record_id)
+    assert record['status'] == 'success'
+    assert record['ra'] == CALIBRATION['ra']
+
+
+def test_callback_starts_tracker_for_retry(app, service):
+    # 本进程还没有提交过任务，第一次收到的就是失败回调
+    record_id = create_record(app, job_id='job-1', status='processing')
+
+    assert callback(app, service, record_id, {'job_id': 'job-1', 'status': 'failure', 'error': '未解析'})
+
+    record = wait_for(app, record_id, lambda r: r['status'] == 'processing')
+    assert record['job_id'] == 'job-2'
+    assert record['hints']['fallback_from'] == ['job-1']
+
+
+def test_unfinished_jobs_reuploads_pending_records_without_job(app, service):
+    old = datetime.utcnow() - timedelta(seconds=service.upload_grace + 10)
+    stale_id = create_record(app, created_at=old)
+    fresh_id = create_record(app)
+    fallback_id = create_record(app, hints=dict(HINTS, fallback=True, fallback_from=['job-1'],
+                                                fallback_at=time.time() - service.upload_grace - 10),
+                                created_at=old)
+
+    with app.app_context():
+        jobs, uploads = service.unfinished_jobs(service.solve_timeout)
+
+    assert jobs == []
+    assert uploads == [(stale_id, 'sky.fits', HINTS), (fallback_id, 'sky.fits', None)]
+    assert fresh_id not in [record_id for record_id, _, _ in uploads]
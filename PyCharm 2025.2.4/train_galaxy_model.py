@@ -3,12 +3,16 @@
 使用Galaxy10 DECaLS数据集训练模型，目标精度89%
 """
 import numpy as np
-import h5py
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers, models, optimizers, callbacks
-from sklearn.model_selection import train_test_split
 import os
+import json
+import time
+import argparse
+import functools
+from services.model_registry import ModelRegistry
+from utils.galaxy10_cache import load_cache
 
 # 设置随机种子
 np.random.seed(42)
@@ -16,84 +20,212 @@ tf.random.set_seed(42)
 
 # 模型保存路径
 MODEL_PATH = 'models/galaxy_classification_model.h5'
+# 级联推理第一级小模型保存路径
+FAST_MODEL_PATH = 'models/galaxy_fast_model.h5'
+# 蒸馏得到的学生模型、剪枝后的学生模型与对比报告
+STUDENT_MODEL_PATH = 'models/galaxy_student_model.h5'
+PRUNED_MODEL_PATH = 'models/galaxy_student_pruned.h5'
+DISTILL_REPORT_PATH = 'models/distill_report.json'
 os.makedirs('models', exist_ok=True)
 
-def load_galaxy10_data(data_path='Galaxy10_DECals.h5'):
+def load_galaxy10_data(data_path='Galaxy10_DECals.h5', rebuild_cache=False):
     """
     加载Galaxy10 DECaLS数据集
     数据集可以从 https://astronn.readthedocs.io/en/latest/galaxy10.html 下载
+
+    首次运行时把原图缩放到 69x69 写入uint8内存映射缓存，之后直接打开缓存，不再解码HDF5
     """
     print("正在加载数据集...")
     
-    if not os.path.exists(data_path):
-        raise FileNotFoundError(
-            f"数据集文件 {data_path} 不存在。\n"
-            "请从以下链接下载Galaxy10 DECaLS数据集：\n"
-            "https://astronn.readthedocs.io/en/latest/galaxy10.html"
-        )
+    cache = load_cache(data_path, rebuild=rebuild_cache)
     
-    with h5py.File(data_path, 'r') as F:
-        images = np.array(F['images'])
-        labels = np.array(F['ans'])
+    print(f"数据集加载完成：{len(cache)} 张图片")
+    print(f"图片形状：{cache.images.shape}")
+    print(f"类别数量：{cache.num_classes}")
     
-    print(f"数据集加载完成：{len(images)} 张图片")
-    print(f"图片形状：{images.shape}")
-    print(f"标签形状：{labels.shape}")
-    print(f"类别数量：{len(np.unique(labels))}")
+    return cache
+
+class Galaxy10Sequence(keras.utils.Sequence):
+    """
+    按批从预处理缓存读取数据
+    每批在读取时才转换为float32并做数据增强，内存中只保留当前批次
+    """
     
-    return images, labels
+    def __init__(self, cache, indices, batch_size=32, augment=None, shuffle=False):
+        super().__init__()
+        self.cache = cache
+        self.indices = np.array(indices)
+        self.batch_size = batch_size
+        self.augment = augment
+        self.shuffle = shuffle
+        if shuffle:
+            np.random.shuffle(self.indices)
+    
+    def __len__(self):
+        return int(np.ceil(len(self.indices) / self.batch_size))
+    
+    def __getitem__(self, index):
+        batch = self.indices[index * self.batch_size:(index + 1) * self.batch_size]
+        images, labels = self.cache.batch(batch)
+        if self.augment is not None:
+            images = np.stack([self.augment.random_transform(image) for image in images])
+        return images, keras.utils.to_categorical(labels, self.cache.num_classes)
+    
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.indices)
+
+def build_augmentation():
+    """
+    计算图上的数据增强，参数与原 ImageDataGenerator 相同：旋转15度、平移10%、水平翻转、缩放10%；
+    增强在输入流水线中进行，固定为float32，不受混合精度策略影响
+    """
+    return keras.Sequential([
+        layers.RandomFlip('horizontal', dtype='float32'),
+        layers.RandomRotation(15 / 360, fill_mode='nearest', dtype='float32'),
+        layers.RandomTranslation(0.1, 0.1, fill_mode='nearest', dtype='float32'),
+        layers.RandomZoom(0.1, fill_mode='nearest', dtype='float32')
+    ])
+
+def make_dataset(cache, split, batch_size=32, training=False, read_chunk=1024, shuffle_buffer=4096,
+                 in_memory=True):
+    """
+    构建 tf.data 输入流水线
 
-def preprocess_data(images, labels):
-    """预处理数据"""
-    print("正在预处理数据...")
+    按下标顺序分块从内存映射缓存读取uint8图片，首轮读取后整体缓存在内存中（训练集约180MB），
+    每轮整体打乱后成批在计算图上转换为float32并做数据增强，多线程并行、预取下一批，
+    不经过单线程的Python增强代码
+
+    in_memory=False 时每轮都从内存映射读取，多个训练进程共享操作系统页缓存中的同一份数据
+    """
+    AUTOTUNE = tf.data.AUTOTUNE
+    height, width, channels = cache.images.shape[1:]
+    
+    def read(indices):
+        indices = np.sort(indices)
+        return cache.images[indices], cache.labels[indices].astype(np.int32)
+    
+    def read_chunk_fn(indices):
+        images, labels = tf.numpy_function(read, [indices], (tf.uint8, tf.int32))
+        images.set_shape((None, height, width, channels))
+        labels.set_shape((None,))
+        return images, labels
     
-    # 归一化到[0, 1]
-    images = images.astype('float32') / 255.0
+    indices = np.sort(cache.splits[split])
+    dataset = tf.data.Dataset.from_tensor_slices(indices)
+    if training and not in_memory:
+        # 不缓存时每轮重新打乱下标，块内仍按下标顺序读取
+        dataset = dataset.shuffle(len(indices), reshuffle_each_iteration=True)
+    dataset = dataset.batch(read_chunk)
+    dataset = dataset.map(read_chunk_fn, num_parallel_calls=AUTOTUNE).unbatch()
+    if in_memory:
+        dataset = dataset.cache()
     
-    # 转换为one-hot编码
-    num_classes = 10
-    labels_one_hot = keras.utils.to_categorical(labels, num_classes)
+    if training:
+        # 内存缓存按下标顺序存放，需整体打乱（缓冲区为整个训练集，约180MB uint8）每轮才覆盖全部样本；
+        # 不缓存时下标已整体打乱，只需打散块内的下标顺序
+        buffer_size = len(indices) if in_memory else shuffle_buffer
+        dataset = dataset.shuffle(buffer_size, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size, drop_remainder=training)
     
-    print(f"数据预处理完成")
-    print(f"图片范围：[{images.min():.3f}, {images.max():.3f}]")
+    augment = build_augmentation() if training else None
+    num_classes = cache.num_classes
     
-    return images, labels_one_hot
+    def transform(images, labels):
+        images = tf.cast(images, tf.float32) * (1.0 / 255.0)
+        if augment is not None:
+            images = augment(images, training=True)
+        return images, tf.one_hot(labels, num_classes)
+    
+    dataset = dataset.map(transform, num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(AUTOTUNE)
 
-def build_model(input_shape=(69, 69, 3), num_classes=10):
+class ThroughputLogger(callbacks.Callback):
+    """记录每轮训练的吞吐量（图片/秒，不含验证时间），写入训练日志的 images_per_sec"""
+    
+    def __init__(self, batch_size):
+        super().__init__()
+        self.batch_size = batch_size
+    
+    def on_epoch_begin(self, epoch, logs=None):
+        self.started = time.perf_counter()
+        self.batches = 0
+        self.finished = self.started
+    
+    def on_train_batch_end(self, batch, logs=None):
+        self.batches += 1
+        self.finished = time.perf_counter()
+    
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = self.finished - self.started
+        images_per_sec = self.batches * self.batch_size / elapsed if elapsed > 0 else 0.0
+        if logs is not None:
+            logs['images_per_sec'] = images_per_sec
+        print(f"\n第 {epoch + 1} 轮训练吞吐量：{images_per_sec:.1f} 张/秒（{elapsed:.1f}s）")
+
+def configure_training(precision='float32', threads=0):
+    """
+    设置训练精度与线程数，须在构建模型之前调用
+
+    precision: float32 / mixed_float16 / mixed_bfloat16；
+    CPU上通常选 mixed_bfloat16（需支持AVX512-BF16/AMX的处理器才有加速）
+    """
+    if threads:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(2)
+    keras.mixed_precision.set_global_policy(precision)
+
+def export_float32(model, build_fn, model_path):
+    """
+    混合精度训练的模型按float32结构重建后保存，
+    线上推理服务加载到的模型与float32训练的模型完全一致
+    """
+    if keras.mixed_precision.global_policy().name == 'float32':
+        return model
+    weights = model.get_weights()
+    keras.mixed_precision.set_global_policy('float32')
+    model = build_fn()
+    model.set_weights(weights)
+    model.save(model_path)
+    return model
+
+def build_model(input_shape=(69, 69, 3), num_classes=10, jit_compile=False,
+                learning_rate=0.001, conv_dropout=0.25, dense_dropout=0.5):
     """
     构建CNN模型
-    使用深度卷积神经网络，包含多个卷积层和全连接层
+    使用深度卷积神经网络，包含多个卷积层和全连接层；
+    学习率与两类Dropout比例可调，供超参数搜索（sweep_galaxy_model.py）使用
     """
     print("正在构建模型...")
     
     model = models.Sequential([
         # 第一组卷积层
-        layers.Conv2D(32, (3, 3), activation='relu', input_shape=input_shape),
+        layers.Conv2D(32, (3, 3), activation='relu', padding='same', input_shape=input_shape),
         layers.BatchNormalization(),
-        layers.Conv2D(32, (3, 3), activation='relu'),
+        layers.Conv2D(32, (3, 3), activation='relu', padding='same'),
         layers.MaxPooling2D((2, 2)),
-        layers.Dropout(0.25),
+        layers.Dropout(conv_dropout),
         
         # 第二组卷积层
-        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.Conv2D(64, (3, 3), activation='relu', padding='same'),
         layers.BatchNormalization(),
-        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.Conv2D(64, (3, 3), activation='relu', padding='same'),
         layers.MaxPooling2D((2, 2)),
-        layers.Dropout(0.25),
+        layers.Dropout(conv_dropout),
         
         # 第三组卷积层
-        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.Conv2D(128, (3, 3), activation='relu', padding='same'),
         layers.BatchNormalization(),
-        layers.Conv2D(128, (3, 3), activation='relu'),
+        layers.Conv2D(128, (3, 3), activation='relu', padding='same'),
         layers.MaxPooling2D((2, 2)),
-        layers.Dropout(0.25),
+        layers.Dropout(conv_dropout),
         
         # 第四组卷积层
-        layers.Conv2D(256, (3, 3), activation='relu'),
+        layers.Conv2D(256, (3, 3), activation='relu', padding='same'),
         layers.BatchNormalization(),
-        layers.Conv2D(256, (3, 3), activation='relu'),
+        layers.Conv2D(256, (3, 3), activation='relu', padding='same'),
         layers.MaxPooling2D((2, 2)),
-        layers.Dropout(0.25),
+        layers.Dropout(conv_dropout),
         
         # 展平
         layers.Flatten(),
@@ -101,20 +233,21 @@ def build_model(input_shape=(69, 69, 3), num_classes=10):
         # 全连接层
         layers.Dense(512, activation='relu'),
         layers.BatchNormalization(),
-        layers.Dropout(0.5),
+        layers.Dropout(dense_dropout),
         layers.Dense(256, activation='relu'),
         layers.BatchNormalization(),
-        layers.Dropout(0.5),
+        layers.Dropout(dense_dropout),
         
         # 输出层
-        layers.Dense(num_classes, activation='softmax')
+        layers.Dense(num_classes, activation='softmax', dtype='float32')
     ])
     
     # 编译模型
     model.compile(
-        optimizer=optimizers.Adam(learning_rate=0.001),
+        optimizer=optimizers.Adam(learning_rate=learning_rate),
         loss='categorical_crossentropy',
-        metrics=['accuracy', 'top_3_accuracy']
+        metrics=['accuracy', keras.metrics.TopKCategoricalAccuracy(k=3, name='top_3_accuracy')],
+        jit_compile=jit_compile
     )
     
     print("模型构建完成")
@@ -122,24 +255,68 @@ def build_model(input_shape=(69, 69, 3), num_classes=10):
     
     return model
 
-def train_model(model, X_train, y_train, X_val, y_val, epochs=100, batch_size=32):
-    """训练模型"""
-    print("开始训练模型...")
+def build_fast_model(input_shape=(69, 69, 3), num_classes=10, jit_compile=False):
+    """
+    构建级联推理第一级的小模型
+    首层步长2卷积快速降采样，后接深度可分离卷积，计算量约为完整模型的几十分之一，
+    负责恒星、圆形椭圆星系等容易分辨的图片
+    """
+    print("正在构建小模型...")
     
-    # 数据增强
-    datagen = keras.preprocessing.image.ImageDataGenerator(
-        rotation_range=15,
-        width_shift_range=0.1,
-        height_shift_range=0.1,
-        horizontal_flip=True,
-        zoom_range=0.1
+    model = models.Sequential([
+        layers.Conv2D(16, (3, 3), strides=2, activation='relu', input_shape=input_shape),
+        layers.BatchNormalization(),
+        layers.SeparableConv2D(32, (3, 3), activation='relu'),
+        layers.MaxPooling2D((2, 2)),
+        layers.SeparableConv2D(64, (3, 3), activation='relu'),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+        layers.SeparableConv2D(96, (3, 3), activation='relu'),
+        layers.GlobalAveragePooling2D(),
+        layers.Dropout(0.3),
+        layers.Dense(num_classes, activation='softmax', dtype='float32')
+    ])
+    
+    model.compile(
+        optimizer=optimizers.Adam(learning_rate=0.002),
+        loss='categorical_crossentropy',
+        metrics=['accuracy', keras.metrics.TopKCategoricalAccuracy(k=3, name='top_3_accuracy')],
+        jit_compile=jit_compile
     )
-    datagen.fit(X_train)
+    
+    print("小模型构建完成")
+    model.summary()
+    
+    return model
+
+def train_model(model, cache, epochs=100, batch_size=32, model_path=MODEL_PATH, pipeline='tfdata'):
+    """
+    训练模型
+
+    pipeline: tfdata（默认）或 generator（原 ImageDataGenerator 方式，用于对比吞吐量）
+    """
+    print("开始训练模型...")
+    
+    if pipeline == 'tfdata':
+        train_data = make_dataset(cache, 'train', batch_size, training=True)
+        val_data = make_dataset(cache, 'val', 256)
+    else:
+        # 数据增强
+        datagen = keras.preprocessing.image.ImageDataGenerator(
+            rotation_range=15,
+            width_shift_range=0.1,
+            height_shift_range=0.1,
+            horizontal_flip=True,
+            zoom_range=0.1
+        )
+        train_data = Galaxy10Sequence(cache, cache.splits['train'], batch_size, augment=datagen, shuffle=True)
+        val_data = Galaxy10Sequence(cache, cache.splits['val'], 256)
     
     # 回调函数
     callbacks_list = [
+        ThroughputLogger(batch_size),
         callbacks.ModelCheckpoint(
-            MODEL_PATH,
+            model_path,
             monitor='val_accuracy',
             save_best_only=True,
             mode='max',
@@ -162,21 +339,21 @@ def train_model(model, X_train, y_train, X_val, y_val, epochs=100, batch_size=32
     
     # 训练
     history = model.fit(
-        datagen.flow(X_train, y_train, batch_size=batch_size),
-        steps_per_epoch=len(X_train) // batch_size,
+        train_data,
         epochs=epochs,
-        validation_data=(X_val, y_val),
+        validation_data=val_data,
         callbacks=callbacks_list,
         verbose=1
     )
     
     return history
 
-def evaluate_model(model, X_test, y_test):
+def evaluate_model(model, cache):
     """评估模型"""
     print("正在评估模型...")
     
-    test_loss, test_accuracy, test_top3_accuracy = model.evaluate(X_test, y_test, verbose=0)
+    test_data = make_dataset(cache, 'test', 256)
+    test_loss, test_accuracy, test_top3_accuracy = model.evaluate(test_data, verbose=0)
     
     print(f"\n测试集结果：")
     print(f"损失：{test_loss:.4f}")
@@ -184,9 +361,9 @@ def evaluate_model(model, X_test, y_test):
     print(f"Top-3准确率：{test_top3_accuracy:.4f} ({test_top3_accuracy*100:.2f}%)")
     
     # 预测
-    y_pred = model.predict(X_test, verbose=0)
+    y_pred = model.predict(test_data, verbose=0)
     y_pred_classes = np.argmax(y_pred, axis=1)
-    y_true_classes = np.argmax(y_test, axis=1)
+    y_true_classes = cache.labels[np.sort(cache.splits['test'])]
     
     # 计算每个类别的准确率
     from sklearn.metrics import classification_report, confusion_matrix
@@ -195,48 +372,347 @@ def evaluate_model(model, X_test, y_test):
     
     return test_accuracy
 
+def build_student_model(input_shape=(69, 69, 3), num_classes=10, jit_compile=False):
+    """
+    构建蒸馏用的学生模型
+    两组普通卷积 + 两组深度可分离卷积 + 全局平均池化，去掉了完整模型中参数量最大的512/256全连接层；
+    倒数第二层仍为全连接特征层，可直接用于相似星系检索
+    """
+    print("正在构建学生模型...")
+    
+    model = models.Sequential([
+        layers.Conv2D(32, (3, 3), activation='relu', padding='same', input_shape=input_shape),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+        layers.Conv2D(64, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+        layers.SeparableConv2D(128, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+        layers.SeparableConv2D(192, (3, 3), activation='relu', padding='same'),
+        layers.BatchNormalization(),
+        layers.GlobalAveragePooling2D(),
+        layers.Dense(128, activation='relu'),
+        layers.Dropout(0.3),
+        layers.Dense(num_classes, activation='softmax', dtype='float32')
+    ])
+    
+    model.compile(
+        optimizer=optimizers.Adam(learning_rate=0.002),
+        loss='categorical_crossentropy',
+        metrics=['accuracy', keras.metrics.TopKCategoricalAccuracy(k=3, name='top_3_accuracy')],
+        jit_compile=jit_compile
+    )
+    
+    print("学生模型构建完成")
+    model.summary()
+    
+    return model
+
+class Distiller(keras.Model):
+    """
+    知识蒸馏：学生模型同时拟合真实标签和教师模型在温度T下软化后的输出
+    loss = alpha * 交叉熵(标签, 学生) + (1 - alpha) * T^2 * KL(教师_T || 学生_T)
+    """
+    
+    def __init__(self, student, teacher, temperature=4.0, alpha=0.1):
+        super().__init__()
+        self.student = student
+        self.teacher = teacher
+        self.teacher.trainable = False
+        self.temperature = temperature
+        self.alpha = alpha
+        self.loss_tracker = keras.metrics.Mean(name='loss')
+        self.hard_loss = keras.losses.CategoricalCrossentropy()
+        self.soft_loss = keras.losses.KLDivergence()
+    
+    def soften(self, probabilities):
+        """两个模型输出的都是softmax概率，取log后除以温度再做softmax，等价于对logits做温度缩放"""
+        logits = tf.math.log(tf.cast(probabilities, tf.float32) + 1e-8)
+        return tf.nn.softmax(logits / self.temperature)
+    
+    def call(self, inputs, training=False):
+        return self.student(inputs, training=training)
+    
+    def train_step(self, data):
+        images, labels = data
+        teacher_output = self.teacher(images, training=False)
+        
+        with tf.GradientTape() as tape:
+            student_output = self.student(images, training=True)
+            hard = self.hard_loss(labels, student_output)
+            soft = self.soft_loss(self.soften(teacher_output), self.soften(student_output))
+            loss = self.alpha * hard + (1 - self.alpha) * soft * self.temperature ** 2
+        
+        self.optimizer.minimize(loss, self.student.trainable_variables, tape=tape)
+        self.loss_tracker.update_state(loss)
+        self.compiled_metrics.update_state(labels, student_output)
+        return {m.name: m.result() for m in self.metrics}
+    
+    def test_step(self, data):
+        images, labels = data
+        student_output = self.student(images, training=False)
+        self.loss_tracker.update_state(self.hard_loss(labels, student_output))
+        self.compiled_metrics.update_state(labels, student_output)
+        return {m.name: m.result() for m in self.metrics}
+
+class MagnitudePruning(callbacks.Callback):
+    """
+    逐步幅度剪枝
+    在前半数轮次内把卷积核与全连接权重中绝对值最小的部分置零，稀疏度线性增加到 target_sparsity，
+    之后保持不变继续微调；每个训练批次后重新应用掩码，已剪掉的权重始终为零。
+    首层卷积与输出层参数很少且对精度敏感，不参与剪枝
+    """
+    
+    def __init__(self, model, target_sparsity=0.5, epochs=6):
+        super().__init__()
+        self.pruned_model = model
+        self.target_sparsity = target_sparsity
+        self.ramp_epochs = max(epochs // 2, 1)
+        self.masks = []
+    
+    def prunable_weights(self):
+        weights = []
+        for layer in self.pruned_model.layers[1:-1]:
+            if isinstance(layer, (layers.Conv2D, layers.SeparableConv2D, layers.Dense)):
+                weights.extend(w for w in layer.trainable_weights if 'kernel' in w.name)
+        return weights
+    
+    def on_epoch_begin(self, epoch, logs=None):
+        sparsity = self.target_sparsity * min(1.0, (epoch + 1) / self.ramp_epochs)
+        self.masks = []
+        for weight in self.prunable_weights():
+            values = np.abs(weight.numpy())
+            threshold = np.quantile(values, sparsity)
+            mask = (values > threshold).astype(values.dtype)
+            weight.assign(weight.numpy() * mask)
+            self.masks.append((weight, tf.constant(mask)))
+        print(f"\n剪枝稀疏度：{sparsity:.0%}")
+    
+    def on_train_batch_end(self, batch, logs=None):
+        for weight, mask in self.masks:
+            weight.assign(weight * mask)
+
+def distill_model(student, teacher, cache, epochs=60, batch_size=64, temperature=4.0, alpha=0.1,
+                  learning_rate=0.002, extra_callbacks=None):
+    """用教师模型蒸馏训练学生模型，结束时学生模型恢复为验证集上最好的权重"""
+    distiller = Distiller(student, teacher, temperature=temperature, alpha=alpha)
+    distiller.compile(
+        optimizer=optimizers.Adam(learning_rate=learning_rate),
+        metrics=['accuracy', keras.metrics.TopKCategoricalAccuracy(k=3, name='top_3_accuracy')]
+    )
+    
+    callbacks_list = [
+        ThroughputLogger(batch_size),
+        callbacks.EarlyStopping(
+            monitor='val_accuracy',
+            patience=10,
+            restore_best_weights=True,
+            verbose=1
+        ),
+        callbacks.ReduceLROnPlateau(
+            monitor='val_loss',
+            factor=0.5,
+            patience=4,
+            min_lr=1e-6,
+            verbose=1
+        )
+    ] + (extra_callbacks or [])
+    
+    return distiller.fit(
+        make_dataset(cache, 'train', batch_size, training=True),
+        epochs=epochs,
+        validation_data=make_dataset(cache, 'val', 256),
+        callbacks=callbacks_list,
+        verbose=1
+    )
+
+def measure_model(model_path, cache, single_runs=200, batch_runs=30):
+    """
+    测量模型的测试集准确率、Top-3准确率、参数量、文件大小，
+    以及通过线上推理后端（KerasBackend）在本机测得的单张与64张批量推理延迟
+    """
+    import gzip
+    from services.inference_backends import create_backend
+    
+    backend = create_backend('keras', model_path)
+    test_images, test_labels = cache.batch(np.sort(cache.splits['test']))
+    probabilities = np.concatenate([
+        backend.predict(test_images[start:start + 256]) for start in range(0, len(test_images), 256)
+    ])
+    top3 = np.argsort(-probabilities, axis=1)[:, :3]
+    
+    weights = backend.model.get_weights()
+    with open(model_path, 'rb') as f:
+        compressed_size = len(gzip.compress(f.read()))
+    
+    def median_ms(batch, runs):
+        backend.predict(batch)
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            backend.predict(batch)
+            timings.append((time.perf_counter() - started) * 1000)
+        return float(np.median(timings))
+    
+    return {
+        'path': model_path,
+        'accuracy': float((probabilities.argmax(axis=1) == test_labels).mean()),
+        'top3_accuracy': float((top3 == test_labels[:, np.newaxis]).any(axis=1).mean()),
+        'params': int(sum(w.size for w in weights)),
+        'nonzero_params': int(sum(np.count_nonzero(w) for w in weights)),
+        'file_size': os.path.getsize(model_path),
+        'gzip_size': compressed_size,
+        'latency_single_ms': median_ms(test_images[:1], single_runs),
+        'latency_batch64_ms': median_ms(test_images[:64], batch_runs)
+    }
+
+def print_report(rows):
+    """打印模型对比表"""
+    print(f"\n{'模型':<12}{'准确率':>8}{'Top-3':>8}{'参数量':>12}{'非零参数':>12}"
+          f"{'文件(MB)':>10}{'gzip(MB)':>10}{'单张(ms)':>10}{'64张(ms)':>10}")
+    for name, row in rows.items():
+        print(f"{name:<12}{row['accuracy']:>9.4f}{row['top3_accuracy']:>9.4f}{row['params']:>13,}"
+              f"{row['nonzero_params']:>13,}{row['file_size'] / 2**20:>11.2f}{row['gzip_size'] / 2**20:>11.2f}"
+              f"{row['latency_single_ms']:>11.2f}{row['latency_batch64_ms']:>11.2f}")
+
+def run_distillation(args, cache):
+    """
+    蒸馏模式：把已训练的完整模型（教师）蒸馏为学生模型，可选幅度剪枝，
+    输出对比报告，并把最终的学生模型发布到模型仓库
+    """
+    teacher = keras.models.load_model(args.teacher, compile=False)
+    print(f"已加载教师模型：{args.teacher}")
+    
+    # 1. 蒸馏
+    student = build_student_model(jit_compile=args.xla)
+    distill_model(student, teacher, cache, epochs=args.epochs, batch_size=args.batch_size,
+                  temperature=args.temperature, alpha=args.alpha)
+    student = export_float32(student, build_student_model, STUDENT_MODEL_PATH)
+    student.save(STUDENT_MODEL_PATH)
+    print(f"学生模型已保存至：{STUDENT_MODEL_PATH}")
+    
+    final_path = STUDENT_MODEL_PATH
+    report_paths = {'teacher': args.teacher, 'student': STUDENT_MODEL_PATH}
+    
+    # 2. 剪枝微调（学生模型结构不变，权重中指定比例置零）
+    if args.prune > 0:
+        pruning = MagnitudePruning(student, args.prune, args.prune_epochs)
+        distill_model(student, teacher, cache, epochs=args.prune_epochs, batch_size=args.batch_size,
+                      temperature=args.temperature, alpha=args.alpha, learning_rate=2e-4,
+                      extra_callbacks=[pruning])
+        # EarlyStopping 可能恢复到剪枝前期的权重，保存前按目标稀疏度再剪一次
+        pruning.ramp_epochs = 1
+        pruning.on_epoch_begin(0)
+        student = export_float32(student, build_student_model, PRUNED_MODEL_PATH)
+        student.save(PRUNED_MODEL_PATH)
+        print(f"剪枝模型已保存至：{PRUNED_MODEL_PATH}")
+        final_path = PRUNED_MODEL_PATH
+        report_paths['pruned'] = PRUNED_MODEL_PATH
+    
+    # 3. 对比报告
+    rows = {name: measure_model(path, cache) for name, path in report_paths.items()}
+    print_report(rows)
+    report = {
+        'teacher': args.teacher,
+        'temperature': args.temperature,
+        'alpha': args.alpha,
+        'sparsity': args.prune,
+        'models': rows
+    }
+    with open(DISTILL_REPORT_PATH, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n报告已保存至：{DISTILL_REPORT_PATH}")
+    
+    # 4. 发布到模型仓库（上线需管理员调用切换接口）
+    final = rows['pruned' if args.prune > 0 else 'student']
+    version = ModelRegistry().publish(final_path, {
+        'accuracy': final['accuracy'],
+        'top3_accuracy': final['top3_accuracy'],
+        'teacher': args.teacher,
+        'sparsity': args.prune,
+        'source': 'train_galaxy_model.py --model distill'
+    })
+    print(f"已发布到模型仓库：{version}")
+    print(f"上线：POST /api/galaxy/admin/models/{version}/activate")
+
+def parse_args():
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description='星系分类模型训练')
+    parser.add_argument('--model', choices=['full', 'fast', 'distill'], default='full',
+                        help='full: 完整模型；fast: 级联推理第一级的小模型；distill: 由完整模型蒸馏学生模型')
+    parser.add_argument('--epochs', type=int, default=100, help='最大训练轮数')
+    parser.add_argument('--data', default='Galaxy10_DECals.h5', help='Galaxy10数据集路径')
+    parser.add_argument('--rebuild-cache', action='store_true', help='重新构建预处理缓存')
+    parser.add_argument('--batch-size', type=int, default=32, help='训练批次大小')
+    parser.add_argument('--pipeline', choices=['tfdata', 'generator'], default='tfdata',
+                        help='输入流水线：tfdata 或原 ImageDataGenerator（用于对比）')
+    parser.add_argument('--precision', choices=['float32', 'mixed_float16', 'mixed_bfloat16'],
+                        default='float32', help='训练精度')
+    parser.add_argument('--xla', action='store_true', help='启用XLA编译')
+    parser.add_argument('--threads', type=int, default=0, help='计算线程数，0表示由TensorFlow决定')
+    parser.add_argument('--learning-rate', type=float, default=0.001, help='完整模型的初始学习率')
+    parser.add_argument('--conv-dropout', type=float, default=0.25, help='完整模型卷积组的Dropout比例')
+    parser.add_argument('--dense-dropout', type=float, default=0.5, help='完整模型全连接层的Dropout比例')
+    parser.add_argument('--teacher', default=MODEL_PATH, help='蒸馏模式的教师模型路径')
+    parser.add_argument('--temperature', type=float, default=4.0, help='蒸馏温度')
+    parser.add_argument('--alpha', type=float, default=0.1, help='蒸馏损失中真实标签交叉熵的权重')
+    parser.add_argument('--prune', type=float, default=0.0, help='剪枝目标稀疏度（0~1），0表示不剪枝')
+    parser.add_argument('--prune-epochs', type=int, default=6, help='剪枝微调轮数')
+    return parser.parse_args()
+
 def main():
     """主函数"""
+    args = parse_args()
+    fast = args.model == 'fast'
+    model_path = FAST_MODEL_PATH if fast else MODEL_PATH
+    builder = build_fast_model if fast else functools.partial(
+        build_model, learning_rate=args.learning_rate,
+        conv_dropout=args.conv_dropout, dense_dropout=args.dense_dropout
+    )
+    configure_training(args.precision, args.threads)
+    
     print("=" * 60)
-    print("星系分类模型训练")
-    print("目标精度：89%")
+    if args.model == 'distill':
+        print("星系分类模型蒸馏")
+    else:
+        print("星系分类小模型训练（级联推理第一级）" if fast else "星系分类模型训练")
+        print("目标精度：89%")
     print("=" * 60)
     
     try:
-        # 1. 加载数据
-        images, labels = load_galaxy10_data()
-        
-        # 2. 预处理数据
-        images, labels_one_hot = preprocess_data(images, labels)
+        # 1. 加载数据（首次运行时构建预处理缓存）
+        cache = load_galaxy10_data(args.data, rebuild_cache=args.rebuild_cache)
         
-        # 3. 划分数据集（70%训练，15%验证，15%测试）
-        X_train, X_temp, y_train, y_temp = train_test_split(
-            images, labels_one_hot, test_size=0.3, random_state=42, stratify=labels
-        )
-        X_val, X_test, y_val, y_test = train_test_split(
-            X_temp, y_temp, test_size=0.5, random_state=42, stratify=np.argmax(y_temp, axis=1)
-        )
+        if args.model == 'distill':
+            run_distillation(args, cache)
+            print("=" * 60)
+            return
         
+        # 2. 数据集划分（构建缓存时已固定：70%训练，15%验证，15%测试）
         print(f"\n数据集划分：")
-        print(f"训练集：{len(X_train)} 张")
-        print(f"验证集：{len(X_val)} 张")
-        print(f"测试集：{len(X_test)} 张")
+        print(f"训练集：{len(cache.splits['train'])} 张")
+        print(f"验证集：{len(cache.splits['val'])} 张")
+        print(f"测试集：{len(cache.splits['test'])} 张")
         
-        # 4. 构建模型
-        model = build_model()
+        # 3. 构建模型
+        model = builder(jit_compile=args.xla)
         
-        # 5. 训练模型
-        history = train_model(model, X_train, y_train, X_val, y_val, epochs=100, batch_size=32)
+        # 4. 训练模型
+        history = train_model(model, cache, epochs=args.epochs, batch_size=args.batch_size,
+                              model_path=model_path, pipeline=args.pipeline)
         
-        # 6. 加载最佳模型
-        if os.path.exists(MODEL_PATH):
-            model = keras.models.load_model(MODEL_PATH)
-            print(f"\n已加载最佳模型：{MODEL_PATH}")
+        # 5. 加载最佳模型
+        if os.path.exists(model_path):
+            model = keras.models.load_model(model_path)
+            print(f"\n已加载最佳模型：{model_path}")
+        model = export_float32(model, builder, model_path)
         
-        # 7. 评估模型
-        accuracy = evaluate_model(model, X_test, y_test)
+        # 6. 评估模型
+        accuracy = evaluate_model(model, cache)
         
-        # 8. 检查是否达到目标精度
+        # 7. 检查是否达到目标精度
         target_accuracy = 0.89
         if accuracy >= target_accuracy:
             print(f"\n✓ 模型训练成功！")
@@ -246,7 +722,22 @@ def main():
             print(f"  测试准确率：{accuracy*100:.2f}% < 目标精度：{target_accuracy*100:.2f}%")
             print(f"  建议：增加训练轮数或调整模型结构")
         
-        print(f"\n模型已保存至：{MODEL_PATH}")
+        print(f"\n模型已保存至：{model_path}")
+        
+        if fast:
+            # 小模型不进入模型仓库，由 GALAXY_FAST_MODEL_PATH 指定
+            print("选择级联阈值：python tune_cascade_threshold.py")
+            print(f"启用级联：GALAXY_FAST_MODEL_PATH={model_path}")
+            print("=" * 60)
+            return
+        
+        # 8. 发布到模型仓库（上线需管理员调用切换接口）
+        version = ModelRegistry().publish(MODEL_PATH, {
+            'accuracy': float(accuracy),
+            'source': 'train_galaxy_model.py'
+        })
+        print(f"已发布到模型仓库：{version}")
+        print(f"上线：POST /api/galaxy/admin/models/{version}/activate")
         print("=" * 60)
         
     except Exception as e:
@@ -0,0 +1,115 @@
+"""
+级联推理阈值选择脚本
+在固定的测试集上分别运行小模型与完整模型，扫描置信度阈值，
+选出准确率不低于"完整模型准确率 - 容差"且平均单图CPU耗时最低的阈值
+
+用法示例：
+    python tune_cascade_threshold.py --fast models/galaxy_fast_model.h5 --tolerance 0.005
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+from services.inference_backends import DEFAULT_MODEL_PATHS, create_backend
+from services.model_registry import FORMAT_BACKENDS
+from utils.galaxy10_cache import load_cache
+
+def load_test_split(data_path='Galaxy10_DECals.h5', limit=None):
+    """读取与 train_galaxy_model.py 相同划分的测试集（来自预处理缓存）"""
+    cache = load_cache(data_path)
+    return cache.batch(cache.splits['test'][:limit])
+
+def run_model(model_path, images, batch_size=64):
+    """运行模型，返回 (概率, 平均单图耗时ms)；计时使用进程CPU时间"""
+    backend = FORMAT_BACKENDS.get(model_path.rsplit('.', 1)[-1].lower(), 'keras')
+    model = create_backend(backend, model_path)
+    model.predict(images[:batch_size])
+
+    outputs = []
+    started = time.process_time()
+    for start in range(0, len(images), batch_size):
+        outputs.append(np.asarray(model.predict(images[start:start + batch_size]), dtype=np.float32))
+    elapsed = time.process_time() - started
+    return np.concatenate(outputs), elapsed / len(images) * 1000
+
+def sweep(fast_probs, full_probs, labels, fast_ms, full_ms, thresholds):
+    """逐个阈值计算级联准确率、小模型命中率与平均单图耗时"""
+    fast_conf = fast_probs.max(axis=1)
+    fast_pred = fast_probs.argmax(axis=1)
+    full_pred = full_probs.argmax(axis=1)
+
+    rows = []
+    for threshold in thresholds:
+        accepted = fast_conf >= threshold
+        predictions = np.where(accepted, fast_pred, full_pred)
+        hit_rate = float(accepted.mean())
+        rows.append({
+            'threshold': float(threshold),
+            'accuracy': float((predictions == labels).mean()),
+            'fast_hit_rate': hit_rate,
+            'ms_per_image': fast_ms + (1 - hit_rate) * full_ms
+        })
+    return rows
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='级联推理阈值选择')
+    parser.add_argument('--full', default=DEFAULT_MODEL_PATHS['keras'], help='完整模型路径')
+    parser.add_argument('--fast', default='models/galaxy_fast_model.h5', help='小模型路径')
+    parser.add_argument('--data', default='Galaxy10_DECals.h5', help='Galaxy10数据集路径')
+    parser.add_argument('--limit', type=int, default=None, help='最多使用的测试图片数')
+    parser.add_argument('--tolerance', type=float, default=0.005,
+                        help='允许的准确率下降（绝对值，0.005 即 0.5 个百分点）')
+    parser.add_argument('--batch-size', type=int, default=64, help='推理批次大小')
+    parser.add_argument('--report', default='models/cascade_report.json', help='报告输出路径')
+    args = parser.parse_args()
+
+    images, labels = load_test_split(args.data, args.limit)
+    print(f"测试集：{len(images)} 张")
+
+    full_probs, full_ms = run_model(args.full, images, args.batch_size)
+    fast_probs, fast_ms = run_model(args.fast, images, args.batch_size)
+    full_accuracy = float((full_probs.argmax(axis=1) == labels).mean())
+    fast_accuracy = float((fast_probs.argmax(axis=1) == labels).mean())
+    print(f"完整模型：准确率 {full_accuracy:.4f}，{full_ms:.2f} ms/张")
+    print(f"小模型：  准确率 {fast_accuracy:.4f}，{fast_ms:.2f} ms/张")
+
+    rows = sweep(fast_probs, full_probs, labels, fast_ms, full_ms, np.arange(0.50, 1.0, 0.01))
+    print(f"\n{'阈值':>6} {'准确率':>8} {'小模型命中率':>12} {'ms/张':>8}")
+    for row in rows:
+        print(f"{row['threshold']:>8.2f} {row['accuracy']:>10.4f} {row['fast_hit_rate']:>16.2%} "
+              f"{row['ms_per_image']:>10.2f}")
+
+    # 满足精度约束的阈值中选平均耗时最低的
+    eligible = [row for row in rows if row['accuracy'] >= full_accuracy - args.tolerance]
+    best = min(eligible, key=lambda row: row['ms_per_image']) if eligible else None
+
+    report = {
+        'full_model': args.full,
+        'fast_model': args.fast,
+        'test_images': len(images),
+        'tolerance': args.tolerance,
+        'full_accuracy': full_accuracy,
+        'fast_accuracy': fast_accuracy,
+        'full_ms_per_image': full_ms,
+        'fast_ms_per_image': fast_ms,
+        'recommended': best,
+        'sweep': rows
+    }
+    os.makedirs(os.path.dirname(args.report) or '.', exist_ok=True)
+    with open(args.report, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print()
+    if best is None or best['ms_per_image'] >= full_ms:
+        print("没有既满足精度容差又能降低耗时的阈值，不建议启用级联")
+    else:
+        print(f"推荐阈值 {best['threshold']:.2f}：准确率 {best['accuracy']:.4f}，"
+              f"小模型命中率 {best['fast_hit_rate']:.2%}，"
+              f"平均耗时 {best['ms_per_image']:.2f} ms/张（完整模型 {full_ms:.2f} ms/张）")
+        print(f"启用：GALAXY_FAST_MODEL_PATH={args.fast} GALAXY_CASCADE_THRESHOLD={best['threshold']:.2f}")
+    print(f"报告已保存至：{args.report}")
+
+if __name__ == '__main__':
+    main()
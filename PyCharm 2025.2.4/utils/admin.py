@@ -0,0 +1,22 @@
+"""
+管理员权限工具
+"""
+import os
+from functools import wraps
+from flask import jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+
+def is_admin(user_id):
+    """用户是否为管理员（ADMIN_USER_IDS 为逗号分隔的用户ID列表）"""
+    admin_ids = {i.strip() for i in os.getenv('ADMIN_USER_IDS', '').split(',') if i.strip()}
+    return str(user_id) in admin_ids
+
+def admin_required(fn):
+    """要求当前JWT用户为管理员"""
+    @wraps(fn)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        if not is_admin(get_jwt_identity()):
+            return jsonify({'error': '需要管理员权限'}), 403
+        return fn(*args, **kwargs)
+    return wrapper
@@ -2,33 +2,101 @@
 文件上传工具
 """
 import os
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+import zipfile
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import uuid
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'fits', 'fit'}
+ARCHIVE_EXTENSIONS = {'zip', 'tar', 'tgz', 'gz'}
 
-def allowed_file(filename):
+# 压缩包内单个文件的大小上限，防止解压炸弹
+MAX_ARCHIVE_MEMBER_SIZE = 50 * 1024 * 1024
+
+def allowed_file(filename, allowed_extensions=None):
     """检查文件扩展名是否允许"""
+    allowed_extensions = allowed_extensions or ALLOWED_EXTENSIONS
     return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+           filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
-def save_uploaded_file(file, subfolder='uploads'):
-    """保存上传的文件"""
-    if not allowed_file(file.filename):
-        raise Exception('不支持的文件类型')
-    
+def is_archive(filename):
+    """检查文件是否为压缩包（zip/tar/tar.gz/tgz）"""
+    return allowed_file(filename, ARCHIVE_EXTENSIONS)
+
+# 归档写盘线程池，把原始文件落盘移出请求路径
+_archive_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='upload-archive')
+
+def generate_upload_path(filename, subfolder='uploads'):
+    """为上传文件生成唯一的保存路径"""
     # 创建上传目录
     upload_dir = os.path.join('uploads', subfolder)
     os.makedirs(upload_dir, exist_ok=True)
     
     # 生成唯一文件名
-    filename = secure_filename(file.filename)
+    filename = secure_filename(filename)
     ext = filename.rsplit('.', 1)[1].lower()
     unique_filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.{ext}"
     
-    file_path = os.path.join(upload_dir, unique_filename)
+    return os.path.join(upload_dir, unique_filename)
+
+def _write_file(file_path, data):
+    """先写临时文件再重命名，避免读到写了一半的文件"""
+    tmp_path = file_path + '.part'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+    except Exception as e:
+        print(f"文件归档失败: {file_path}: {e}")
+
+def read_uploaded_file(file, subfolder='uploads'):
+    """
+    读取上传文件的字节，并在后台线程中归档原始文件
+
+    返回 (归档路径, 文件字节)；归档路径立即可用于记录，文件稍后写入磁盘
+    """
+    if not allowed_file(file.filename):
+        raise Exception('不支持的文件类型')
+    
+    data = file.read()
+    file_path = generate_upload_path(file.filename, subfolder)
+    _archive_executor.submit(_write_file, file_path, data)
+    
+    return file_path, data
+
+def save_uploaded_file(file, subfolder='uploads', allowed_extensions=None):
+    """保存上传的文件"""
+    if not allowed_file(file.filename, allowed_extensions):
+        raise Exception('不支持的文件类型')
+    
+    file_path = generate_upload_path(file.filename, subfolder)
     file.save(file_path)
     
     return file_path
 
+def iter_archive_images(archive_path):
+    """
+    逐个读取压缩包中的图片文件
+
+    生成 (成员名, 文件字节) 对，跳过目录、非图片文件和超过大小上限的文件
+    """
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not allowed_file(info.filename):
+                    continue
+                if info.file_size > MAX_ARCHIVE_MEMBER_SIZE:
+                    continue
+                yield info.filename, archive.read(info)
+    elif tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path) as archive:
+            for member in archive:
+                if not member.isfile() or not allowed_file(member.name):
+                    continue
+                if member.size > MAX_ARCHIVE_MEMBER_SIZE:
+                    continue
+                yield member.name, archive.extractfile(member).read()
+    else:
+        raise Exception('无法识别的压缩包格式')
@@ -0,0 +1,167 @@
+"""
+Galaxy10 预处理缓存
+一次性把 Galaxy10 DECaLS 的 256x256 原图并行缩放到模型输入尺寸，
+写成uint8内存映射文件，训练时按批读取，不再把整个HDF5文件解码进内存
+
+缓存目录结构：
+    data/galaxy10_cache/
+        images.u8        (N, 69, 69, 3) uint8，行优先
+        labels.npy       (N,) 类别
+        train_idx.npy    训练集下标（70%）
+        val_idx.npy      验证集下标（15%）
+        test_idx.npy     测试集下标（15%）
+        meta.json        来源文件、图片数、尺寸等
+"""
+import json
+import multiprocessing
+import os
+import time
+from datetime import datetime
+import numpy as np
+from PIL import Image
+
+CACHE_DIR = os.getenv('GALAXY10_CACHE_DIR', 'data/galaxy10_cache')
+IMAGE_SIZE = (69, 69)
+
+
+def split_indices(labels, seed=42):
+    """分层划分训练/验证/测试集下标（70% / 15% / 15%），固定随机种子"""
+    from sklearn.model_selection import train_test_split
+
+    indices = np.arange(len(labels))
+    train_idx, temp_idx = train_test_split(
+        indices, test_size=0.3, random_state=seed, stratify=labels
+    )
+    val_idx, test_idx = train_test_split(
+        temp_idx, test_size=0.5, random_state=seed, stratify=labels[temp_idx]
+    )
+    return train_idx, val_idx, test_idx
+
+
+def _resize_chunk(args):
+    """子进程：读取一段原图，缩放后直接写入共享的内存映射文件"""
+    data_path, images_path, start, end, total, size = args
+    import h5py
+
+    frame = np.memmap(images_path, dtype=np.uint8, mode='r+', shape=(total, size[1], size[0], 3))
+    with h5py.File(data_path, 'r') as F:
+        chunk = F['images'][start:end]
+    for i, image in enumerate(chunk):
+        img = Image.fromarray(image)
+        if img.size != size:
+            # 与线上预处理（utils.image_preprocess）使用相同的缩放方式
+            img = img.resize(size, reducing_gap=3.0)
+        frame[start + i] = np.asarray(img.convert('RGB'))
+    frame.flush()
+    return end - start
+
+
+def _source_info(data_path):
+    stat = os.stat(data_path)
+    return {'source': os.path.abspath(data_path), 'source_size': stat.st_size, 'source_mtime': stat.st_mtime}
+
+
+def build_cache(data_path='Galaxy10_DECals.h5', cache_dir=CACHE_DIR, size=IMAGE_SIZE,
+                chunk_size=512, workers=None):
+    """
+    构建预处理缓存
+
+    按 chunk_size 张一段分给进程池并行解码缩放，各进程直接写入同一个内存映射文件，
+    主进程只保存标签和下标，内存占用与数据集大小无关
+    """
+    import h5py
+
+    if not os.path.exists(data_path):
+        raise FileNotFoundError(
+            f"数据集文件 {data_path} 不存在。\n"
+            "请从以下链接下载Galaxy10 DECaLS数据集：\n"
+            "https://astronn.readthedocs.io/en/latest/galaxy10.html"
+        )
+
+    with h5py.File(data_path, 'r') as F:
+        total = F['images'].shape[0]
+        labels = np.array(F['ans'])
+
+    os.makedirs(cache_dir, exist_ok=True)
+    images_path = os.path.join(cache_dir, 'images.u8')
+    tmp_path = images_path + '.part'
+    np.memmap(tmp_path, dtype=np.uint8, mode='w+', shape=(total, size[1], size[0], 3)).flush()
+
+    print(f"正在构建预处理缓存：{total} 张图片 -> {cache_dir}")
+    started = time.time()
+    tasks = [
+        (data_path, tmp_path, start, min(start + chunk_size, total), total, tuple(size))
+        for start in range(0, total, chunk_size)
+    ]
+    done = 0
+    with multiprocessing.get_context('spawn').Pool(workers or os.cpu_count()) as pool:
+        for count in pool.imap_unordered(_resize_chunk, tasks):
+            done += count
+            print(f"  已处理 {done}/{total}", end='\r')
+    print()
+    os.replace(tmp_path, images_path)
+
+    train_idx, val_idx, test_idx = split_indices(labels)
+    np.save(os.path.join(cache_dir, 'labels.npy'), labels)
+    np.save(os.path.join(cache_dir, 'train_idx.npy'), train_idx)
+    np.save(os.path.join(cache_dir, 'val_idx.npy'), val_idx)
+    np.save(os.path.join(cache_dir, 'test_idx.npy'), test_idx)
+
+    meta = {
+        **_source_info(data_path),
+        'count': int(total),
+        'shape': [size[1], size[0], 3],
+        'num_classes': int(labels.max()) + 1,
+        'created_at': datetime.now().isoformat()
+    }
+    with open(os.path.join(cache_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    print(f"预处理缓存构建完成，耗时 {time.time() - started:.1f}s")
+    return meta
+
+
+class Galaxy10Cache:
+    """只读访问预处理缓存，images 为内存映射，按需从磁盘读取"""
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.images = np.memmap(os.path.join(cache_dir, 'images.u8'), dtype=np.uint8, mode='r',
+                                shape=(self.meta['count'], *self.meta['shape']))
+        self.labels = np.load(os.path.join(cache_dir, 'labels.npy'))
+        self.num_classes = self.meta.get('num_classes', 10)
+        self.splits = {
+            name: np.load(os.path.join(cache_dir, f'{name}_idx.npy'))
+            for name in ('train', 'val', 'test')
+        }
+
+    def __len__(self):
+        return self.meta['count']
+
+    def batch(self, indices):
+        """读取一批图片，返回 (float32图片 [0, 1], 类别)；下标先排序以便顺序读盘"""
+        indices = np.asarray(indices)
+        order = np.argsort(indices)
+        images = np.empty((len(indices),) + self.images.shape[1:], dtype=np.float32)
+        images[order] = self.images[indices[order]]
+        images *= 1.0 / 255.0
+        return images, self.labels[indices]
+
+
+def load_cache(data_path='Galaxy10_DECals.h5', cache_dir=CACHE_DIR, rebuild=False):
+    """打开预处理缓存；缓存不存在或来源文件已变化时先构建"""
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if not rebuild and os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        # 原始数据集不在本机时直接使用已有缓存
+        if not os.path.exists(data_path) or all(
+                meta.get(key) == value for key, value in _source_info(data_path).items()
+                if key != 'source'):
+            return Galaxy10Cache(cache_dir)
+        print("数据集文件已变化，重新构建预处理缓存")
+
+    build_cache(data_path, cache_dir)
+    return Galaxy10Cache(cache_dir)
@@ -0,0 +1,176 @@
+"""
+外部HTTP接口的共享客户端
+连接池复用keep-alive连接，统一设置连接/读取超时，对5xx与429做有上限的带抖动重试，
+multipart请求体按块从文件读取，不把整个文件读入内存
+"""
+import mimetypes
+import os
+import random
+import threading
+import uuid
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 触发重试的状态码
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# 单次重试等待的上限（秒）
+MAX_BACKOFF = 10.0
+
+
+class JitterRetry(Retry):
+    """
+    指数退避加随机抖动：第 n 次重试等待 backoff_factor * 2^(n-1) 的 50%~100%，
+    避免多个进程同时失败后又同时重试；响应带 Retry-After 时以其为准
+    """
+
+    def get_backoff_time(self):
+        attempts = len(self.history)
+        if attempts == 0:
+            return 0
+        backoff = min(self.backoff_factor * (2 ** (attempts - 1)), MAX_BACKOFF)
+        return random.uniform(backoff / 2, backoff)
+
+
+class MultipartFile:
+    """
+    流式 multipart/form-data 请求体
+
+    表单字段与文件内容按需分块读取；实现了 seek/tell，
+    重试时 urllib3 会回绕到开头重新发送。file 可以是文件路径或可 seek 的二进制文件对象
+    """
+
+    def __init__(self, fields, file_field, file, filename=None, content_type=None):
+        self.boundary = uuid.uuid4().hex
+        if isinstance(file, (str, os.PathLike)):
+            filename = filename or os.path.basename(file)
+            file = open(file, 'rb')
+        filename = filename or getattr(file, 'name', None) or file_field
+        content_type = content_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        head = b''.join(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+            for name, value in (fields or {}).items()
+        )
+        head += (
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+            f'filename="{filename}"\r\nContent-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+        self._file = file
+        file_size = file.seek(0, os.SEEK_END)
+        # (起始偏移, 长度, 内容)，内容为 bytes 或文件对象
+        self._segments = [
+            (0, len(head), head),
+            (len(head), file_size, self._file),
+            (len(head) + file_size, len(tail), tail)
+        ]
+        self.len = len(head) + file_size + len(tail)
+        self._pos = 0
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return self.len
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._pos
+        elif whence == os.SEEK_END:
+            offset += self.len
+        self._pos = min(max(offset, 0), self.len)
+        return self._pos
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len - self._pos
+        chunks = []
+        while size > 0 and self._pos < self.len:
+            start, length, content = next(s for s in self._segments if s[0] <= self._pos < s[0] + s[1])
+            offset = self._pos - start
+            count = min(size, length - offset)
+            if isinstance(content, bytes):
+                chunk = content[offset:offset + count]
+            else:
+                content.seek(offset)
+                chunk = content.read(count)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            self._pos += len(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HTTPClient:
+    """
+    线程安全的共享HTTP客户端
+
+    所有线程共用同一个连接池适配器（urllib3连接池本身是线程安全的），
+    每个线程持有各自的 requests.Session，避免并发修改 Cookie 等会话状态
+    """
+
+    def __init__(self, pool_size=16, max_retries=3, backoff_factor=0.5,
+                 connect_timeout=3.05, read_timeout=30.0):
+        self.timeout = (connect_timeout, read_timeout)
+        self.adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            max_retries=JitterRetry(
+                total=max_retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=RETRY_STATUS,
+                allowed_methods=None,          # 检测接口是幂等的，POST 也重试
+                respect_retry_after_header=True,
+                raise_on_status=False          # 重试用尽后返回最后一次响应，由调用方处理
+            )
+        )
+        self._local = threading.local()
+
+    @classmethod
+    def from_env(cls, prefix):
+        """按 <prefix>_POOL_SIZE / _MAX_RETRIES / _CONNECT_TIMEOUT / _READ_TIMEOUT 环境变量创建"""
+        return cls(
+            pool_size=int(os.getenv(f'{prefix}_POOL_SIZE', 16)),
+            max_retries=int(os.getenv(f'{prefix}_MAX_RETRIES', 3)),
+            connect_timeout=float(os.getenv(f'{prefix}_CONNECT_TIMEOUT', 3.05)),
+            read_timeout=float(os.getenv(f'{prefix}_READ_TIMEOUT', 30))
+        )
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self.adapter.close()
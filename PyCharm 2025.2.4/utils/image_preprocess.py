@@ -0,0 +1,26 @@
+"""
+图片预处理工具
+"""
+import io
+import numpy as np
+from PIL import Image
+
+def load_image_tensor(source, size=(69, 69)):
+    """
+    将图片解码为 (高, 宽, 3) 的float32数组，取值范围[0, 1]
+
+    source 可以是文件路径、文件对象或图片字节。
+    JPEG 使用 draft 模式在解码阶段按 1/2、1/4、1/8 缩小，大图不必完整解码；
+    其他格式在缩放时先做整数倍降采样（reducing_gap），再做插值
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+
+    img = Image.open(source)
+    img.draft('RGB', size)
+    img = img.convert('RGB')
+    img = img.resize(size, reducing_gap=3.0)
+
+    tensor = np.asarray(img, dtype=np.float32)
+    tensor *= 1.0 / 255.0
+    return tensor
@@ -0,0 +1,211 @@
+"""
+近重复图片结果缓存
+按感知哈希（pHash）的汉明距离查找之前处理过的相似图片，命中时直接复用其结果；
+多个候选时取 pHash 与 dHash 距离之和最小的一个
+
+优先使用Redis（多个Web进程共享），Redis不可用时退回到进程内的BK树
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from utils.perceptual_hash import BKTree, HASH_BITS, hamming, to_hex, from_hex
+
+
+class LocalNearDuplicateIndex:
+    """进程内索引：BK树检索 + 按最近使用顺序淘汰（带TTL，线程安全）"""
+
+    def __init__(self, max_entries=10000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()     # 键 -> (过期时间, pHash, dHash, 结果)
+        self._tree = BKTree()
+        self._removed = 0
+        self._lock = threading.Lock()
+
+    def _evict(self, key):
+        _, ph, _, _ = self._entries.pop(key)
+        self._tree.remove(ph, key)
+        self._removed += 1
+        # 被删除的节点较多时重建，保持检索效率
+        if self._removed > max(len(self._entries), 1000):
+            self._tree = BKTree()
+            for entry_key, (_, entry_ph, _, _) in self._entries.items():
+                self._tree.add(entry_ph, entry_key)
+            self._removed = 0
+
+    def lookup(self, ph, dh, max_distance):
+        """返回 (结果, pHash距离) 或 None"""
+        now = time.time()
+        with self._lock:
+            best = None
+            for distance, key in self._tree.search(ph, max_distance):
+                expires_at, _, entry_dh, value = self._entries[key]
+                if expires_at is not None and expires_at < now:
+                    self._evict(key)
+                    continue
+                score = distance + hamming(dh, entry_dh)
+                if best is None or score < best[0]:
+                    best = (score, key, distance, value)
+            if best is None:
+                return None
+            self._entries.move_to_end(best[1])
+            return best[3], best[2]
+
+    def add(self, key, ph, dh, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (expires_at, ph, dh, value)
+            self._tree.add(ph, key)
+            while len(self._entries) > self.max_entries:
+                self._evict(next(iter(self._entries)))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class NearDuplicateCache:
+    """
+    近重复结果缓存
+
+    Redis 中采用多索引哈希：把64位pHash切成 max_distance+1 段，每段一个桶（集合），
+    由抽屉原理，距离不超过 max_distance 的两个哈希至少有一段完全相同，
+    查询只需取出各段对应桶的并集再逐个计算距离。桶成员为 "键:pHash:dHash"，不必读取结果即可计算距离；
+    结果条目带TTL，容量超过 max_entries 时按最近使用时间淘汰，过期条目在查询时顺带清理出桶
+    """
+
+    def __init__(self, namespace, max_distance=8, max_entries=10000, ttl=None, redis_client=None):
+        self.namespace = namespace
+        self.max_distance = max_distance
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.redis = redis_client
+        self.local = LocalNearDuplicateIndex(max_entries=max_entries, ttl=ttl)
+
+        chunks = min(max_distance + 1, HASH_BITS)
+        widths = [HASH_BITS // chunks + (1 if i < HASH_BITS % chunks else 0) for i in range(chunks)]
+        self._chunks = []
+        shift = HASH_BITS
+        for width in widths:
+            shift -= width
+            self._chunks.append((shift, (1 << width) - 1))
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._hit_distance = 0
+
+    def _key(self, *parts):
+        return ':'.join((self.namespace,) + parts)
+
+    def _buckets(self, ph):
+        return [self._key('mih', str(i), format((ph >> shift) & mask, 'x'))
+                for i, (shift, mask) in enumerate(self._chunks)]
+
+    def _count(self, match):
+        with self._lock:
+            if match is not None:
+                self.hits += 1
+                self._hit_distance += match[1]
+            else:
+                self.misses += 1
+
+    def _error(self):
+        with self._lock:
+            self.errors += 1
+
+    def lookup(self, ph, dh):
+        """查找距离不超过 max_distance 的已缓存结果，返回 (结果, pHash距离) 或 None"""
+        match = None
+        if self.redis is not None:
+            try:
+                match = self._redis_lookup(ph, dh)
+            except Exception:
+                self._error()
+                match = self.local.lookup(ph, dh, self.max_distance)
+        else:
+            match = self.local.lookup(ph, dh, self.max_distance)
+        self._count(match)
+        return match
+
+    def _redis_lookup(self, ph, dh):
+        candidates = []
+        for member in self.redis.sunion(self._buckets(ph)):
+            member = member.decode('utf-8') if isinstance(member, bytes) else member
+            key, member_ph, member_dh = member.rsplit(':', 2)
+            distance = hamming(ph, from_hex(member_ph))
+            if distance <= self.max_distance:
+                candidates.append((distance + hamming(dh, from_hex(member_dh)), distance, key, member))
+        candidates.sort()
+
+        for _, distance, key, member in candidates:
+            value = self.redis.get(self._key('entry', key))
+            if value is None:
+                # 条目已过期，清理索引
+                self._redis_remove(member)
+                continue
+            self.redis.zadd(self._key('lru'), {member: time.time()})
+            return json.loads(value), distance
+        return None
+
+    def _redis_remove(self, member):
+        key, member_ph, _ = member.rsplit(':', 2)
+        pipe = self.redis.pipeline()
+        for bucket in self._buckets(from_hex(member_ph)):
+            pipe.srem(bucket, member)
+        pipe.zrem(self._key('lru'), member)
+        pipe.delete(self._key('entry', key))
+        pipe.execute()
+
+    def add(self, key, ph, dh, value):
+        """加入缓存，value 须可JSON序列化"""
+        if self.redis is not None:
+            try:
+                self._redis_add(str(key), ph, dh, value)
+                return
+            except Exception:
+                self._error()
+        self.local.add(key, ph, dh, value)
+
+    def _redis_add(self, key, ph, dh, value):
+        member = f'{key}:{to_hex(ph)}:{to_hex(dh)}'
+        pipe = self.redis.pipeline()
+        if self.ttl:
+            pipe.setex(self._key('entry', key), int(self.ttl), json.dumps(value, ensure_ascii=False))
+        else:
+            pipe.set(self._key('entry', key), json.dumps(value, ensure_ascii=False))
+        for bucket in self._buckets(ph):
+            pipe.sadd(bucket, member)
+        pipe.zadd(self._key('lru'), {member: time.time()})
+        pipe.zcard(self._key('lru'))
+        count = pipe.execute()[-1]
+
+        if count > self.max_entries:
+            for member, _ in self.redis.zpopmin(self._key('lru'), count - self.max_entries):
+                self._redis_remove(member.decode('utf-8') if isinstance(member, bytes) else member)
+
+    def get_stats(self):
+        """获取命中率统计"""
+        with self._lock:
+            hits, misses, errors, hit_distance = self.hits, self.misses, self.errors, self._hit_distance
+        total = hits + misses
+        entries = len(self.local)
+        if self.redis is not None:
+            try:
+                entries = self.redis.zcard(self._key('lru'))
+            except Exception:
+                pass
+        return {
+            'backend': 'redis' if self.redis is not None else 'local',
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else 0,
+            'avg_hit_distance': round(hit_distance / hits, 2) if hits else None,
+            'errors': errors,
+            'entries': entries,
+            'max_distance': self.max_distance,
+            'ttl': self.ttl
+        }
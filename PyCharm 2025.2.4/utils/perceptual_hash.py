@@ -0,0 +1,124 @@
+"""
+星空照片的感知哈希
+夜空照片的大部分画面是天光渐变、地平线与噪声，直接计算的哈希对不同天区的照片也很接近；
+这里先把图片缩到 256 像素宽，减去高斯模糊估计的背景，只保留星点分布，再计算：
+    pHash：32x32 DCT左上角8x8低频系数与其中位数比较，64位，对重新压缩、缩放、小幅裁剪稳定
+    dHash：9x8 相邻像素亮度梯度方向，64位，对裁剪敏感，用于在多个候选中挑选最接近的
+"""
+import numpy as np
+import cv2
+from PIL import Image
+
+HASH_BITS = 64
+# 计算哈希前的工作分辨率（宽）与背景估计的高斯半径
+WORK_WIDTH = 256
+BACKGROUND_SIGMA = 4
+
+
+def star_map(image_path):
+    """
+    解码为去除背景后的float32灰度图，返回 (星点图, 原图(宽, 高))
+
+    JPEG用draft模式按比例解码，大图不必完整解码
+    """
+    with Image.open(image_path) as img:
+        size = img.size
+        img.draft('L', (WORK_WIDTH * 2, WORK_WIDTH * 2))
+        gray = img.convert('L')
+    height = max(1, round(WORK_WIDTH * gray.height / gray.width))
+    gray = np.asarray(gray.resize((WORK_WIDTH, height), Image.BOX), dtype=np.float32)
+
+    residual = np.clip(gray - cv2.GaussianBlur(gray, (0, 0), BACKGROUND_SIGMA), 0, None)
+    return cv2.GaussianBlur(residual, (0, 0), 2), size
+
+
+def _to_int(bits):
+    return int(np.packbits(bits.astype(np.uint8)).view('>u8')[0])
+
+
+def phash(pixels):
+    """64位pHash：DCT左上角8x8低频系数与其中位数（不含直流分量）比较"""
+    coeffs = cv2.dct(cv2.resize(pixels, (32, 32), interpolation=cv2.INTER_AREA))[:8, :8]
+    return _to_int(coeffs > np.median(coeffs.ravel()[1:]))
+
+
+def dhash(pixels):
+    """64位dHash：每行相邻像素的亮度梯度方向"""
+    cells = cv2.resize(pixels, (9, 8), interpolation=cv2.INTER_AREA)
+    return _to_int(cells[:, 1:] > cells[:, :-1])
+
+
+def image_hashes(image_path):
+    """一次解码计算 (pHash, dHash, 原图(宽, 高))"""
+    pixels, size = star_map(image_path)
+    return phash(pixels), dhash(pixels), size
+
+
+def hamming(a, b):
+    """两个64位哈希的汉明距离"""
+    return bin(a ^ b).count('1')
+
+
+def to_hex(value):
+    return f'{value:016x}'
+
+
+def from_hex(text):
+    return int(text, 16)
+
+
+class BKTree:
+    """
+    按汉明距离组织的BK树，查询距离不超过 d 的所有哈希
+
+    每个节点为 [哈希, 键集合, {距离: 子节点}]；删除只从键集合中移除，
+    空节点保留作路由，删除较多时由调用方重建
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, key):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, {key}, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].add(key)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, {key}, {}]
+                return
+            node = child
+
+    def remove(self, value, key):
+        node = self.root
+        while node is not None:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                if key in node[1]:
+                    node[1].discard(key)
+                    self.size -= 1
+                return
+            node = node[2].get(distance)
+
+    def search(self, value, max_distance):
+        """返回 [(距离, 键)]，按距离升序"""
+        matches = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, key) for key in node[1])
+            # 三角不等式：只有与当前节点距离在 [d - r, d + r] 内的子树可能命中
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda item: item[0])
+        return matches
@@ -0,0 +1,27 @@
+"""
+服务就绪检查工具
+耗时初始化的服务（如模型加载）在此登记就绪检查函数，
+供 /api/health/ready 判断当前进程能否接收流量
+"""
+import threading
+
+_checks = {}
+_lock = threading.Lock()
+
+def register_readiness_check(name, check):
+    """登记就绪检查函数，check 无参数，返回bool"""
+    with _lock:
+        _checks[name] = check
+
+def get_readiness():
+    """获取各服务的就绪状态"""
+    with _lock:
+        checks = dict(_checks)
+
+    status = {}
+    for name, check in checks.items():
+        try:
+            status[name] = bool(check())
+        except Exception:
+            status[name] = False
+    return status
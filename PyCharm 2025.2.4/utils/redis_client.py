@@ -0,0 +1,49 @@
+"""
+Redis连接工具
+"""
+import os
+import threading
+import time
+
+# 连接失败后，间隔多久再尝试重连（秒）
+RECONNECT_INTERVAL = 30
+
+_client = None
+_last_attempt = 0.0
+_lock = threading.Lock()
+
+def get_redis_client():
+    """
+    获取共享的Redis客户端
+
+    使用 REDIS_HOST/REDIS_PORT/REDIS_DB 配置；未安装redis包或连接失败时返回None，
+    调用方应退回到进程内实现
+    """
+    global _client, _last_attempt
+
+    if _client is not None:
+        return _client
+
+    with _lock:
+        if _client is not None:
+            return _client
+        if time.time() - _last_attempt < RECONNECT_INTERVAL:
+            return None
+        _last_attempt = time.time()
+
+        try:
+            import redis
+            client = redis.Redis(
+                host=os.getenv('REDIS_HOST', 'localhost'),
+                port=int(os.getenv('REDIS_PORT', 6379)),
+                db=int(os.getenv('REDIS_DB', 0)),
+                socket_connect_timeout=0.5,
+                socket_timeout=0.5
+            )
+            client.ping()
+            _client = client
+        except Exception as e:
+            print(f"Redis不可用，使用进程内缓存: {e}")
+            _client = None
+
+    return _client
@@ -0,0 +1,141 @@
+"""
+结果缓存工具
+优先使用Redis，Redis不可用时退回到进程内LRU缓存
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalLRUCache:
+    """进程内LRU缓存（带TTL，线程安全）"""
+
+    def __init__(self, max_entries=10000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ResultCache:
+    """
+    带命名空间的字节值缓存
+
+    redis_client 为固定使用的Redis客户端；redis_factory（如 get_redis_client）则在每次读写时获取客户端，
+    创建缓存时Redis不可用、之后恢复的，在工厂的重连间隔后自动切回Redis。两者都为None时只使用进程内LRU；
+    Redis中的条目通过TTL过期，容量淘汰交由Redis的 maxmemory-policy（建议 allkeys-lru）处理
+    """
+
+    def __init__(self, namespace, max_entries=10000, ttl=None, redis_client=None, redis_factory=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self._redis = redis_client
+        self.redis_factory = redis_factory
+        self.local = LocalLRUCache(max_entries=max_entries, ttl=ttl)
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def redis(self):
+        """当前使用的Redis客户端，不可用时为None"""
+        if self._redis is not None or self.redis_factory is None:
+            return self._redis
+        return self.redis_factory()
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key):
+        """读取缓存，未命中返回None"""
+        value = None
+        redis = self.redis
+        if redis is not None:
+            try:
+                value = redis.get(self._key(key))
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+                value = self.local.get(key)
+        else:
+            value = self.local.get(key)
+
+        self._count(value is not None)
+        return value
+
+    def set(self, key, value):
+        """写入缓存"""
+        redis = self.redis
+        if redis is not None:
+            try:
+                if self.ttl:
+                    redis.setex(self._key(key), int(self.ttl), value)
+                else:
+                    redis.set(self._key(key), value)
+                return
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+        self.local.set(key, value)
+
+    def delete(self, key):
+        """删除缓存条目"""
+        redis = self.redis
+        if redis is not None:
+            try:
+                redis.delete(self._key(key))
+            except Exception:
+                with self._lock:
+                    self.errors += 1
+        self.local.delete(key)
+
+    def get_stats(self):
+        """获取命中率统计"""
+        with self._lock:
+            hits, misses, errors = self.hits, self.misses, self.errors
+        total = hits + misses
+        return {
+            'backend': 'redis' if self.redis is not None else 'local',
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else 0,
+            'errors': errors,
+            'local_entries': len(self.local),
+            'ttl': self.ttl
+        }